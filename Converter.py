@@ -1,8 +1,33 @@
-import docx
+import argparse
+import base64
+import collections
+import concurrent.futures
+import contextlib
+import cProfile
+import filecmp
+import functools
+import gzip
+import hashlib
+import html
+import io
+import itertools
 import re
 import json
 import os
+import posixpath
+import pstats
+import struct
+import sys
 import time
+import unicodedata
+import urllib.parse
+import zipfile
+import xml.etree.ElementTree as ET
+
+try:
+    import docx  # Only needed by the fallback reader
+except ImportError:
+    docx = None
 
 # ==========================================
 # CONFIGURATION
@@ -143,6 +168,8 @@ HTML_TEMPLATE = """
         /* Text Styling */
         h1 { padding-bottom: 10px; font-size: 1.8rem; margin-top: 0; }
         p { font-size: 1.1rem; line-height: 1.8; margin-bottom: 20px; }
+        .scene-image { max-width: 100%; height: auto; vertical-align: middle; }
+        .scene-figure { display: block; margin: 0 auto; border-radius: 4px; }
 
         /* Choices Container (Inside the scroll area) */
         #choices-container {
@@ -249,6 +276,17 @@ HTML_TEMPLATE = """
             background: #555;
             color: white;
         }
+        #more-saves-btn {
+            width: 100%;
+            margin-top: 10px;
+            padding: 8px;
+            border: 1px dashed #555;
+            background: transparent;
+            color: #999;
+            border-radius: 4px;
+            cursor: pointer;
+        }
+        #more-saves-btn:hover { color: var(--scene-color, #4ecdc4); border-color: var(--scene-color, #4ecdc4); }
         #save-input-group {
             display: flex;
             gap: 10px;
@@ -271,6 +309,50 @@ HTML_TEMPLATE = """
             border-radius: 4px;
             cursor: pointer;
         }
+
+        /* --- Search Panel --- */
+        #search-panel {
+            flex-shrink: 0;
+            max-height: 40%;
+            overflow-y: auto;
+            padding: 15px 40px;
+            background: #252525;
+            border-bottom: 1px solid #444;
+        }
+        #search-input {
+            width: 100%;
+            box-sizing: border-box;
+            padding: 10px;
+            border: 1px solid #555;
+            background: #222;
+            color: var(--text-color);
+            border-radius: 4px;
+        }
+        #search-status { font-size: 0.8rem; color: #999; margin-top: 8px; }
+        .search-result { padding: 8px 0; border-bottom: 1px solid #333; cursor: pointer; }
+        .search-result:last-child { border-bottom: none; }
+        .search-result:hover .search-title { color: var(--scene-color, #4ecdc4); }
+        .search-title { font-weight: bold; }
+        .search-snippet { font-size: 0.9rem; color: #999; }
+        .search-snippet mark { background: none; color: var(--scene-color, #4ecdc4); }
+        .search-hit { background: rgba(255, 255, 255, 0.08); transition: background 0.5s; }
+
+        /* --- Performance Overlay --- */
+        #perf-overlay {
+            position: fixed;
+            left: 8px;
+            bottom: 8px;
+            z-index: 2000;
+            max-width: calc(100% - 16px);
+            padding: 6px 8px;
+            background: rgba(0, 0, 0, 0.8);
+            border: 1px solid #444;
+            border-radius: 4px;
+            font: 11px/1.4 var(--font-mono);
+            color: #9f9;
+        }
+        #perf-summary { margin: 0 0 4px; white-space: pre-wrap; }
+        #perf-overlay button { font: inherit; background: #222; color: #ccc; border: 1px solid #555; cursor: pointer; }
     </style>
 </head>
 <body>
@@ -281,6 +363,13 @@ HTML_TEMPLATE = """
             <div id="scene-icon"></div>
         </div>
 
+        <!-- Search Panel (builds with --search only) -->
+        <div id="search-panel" style="display: none;">
+            <input type="search" id="search-input" placeholder="Search the story" oninput="runSearch()">
+            <div id="search-status"></div>
+            <div id="search-results"></div>
+        </div>
+
         <!-- Single Scrolling Area for Text AND Choices -->
         <div id="content-scroll-area">
             <div id="story-content"></div>
@@ -291,6 +380,7 @@ HTML_TEMPLATE = """
         <div id="control-panel">
             <button id="save-btn" onclick="openSaveLoadModal('save')">💾 Save Game</button>
             <div id="status-message">Ready.</div>
+            <button id="search-btn" onclick="toggleSearchPanel()" style="display: none;">🔍 Search</button>
             <button id="load-btn" onclick="openSaveLoadModal('load')">↩️ Load Game</button>
         </div>
     </div>
@@ -305,7 +395,8 @@ HTML_TEMPLATE = """
             
             <div id="slots-container">
                 <div id="slots-list"><!-- Save slots will be inserted here --></div>
-                <p id="no-saves-msg" style="text-align: center; color: #999; margin-top:10px;">No saved games found in local storage.</p>
+                <button id="more-saves-btn" onclick="loadMoreSaveSlots()" style="display: none;">Show older saves</button>
+                <p id="no-saves-msg" style="text-align: center; color: #999; margin-top:10px;">No saved games found.</p>
             </div>
             
             <div id="save-input-group" style="display: none;">
@@ -316,15 +407,58 @@ HTML_TEMPLATE = """
         </div>
     </div>
 
+    <!-- Performance Overlay (--perf builds, or any build opened with ?perf=1) -->
+    <div id="perf-overlay" style="display: none;">
+        <pre id="perf-summary"></pre>
+        <button onclick="exportPerfReport()">Export JSON</button>
+        <button onclick="togglePerfSummary()">Hide</button>
+    </div>
+
+    <!-- Scene shards (sharded payload only) and search index (--search) -->
+    STORY_SHARDS_PLACEHOLDER
+
     <script>
-        // Data injected by Python
+        // Player settings chosen at build time (see PLAYER_DEFAULTS in Converter.py)
+        const playerConfig = PLAYER_CONFIG_PLACEHOLDER;
+        // Timings for the performance overlay, or null when it is off (see perfStart)
+        const perf = (playerConfig.perf || new URLSearchParams(location.search).get('perf') === '1') && window.performance
+            ? { scriptStart: performance.now(), measures: 0, entries: [], totals: {}, last: {} } : null;
+        const PERF_ENTRY_LIMIT = 2000;
+        const storyDataTiming = perfStart('story-data');
+
+        // Data injected by Python:
+        //   titles: scene titles, in document order (display + title lookups)
+        //   scenes: [text, icon, color, choices] per scene, where each choice is
+        //           [label, next] and next is the index of the target scene
+        //           (or the raw target title if it could not be resolved at build time).
+        //           Choices with {if ...} or {set ...} clauses are [label, next,
+        //           condition or 0, effects], compiled to bytecode (see runStoryCode).
+        //   vars: absent if no choice uses variables. Otherwise the variable names,
+        //           which the bytecode refers to by index.
+        //   strings: absent if nothing repeats, and in sidecar and site builds (where
+        //           scenes are separate files). Otherwise the texts, icons, colors and
+        //           choice labels used by several scenes; scenes then hold their index
+        //           in this table in place of the string.
+        //   shards: absent when every scene is inline. Otherwise 'embedded' (one JSON
+        //           block per scene in this page) or 'sidecar' (one script per scene
+        //           in shardPath); scenes are then parsed on first visit. Site
+        //           builds also list the content-hashed shardFiles (whose scenes
+        //           refer to scenes and variables by name) and their
+        //           serviceWorker.
+        //   images: absent without pictures. Otherwise content key -> [src, width,
+        //           height], src being a data: URI or a file in the media folder.
+        //   searchIndex: absent without --search. Otherwise 'embedded' (a JSON block
+        //           in this page) or the URL of a script that calls storySearchIndex().
         const storyData = STORY_DATA_PLACEHOLDER;
+        perfEnd(storyDataTiming, { scenes: storyData.titles.length });
         const defaultColor = "#4ecdc4"; // Cyan fallback
         const defaultIcon = '💠'; // Diamond fallback
         
         // --- Game State and Local Storage Key ---
-        let currentSceneId = '';
-        const SAVE_KEY = 'interactive_novel_saves'; // Key remains the same for continuity
+        let currentSceneId = ''; // Scene title, kept in saves for compatibility
+        let currentSceneIndex = -1;
+        let currentView = null; // Rendered view of the current scene (see buildSceneView)
+        const SAVE_KEY = 'interactive_novel_saves'; // Key remains the same for continuity (also the IndexedDB name)
         
         // --- Utility Functions ---
 
@@ -344,18 +478,559 @@ HTML_TEMPLATE = """
             return date.toLocaleDateString() + ' ' + date.toLocaleTimeString();
         }
 
+        // --- Performance Instrumentation (opt-in) ---
+        // Builds with --perf, and any build opened with ?perf=1, time the hot paths:
+        // evaluating the story data, parsing and loading shards, initializeGame,
+        // showScene (and the frame that shows the scene), loadSaveSlots and every call
+        // to the save store and localStorage. Each timing is a performance.measure(),
+        // so it also appears in the browser's performance panel. The overlay shows the
+        // latest timings, the DOM size and the size of the save store, and "Export
+        // JSON" downloads all of it. When instrumentation is off, perfStart() returns
+        // null and perfEnd(null) does nothing.
+
+        function perfStart(name) {
+            if (!perf) return null;
+            return { name, start: performance.now() };
+        }
+
+        // Record the time since perfStart() as `name` (default: the name it was started with)
+        function perfEnd(timing, detail, name = timing && timing.name) {
+            if (!timing) return;
+            // From the start time rather than a mark: a timing can end more than once
+            // (showScene, then scene-paint), and no marks pile up in the browser's buffer
+            try {
+                performance.measure(name, { start: timing.start });
+            } catch (e) {
+                // Browsers without measure options still get the overlay and the export
+            }
+            if (++perf.measures > PERF_ENTRY_LIMIT) {
+                performance.clearMeasures();
+                perf.measures = 0;
+            }
+            perfRecord(Object.assign({ name, start: timing.start, duration: performance.now() - timing.start }, detail));
+        }
+
+        // Time a call; a promise it returns is timed until it settles
+        function perfTimed(name, call, detail) {
+            const timing = perfStart(name);
+            const result = call();
+            if (timing && result && typeof result.then === 'function') {
+                return result.finally(() => perfEnd(timing, detail));
+            }
+            perfEnd(timing, detail);
+            return result;
+        }
+
+        function perfRecord(entry) {
+            entry.start = Math.round(entry.start * 100) / 100;
+            entry.duration = Math.round(entry.duration * 100) / 100;
+            perf.entries.push(entry);
+            if (perf.entries.length > PERF_ENTRY_LIMIT) perf.entries.shift();
+            const total = perf.totals[entry.name] || (perf.totals[entry.name] = { count: 0, total: 0, max: 0 });
+            total.count++;
+            total.total += entry.duration;
+            total.max = Math.max(total.max, entry.duration);
+            perf.last[entry.name] = entry;
+            if (!perf.overlayQueued) {
+                // Redrawn a few times a second at most, so it does not skew the timings
+                perf.overlayQueued = true;
+                setTimeout(renderPerfOverlay, 250);
+            }
+        }
+
+        function perfNodeCount() {
+            return document.getElementsByTagName('*').length;
+        }
+
+        // Saves, their size as JSON, and what the browser reports for the whole origin
+        async function perfStoreSize() {
+            const store = await getSaveStore();
+            const { slots } = await store.unwrapped.page(0, Infinity);
+            const size = { backend: store.backend, saves: slots.length, bytes: new Blob([JSON.stringify(slots)]).size };
+            if (navigator.storage && navigator.storage.estimate) {
+                const { usage, quota } = await navigator.storage.estimate();
+                Object.assign(size, { originUsage: usage, originQuota: quota });
+            }
+            return size;
+        }
+
+        function refreshPerfStoreSize() {
+            perfStoreSize().then((size) => { perf.storeSize = size; renderPerfOverlay(); },
+                                 (e) => console.warn('Could not measure the save store:', e));
+        }
+
+        // Measuring reads every save, so after a change the size is only measured
+        // again once the store has been left alone for a while, when the browser is idle
+        const PERF_STORE_SIZE_DELAY_MS = 2000;
+        function perfStoreChanged() {
+            clearTimeout(perf.storeSizeTimer);
+            perf.storeSizeTimer = setTimeout(() => whenIdle(refreshPerfStoreSize), PERF_STORE_SIZE_DELAY_MS);
+        }
+
+        function renderPerfOverlay() {
+            perf.overlayQueued = false;
+            const ms = (name) => perf.last[name] ? `${perf.last[name].duration.toFixed(1)} ms` : '-';
+            const scene = perf.last.showScene;
+            const complete = perf.last['scene-complete'];
+            const store = perf.storeSize;
+            const lines = [
+                `script start ${perf.scriptStart.toFixed(0)} ms · story data ${ms('story-data')} · init ${ms('initializeGame')}`,
+                scene ? `scene ${scene.scene}${scene.cached ? ' (cached)' : ''}: show ${ms('showScene')} · ` +
+                        `painted ${ms('scene-paint')}` + (complete && complete.scene === scene.scene ? ` · complete ${ms('scene-complete')}` : '') : '',
+                `DOM ${perfNodeCount()} nodes` + (store ? ` · ${store.saves} save(s), ${(store.bytes / 1024).toFixed(1)} KB in ${store.backend}` : ''),
+            ];
+            for (const [name, total] of Object.entries(perf.totals)) {
+                if (total.count > 1) {
+                    lines.push(`${name} ×${total.count}: avg ${(total.total / total.count).toFixed(1)} · max ${total.max.toFixed(1)} ms`);
+                }
+            }
+            document.getElementById('perf-summary').textContent = lines.filter(Boolean).join('\\n');
+        }
+
+        window.togglePerfSummary = function() {
+            const summary = document.getElementById('perf-summary');
+            summary.style.display = summary.style.display === 'none' ? '' : 'none';
+        };
+
+        // Everything measured so far (also callable from a remote debugging console)
+        window.playerPerfReport = async function() {
+            const navigation = performance.getEntriesByType('navigation')[0];
+            const round = (value) => Math.round(value * 100) / 100;
+            return {
+                page: location.href,
+                created: new Date().toISOString(),
+                userAgent: navigator.userAgent,
+                device: {
+                    cpus: navigator.hardwareConcurrency,
+                    memoryGB: navigator.deviceMemory,
+                    connection: navigator.connection && navigator.connection.effectiveType,
+                    viewport: [window.innerWidth, window.innerHeight, window.devicePixelRatio],
+                },
+                story: { scenes: storyData.titles.length, payload: storyData.shards || 'inline', search: Boolean(storyData.searchIndex) },
+                config: playerConfig,
+                scriptStart: round(perf.scriptStart),
+                navigation: navigation && {
+                    transferSize: navigation.transferSize,
+                    decodedBodySize: navigation.decodedBodySize,
+                    responseEnd: round(navigation.responseEnd),
+                    domInteractive: round(navigation.domInteractive),
+                    domContentLoaded: round(navigation.domContentLoadedEventEnd),
+                    load: round(navigation.loadEventEnd),
+                },
+                paint: Object.fromEntries(performance.getEntriesByType('paint').map((e) => [e.name, round(e.startTime)])),
+                domNodes: perfNodeCount(),
+                jsHeapBytes: performance.memory ? performance.memory.usedJSHeapSize : undefined,
+                saveStore: await perfStoreSize().catch((e) => ({ error: String(e) })),
+                summary: Object.fromEntries(Object.entries(perf.totals).map(([name, total]) => [name, {
+                    count: total.count, mean: round(total.total / total.count), max: round(total.max), total: round(total.total),
+                }])),
+                entries: perf.entries,
+            };
+        };
+
+        window.exportPerfReport = async function() {
+            const report = await window.playerPerfReport();
+            const link = document.createElement('a');
+            link.href = URL.createObjectURL(new Blob([JSON.stringify(report, null, 2)], { type: 'application/json' }));
+            link.download = `player-perf-${Date.now()}.json`;
+            document.body.appendChild(link);
+            link.click();
+            link.remove();
+            setTimeout(() => URL.revokeObjectURL(link.href), 1000);
+        };
+
+        function startPerfOverlay() {
+            document.getElementById('perf-overlay').style.display = '';
+            // Main-thread tasks over 50 ms (Chromium only)
+            if (window.PerformanceObserver && (PerformanceObserver.supportedEntryTypes || []).includes('longtask')) {
+                new PerformanceObserver((list) => {
+                    for (const task of list.getEntries()) {
+                        perfRecord({ name: 'longtask', start: task.startTime, duration: task.duration });
+                    }
+                }).observe({ type: 'longtask', buffered: true });
+            }
+            refreshPerfStoreSize();
+        }
+
+        // --- Scene Lookup ---
+
+        // Title -> index map, only needed for saves that store a scene title.
+        // Built once on first use; the first scene wins if two titles collide.
+        let sceneIndexByKey = null;
+
+        function normalizeSceneKey(sceneId) {
+            return String(sceneId).trim().toLowerCase();
+        }
+
+        function findSceneIndex(sceneId) {
+            if (typeof sceneId === 'number') {
+                return sceneId >= 0 && sceneId < storyData.titles.length ? sceneId : -1;
+            }
+            if (!sceneIndexByKey) {
+                sceneIndexByKey = new Map();
+                storyData.titles.forEach((title, index) => {
+                    const k = normalizeSceneKey(title);
+                    if (!sceneIndexByKey.has(k)) sceneIndexByKey.set(k, index);
+                });
+            }
+            const index = sceneIndexByKey.get(normalizeSceneKey(sceneId));
+            return index === undefined ? -1 : index;
+        }
+
+        // Parse an embedded shard the first time its scene is visited
+        function readEmbeddedShard(index) {
+            const block = document.getElementById('scene-shard-' + index);
+            if (!block) return null;
+            const scene = perfTimed('shard-parse', () => JSON.parse(block.textContent),
+                                    { scene: index, chars: block.textContent.length });
+            block.remove(); // The parsed scene replaces its source text
+            return scene;
+        }
+
+        // Sidecar shards call storyShard(index, scene) when their script loads.
+        // Site shards call storyShard(title, scene) with choice targets given by
+        // title and variables by name, so that their content (and content-hashed
+        // URL) stays the same when scenes are added or removed elsewhere; they are
+        // linked to indexes here.
+        const pendingShards = new Map();
+        let shardIndexByTitle = null;
+        let varIndexByName = null;
+
+        window.storyShard = function(id, scene) {
+            if (typeof id === 'string') {
+                if (!shardIndexByTitle) {
+                    shardIndexByTitle = new Map(storyData.titles.map((title, index) => [title, index]));
+                    varIndexByName = new Map((storyData.vars || []).map((name, index) => [name, index]));
+                }
+                id = shardIndexByTitle.get(id);
+                if (id === undefined) return;
+                scene[3] = scene[3].map(([label, next, ...logic]) => {
+                    const target = typeof next === 'string' ? findSceneIndex(next) : -1;
+                    return [label, target < 0 ? next : target,
+                            // The only strings in bytecode are variable names
+                            ...logic.map((code) => code && code.map((value) =>
+                                typeof value === 'string' ? varIndexByName.get(value) : value))];
+                });
+            }
+            storyData.scenes[id] = scene;
+        };
+
+        function fetchSidecarShard(index) {
+            if (!pendingShards.has(index)) {
+                pendingShards.set(index, new Promise((resolve, reject) => {
+                    const timing = perfStart('shard-fetch');
+                    const script = document.createElement('script');
+                    // Site builds name each shard after its content (shardFiles)
+                    const file = storyData.shardFiles ? storyData.shardFiles[index] : `scene-${index}.js`;
+                    script.src = `${storyData.shardPath}/${file}`;
+                    script.onload = () => {
+                        script.remove();
+                        perfEnd(timing, { scene: index });
+                        if (storyData.scenes[index]) return resolve();
+                        pendingShards.delete(index);
+                        reject(new Error("Shard did not define scene " + index));
+                    };
+                    script.onerror = () => {
+                        script.remove();
+                        pendingShards.delete(index); // Allow a retry
+                        reject(new Error("Could not load " + script.src));
+                    };
+                    document.head.appendChild(script);
+                }));
+            }
+            return pendingShards.get(index);
+        }
+
+        // Strings shared by several scenes are stored once, in storyData.strings
+        function storyString(value) {
+            return typeof value === 'number' ? storyData.strings[value] : value;
+        }
+
+        // Returns null while a sidecar shard still has to be fetched
+        function getScene(index) {
+            let raw = storyData.scenes[index];
+            if (!raw && storyData.shards === 'embedded') {
+                raw = storyData.scenes[index] = readEmbeddedShard(index);
+            }
+            if (!raw) return null;
+            const [text, icon, color, choices] = raw;
+            return {
+                title: storyData.titles[index],
+                text: storyString(text),
+                icon: storyString(icon),
+                color: storyString(color),
+                choices: choices.map(([label, next, condition, effects]) =>
+                    [storyString(label), next, condition || null, effects || null]),
+            };
+        }
+
+        // --- Story Variables ---
+        // Choice conditions and effects arrive compiled to a flat stack bytecode
+        // (see compile_condition() in Converter.py), so showing a choice costs one
+        // short loop and nothing is parsed or eval()'d here. Variables are integers,
+        // start at 0 and are addressed by their index in storyData.vars.
+        let storyVars = (storyData.vars || []).map(() => 0);
+
+        // Returns the value left on the stack (conditions) or 0 (effects)
+        function runStoryCode(code) {
+            const stack = [];
+            for (let i = 0; i < code.length; i++) {
+                const op = code[i];
+                if (op === 0) { stack.push(code[++i]); continue; }              // CONST n
+                if (op === 1) { stack.push(storyVars[code[++i]] || 0); continue; } // LOAD var
+                if (op === 2) { storyVars[code[++i]] = stack.pop(); continue; }  // STORE var
+                if (op === 3) { stack.push(stack.pop() ? 0 : 1); continue; }     // NOT
+                if (op === 4) { stack.push(-stack.pop()); continue; }            // NEG
+                const b = stack.pop(), a = stack.pop();
+                switch (op) {
+                    case 5: stack.push(a + b); break;
+                    case 6: stack.push(a - b); break;
+                    case 7: stack.push(a === b ? 1 : 0); break;
+                    case 8: stack.push(a !== b ? 1 : 0); break;
+                    case 9: stack.push(a < b ? 1 : 0); break;
+                    case 10: stack.push(a <= b ? 1 : 0); break;
+                    case 11: stack.push(a > b ? 1 : 0); break;
+                    case 12: stack.push(a >= b ? 1 : 0); break;
+                    case 13: stack.push(a && b ? 1 : 0); break;
+                    case 14: stack.push(a || b ? 1 : 0); break;
+                }
+            }
+            return stack.length ? stack[stack.length - 1] : 0;
+        }
+
+        function choiceAvailable(condition) {
+            return !condition || Boolean(runStoryCode(condition));
+        }
+
+        // Saves keep the variables that are not 0 by name, so they still apply
+        // after the story is rebuilt with variables added or reordered
+        function storyStateByName() {
+            const state = {};
+            (storyData.vars || []).forEach((name, index) => { if (storyVars[index]) state[name] = storyVars[index]; });
+            return state;
+        }
+
+        function restoreStoryState(state) {
+            storyVars = (storyData.vars || []).map((name) => (state && state[name]) || 0);
+        }
+
+        window.restartStory = function() {
+            restoreStoryState(null);
+            window.showScene(0);
+        };
+
+        // Show the choices whose condition holds; with none left, the story ends here
+        function updateChoices(view) {
+            if (!view.conditions) return;
+            let shown = view.unconditional;
+            for (const [btn, condition] of view.conditions) {
+                const available = choiceAvailable(condition);
+                btn.style.display = available ? '' : 'none';
+                if (available) shown++;
+            }
+            view.ending.style.display = shown ? 'none' : '';
+        }
+
+        // --- Pictures ---
+        // Scene text refers to pictures by content key (<img data-image="...">), so a
+        // picture used in many scenes is stored once. The src is filled in here; the
+        // browser only loads or decodes it once it scrolls near the viewport.
+        function resolveImages(root) {
+            if (!storyData.images) return;
+            for (const img of root.querySelectorAll('img[data-image]:not([src])')) {
+                const picture = storyData.images[img.dataset.image];
+                if (!picture) { img.remove(); continue; } // Skipped at build time
+                const [src, width, height] = picture;
+                if (width && height) { img.width = width; img.height = height; } // Reserve the space
+                img.src = src;
+            }
+        }
+
+        // --- Render Cache ---
+        // The DOM built for recently shown scenes (title, text and choice buttons),
+        // least recently used first. Going back to a scene re-attaches its nodes
+        // instead of parsing its HTML again, and the targets of the current scene's
+        // choices are built ahead while the browser is idle. At most
+        // playerConfig.renderCacheSize scenes are kept; 0 turns caching off.
+        const renderCache = new Map();
+        let prefetchGeneration = 0;
+        const whenIdle = window.requestIdleCallback ||
+            ((work) => setTimeout(() => work({ timeRemaining: () => 5 }), 50));
+
+        function buildSceneView(scene) {
+            const content = document.createElement('div');
+            content.innerHTML = `
+                <h1 class="fade-in scene-accent-color scene-accent-border">${scene.title}</h1>
+            `;
+            // Long texts are filled in by renderProgressively() once the view is shown
+            const paragraphs = splitParagraphs(scene.text);
+            const textDiv = document.createElement('div');
+            textDiv.className = "fade-in";
+            if (!paragraphs) {
+                textDiv.innerHTML = scene.text;
+                resolveImages(textDiv);
+            }
+            content.appendChild(textDiv);
+
+            const choices = document.createElement('div');
+            const ending = "<p style='color:#777; text-align:center'>[End of Story]</p><button class='choice-btn' onclick='restartStory()'>Start Over</button>";
+            let conditions = null; // [button, condition] pairs when a choice has a condition
+            if (scene.choices.length === 0) {
+                choices.innerHTML = ending;
+            } else {
+                scene.choices.forEach(([label, next, condition, effects]) => {
+                    const btn = document.createElement('button');
+                    btn.className = "choice-btn fade-in";
+                    btn.innerText = label;
+                    btn.onclick = () => window.showScene(next, effects);
+                    choices.appendChild(btn);
+                    if (condition) (conditions = conditions || []).push([btn, condition]);
+                });
+            }
+            let endingDiv = null; // Shown by updateChoices() when every choice is hidden
+            if (conditions) {
+                endingDiv = document.createElement('div');
+                endingDiv.innerHTML = ending;
+                choices.appendChild(endingDiv);
+            }
+            return {
+                content: Array.from(content.childNodes),
+                choices: Array.from(choices.childNodes),
+                conditions,
+                unconditional: scene.choices.length - (conditions ? conditions.length : 0),
+                ending: endingDiv,
+                textDiv,
+                pending: paragraphs, // Paragraphs still to append (null when complete)
+                next: 0,
+            };
+        }
+
+        function rememberView(index, view) {
+            renderCache.delete(index); // Re-inserting moves it to the most recent end
+            renderCache.set(index, view);
+            while (renderCache.size > playerConfig.renderCacheSize) {
+                renderCache.delete(renderCache.keys().next().value);
+            }
+        }
+
+        function sceneView(index, scene) {
+            const view = renderCache.get(index) || buildSceneView(scene);
+            rememberView(index, view);
+            return view;
+        }
+
+        // Build the views of the scenes the reader can go to next. Stale jobs stop
+        // as soon as the reader moves on; the current scene is never evicted.
+        function prefetchChoices(scene) {
+            const generation = ++prefetchGeneration;
+            const targets = [...new Set(scene.choices.filter(([, , condition]) => choiceAvailable(condition))
+                .map(([, next]) => next))]
+                .filter((next) => typeof next === 'number' && !renderCache.has(next))
+                .slice(0, Math.max(0, playerConfig.renderCacheSize - 1));
+            if (targets.length === 0) return;
+
+            whenIdle(function build(deadline) {
+                while (generation === prefetchGeneration && targets.length && deadline.timeRemaining() > 1) {
+                    const index = targets.shift();
+                    const target = getScene(index);
+                    if (target) {
+                        if (!renderCache.has(index)) rememberView(index, buildSceneView(target));
+                    } else if (storyData.shards === 'sidecar') {
+                        // Fetch the shard now; it is built on a later idle pass
+                        fetchSidecarShard(index).then(() => {
+                            if (generation === prefetchGeneration) { targets.push(index); whenIdle(build); }
+                        }, () => {});
+                    }
+                }
+                if (generation === prefetchGeneration && targets.length) whenIdle(build);
+            });
+        }
+
+        // --- Progressive Rendering ---
+        // Scene text longer than playerConfig.progressiveThreshold characters is not
+        // parsed in one innerHTML assignment. The first screenful of paragraphs is
+        // shown at once, the rest is appended once per animation frame in batches
+        // sized to stay within FRAME_BUDGET_MS, and the choices are attached when the
+        // text is complete. A half-rendered view that is left resumes on return.
+        const FRAME_BUDGET_MS = 8;
+        let renderGeneration = 0;
+
+        function splitParagraphs(text) {
+            const threshold = playerConfig.progressiveThreshold;
+            if (!(threshold > 0) || text.length <= threshold || !text.startsWith('<p>') || !text.endsWith('</p>')) {
+                return null;
+            }
+            return text.slice(3, -4).split('</p><p>');
+        }
+
+        function appendParagraphs(view, count) {
+            const end = Math.min(view.pending.length, view.next + count);
+            view.textDiv.insertAdjacentHTML('beforeend', '<p>' + view.pending.slice(view.next, end).join('</p><p>') + '</p>');
+            view.next = end;
+            resolveImages(view.textDiv);
+        }
+
+        function attachView(view, contentDiv, choicesDiv, scrollArea, timing) {
+            const generation = ++renderGeneration; // Stops the previous scene's batches
+            contentDiv.replaceChildren(...view.content);
+            if (!view.pending) {
+                choicesDiv.replaceChildren(...view.choices);
+                return;
+            }
+            choicesDiv.replaceChildren();
+
+            let batch = 4;
+            while (view.next < view.pending.length && view.textDiv.offsetHeight <= scrollArea.clientHeight) {
+                appendParagraphs(view, batch);
+            }
+            requestAnimationFrame(function frame() {
+                if (generation !== renderGeneration) return;
+                if (view.next < view.pending.length) {
+                    const start = performance.now();
+                    appendParagraphs(view, batch);
+                    const spent = performance.now() - start;
+                    if (spent < FRAME_BUDGET_MS / 2) batch *= 2;
+                    else if (spent > FRAME_BUDGET_MS) batch = Math.max(1, batch >> 1);
+                    requestAnimationFrame(frame);
+                    return;
+                }
+                perfEnd(timing, { scene: currentSceneIndex, paragraphs: view.pending.length }, 'scene-complete');
+                view.pending = null;
+                choicesDiv.replaceChildren(...view.choices);
+            });
+        }
+
         // --- Game Logic ---
         
-        window.showScene = function(sceneId) {
-            let key = Object.keys(storyData).find(k => k.trim().toLowerCase() === sceneId.trim().toLowerCase());
-            if (!key) { 
+        // Accepts a scene index (choices, restarts) or a scene title (saves).
+        // `effects` are the chosen choice's {set ...} bytecode, run once the scene
+        // is actually shown: not while its shard is loading, and not if that fails.
+        let navigationCount = 0; // Only the latest call goes ahead after a shard loads
+        window.showScene = function(sceneId, effects) {
+            const timing = perfStart('showScene');
+            const navigation = ++navigationCount;
+            const index = findSceneIndex(sceneId);
+            if (index < 0) { 
                 console.warn("Scene not found: " + sceneId); 
                 showStatus(`Error: Scene '${sceneId}' not found.`, 'error');
                 return; 
             }
 
-            const scene = storyData[key];
+            const scene = getScene(index);
+            if (!scene) {
+                showStatus('Loading scene...', 'info');
+                fetchSidecarShard(index).then(
+                    () => { if (navigation === navigationCount) window.showScene(index, effects); },
+                    (e) => {
+                        console.error(e);
+                        showStatus(`Error: Could not load scene '${storyData.titles[index]}'.`, 'error');
+                    });
+                return;
+            }
+            if (effects) runStoryCode(effects);
+            const key = scene.title;
             currentSceneId = key; // Update current scene state
+            currentSceneIndex = index;
             
             const scrollArea = document.getElementById('content-scroll-area');
             const contentDiv = document.getElementById('story-content');
@@ -372,68 +1047,219 @@ HTML_TEMPLATE = """
             visualDiv.style.borderColor = accentColor;
             visualDiv.style.background = `linear-gradient(135deg, ${accentColor}AA, #000)`;
 
-            // Render Text
-            contentDiv.innerHTML = `
-                <h1 class="fade-in scene-accent-color scene-accent-border">${key}</h1>
-                <div class="fade-in">${scene.text}</div>
-            `;
-
-            // Render Choices
-            choicesDiv.innerHTML = "";
-            if (scene.choices.length === 0) {
-                choicesDiv.innerHTML = "<p style='color:#777; text-align:center'>[End of Story]</p><button class='choice-btn' onclick='showScene(Object.keys(storyData)[0])'>Start Over</button>";
-            } else {
-                scene.choices.forEach(choice => {
-                    const btn = document.createElement('button');
-                    btn.className = "choice-btn fade-in";
-                    btn.innerText = choice.text;
-                    btn.onclick = () => window.showScene(choice.next);
-                    choicesDiv.appendChild(btn);
-                });
-            }
+            // Render Text and Choices (re-attached from the render cache when possible;
+            // long texts are completed over the next frames)
+            const cached = renderCache.has(index);
+            currentView = sceneView(index, scene);
+            updateChoices(currentView);
+            attachView(currentView, contentDiv, choicesDiv, scrollArea, timing);
 
             // Reset scroll to top
             scrollArea.scrollTop = 0;
             window.closeSaveLoadModal(); // Ensure modal closes when navigating
+            prefetchChoices(scene);
+            if (timing) {
+                perfEnd(timing, { scene: index, cached, nodes: perfNodeCount() });
+                // Until the frame that shows the scene has been painted (approximately)
+                requestAnimationFrame(() => setTimeout(() => perfEnd(timing, { scene: index }, 'scene-paint')));
+            }
         }
 
-        // --- Local Storage Persistence Functions ---
+        // --- Save Store (IndexedDB, with a localStorage fallback) ---
+        // Saves live in an IndexedDB object store indexed by timestamp, so listing a
+        // page of saves or evicting old autosaves never touches the other records.
+        // Browsers without IndexedDB (or with it blocked) keep the old localStorage
+        // array. Saves made by earlier versions are moved over once, on first open.
 
-        function getSaveSlots() {
-            try {
-                const json = localStorage.getItem(SAVE_KEY);
-                return json ? JSON.parse(json) : [];
-            } catch (e) {
-                console.error("Error reading localStorage:", e);
-                return [];
+        const DB_NAME = SAVE_KEY;
+        const DB_STORE = 'saves';
+
+        // Saves from older versions carry no kind; unnamed ones were autosaves
+        function saveKind(slot) {
+            return slot.kind || (String(slot.name).startsWith('AutoSave @') ? 'auto' : 'manual');
+        }
+
+        function requestToPromise(request) {
+            return new Promise((resolve, reject) => {
+                request.onsuccess = () => resolve(request.result);
+                request.onerror = () => reject(request.error);
+            });
+        }
+
+        function createIndexedDbStore(db) {
+            function transaction(mode, work) {
+                return new Promise((resolve, reject) => {
+                    const tx = db.transaction(DB_STORE, mode);
+                    let result;
+                    Promise.resolve(work(tx.objectStore(DB_STORE))).then(r => { result = r; }, reject);
+                    tx.oncomplete = () => resolve(result);
+                    tx.onerror = () => reject(tx.error);
+                    tx.onabort = () => reject(tx.error);
+                });
+            }
+
+            // Walk a cursor: visit(cursor) returns false to stop, a number to skip
+            // ahead that many records, anything else to move to the next record
+            function walk(source, range, direction, visit) {
+                return new Promise((resolve, reject) => {
+                    const request = source.openCursor(range, direction);
+                    request.onsuccess = () => {
+                        const cursor = request.result;
+                        if (!cursor) return resolve();
+                        const next = visit(cursor);
+                        if (next === false) resolve();
+                        else if (typeof next === 'number') cursor.advance(next);
+                        else cursor.continue();
+                    };
+                    request.onerror = () => reject(request.error);
+                });
             }
+
+            return {
+                backend: 'IndexedDB',
+                get: (id) => transaction('readonly', store => requestToPromise(store.get(id))),
+                put: (slot) => transaction('readwrite', store => { store.put(slot); }),
+                remove: (id) => transaction('readwrite', store => { store.delete(id); }),
+
+                // Newest first; returns { slots, hasMore }
+                page: (offset, limit) => transaction('readonly', store => {
+                    const slots = [];
+                    let skip = offset;
+                    return walk(store.index('timestamp'), null, 'prev', cursor => {
+                        if (skip > 0) {
+                            const n = skip;
+                            skip = 0;
+                            return n;
+                        }
+                        slots.push(cursor.value);
+                        return slots.length <= limit; // One extra record tells whether there are more
+                    }).then(() => ({ slots: slots.slice(0, limit), hasMore: slots.length > limit }));
+                }),
+
+                // Delete the oldest autosaves beyond `cap`
+                evictAutosaves: (cap) => transaction('readwrite', store => {
+                    const range = IDBKeyRange.bound(['auto', -Infinity], ['auto', Infinity]);
+                    return requestToPromise(store.index('kind_timestamp').count(range)).then(total => {
+                        let excess = total - cap;
+                        if (excess <= 0) return;
+                        return walk(store.index('kind_timestamp'), range, 'next', cursor => {
+                            cursor.delete();
+                            return --excess > 0;
+                        });
+                    });
+                }),
+            };
         }
-        
-        function saveSaveSlots(slots) {
-             try {
-                localStorage.setItem(SAVE_KEY, JSON.stringify(slots));
-            } catch (e) {
-                console.error("Error writing to localStorage:", e);
-                showStatus("Error: Could not save game. Local storage is full or restricted.", 'error');
+
+        // Same interface over the single localStorage array used by older versions
+        function createLocalStorageStore() {
+            function read() {
+                try {
+                    const json = perfTimed('localStorage.getItem', () => localStorage.getItem(SAVE_KEY));
+                    return json ? JSON.parse(json) : [];
+                } catch (e) {
+                    console.error("Error reading localStorage:", e);
+                    return [];
+                }
+            }
+            function write(slots) {
+                const json = JSON.stringify(slots);
+                perfTimed('localStorage.setItem', () => localStorage.setItem(SAVE_KEY, json), { chars: json.length });
+            }
+            const newestFirst = (a, b) => b.timestamp - a.timestamp;
+
+            return {
+                backend: 'localStorage',
+                get: async (id) => read().find(s => s.id === id),
+                put: async (slot) => write([slot, ...read().filter(s => s.id !== slot.id)]),
+                remove: async (id) => write(read().filter(s => s.id !== id)),
+                page: async (offset, limit) => {
+                    const slots = read().sort(newestFirst);
+                    return { slots: slots.slice(offset, offset + limit), hasMore: slots.length > offset + limit };
+                },
+                evictAutosaves: async (cap) => {
+                    const slots = read().sort(newestFirst);
+                    let autosaves = 0;
+                    write(slots.filter(s => saveKind(s) !== 'auto' || ++autosaves <= cap));
+                },
+            };
+        }
+
+        function openSaveStore() {
+            if (!window.indexedDB) return Promise.resolve(createLocalStorageStore());
+
+            const request = indexedDB.open(DB_NAME, 1);
+            request.onupgradeneeded = () => {
+                const store = request.result.createObjectStore(DB_STORE, { keyPath: 'id' });
+                store.createIndex('timestamp', 'timestamp');
+                store.createIndex('kind_timestamp', ['kind', 'timestamp']);
+            };
+            return requestToPromise(request)
+                .then(db => migrateLocalStorageSaves(createIndexedDbStore(db)))
+                .catch(e => {
+                    console.warn("IndexedDB unavailable, saving to localStorage instead:", e);
+                    return createLocalStorageStore();
+                });
+        }
+
+        async function migrateLocalStorageSaves(store) {
+            const legacy = createLocalStorageStore();
+            const { slots } = await legacy.page(0, Infinity);
+            if (slots.length === 0) return store;
+            for (const slot of slots) {
+                slot.kind = saveKind(slot);
+                await store.put(slot);
             }
+            localStorage.removeItem(SAVE_KEY);
+            console.info(`Moved ${slots.length} save(s) from localStorage to IndexedDB.`);
+            return store;
+        }
+
+        // With instrumentation on, every store call is timed, and changes update the size
+        // shown (see perfStoreChanged)
+        function perfStore(store) {
+            if (!perf) return store;
+            const timed = { backend: store.backend, unwrapped: store };
+            for (const method of ['get', 'put', 'remove', 'page', 'evictAutosaves']) {
+                timed[method] = (...args) => {
+                    const result = perfTimed(`save-store.${method}`, () => store[method](...args), { backend: store.backend });
+                    if (method !== 'get' && method !== 'page') result.then(perfStoreChanged, () => {});
+                    return result;
+                };
+            }
+            return timed;
+        }
+
+        let saveStorePromise = null;
+        function getSaveStore() {
+            if (!saveStorePromise) saveStorePromise = perfTimed('save-store.open', openSaveStore).then(perfStore);
+            return saveStorePromise;
         }
 
-        window.saveGame = function(slotName) {
+        window.saveGame = async function(slotName) {
             if (!currentSceneId) {
                 showStatus("Error: Cannot save empty scene.", 'error');
                 return;
             }
 
-            let slots = getSaveSlots();
             const newSave = {
                 id: Date.now().toString(), // Unique ID
                 name: slotName || `AutoSave @ ${formatTime(Date.now())}`,
+                kind: slotName ? 'manual' : 'auto',
                 timestamp: Date.now(),
-                sceneId: currentSceneId
+                sceneId: currentSceneId,
+                vars: storyStateByName()
             };
 
-            slots.unshift(newSave); // Add to the beginning (most recent first)
-            saveSaveSlots(slots);
+            try {
+                const store = await getSaveStore();
+                await store.put(newSave);
+                if (newSave.kind === 'auto') await store.evictAutosaves(playerConfig.autosaveCap);
+            } catch (e) {
+                console.error("Error writing save:", e);
+                showStatus("Error: Could not save game. Storage is full or restricted.", 'error');
+                return;
+            }
             showStatus(`Game saved as '${newSave.name}'!`, 'success');
             
             loadSaveSlots();
@@ -442,11 +1268,16 @@ HTML_TEMPLATE = """
             window.closeSaveLoadModal(); 
         };
 
-        window.loadGame = function(slotId) {
-            const slots = getSaveSlots();
-            const slot = slots.find(s => s.id === slotId);
+        window.loadGame = async function(slotId) {
+            let slot = null;
+            try {
+                slot = await (await getSaveStore()).get(slotId);
+            } catch (e) {
+                console.error("Error reading save:", e);
+            }
 
             if (slot && slot.sceneId) {
+                restoreStoryState(slot.vars); // Saves from older versions have none
                 window.showScene(slot.sceneId);
                 showStatus(`Game loaded: '${slot.name}'`, 'success');
                 window.closeSaveLoadModal(); // Close after loading
@@ -455,16 +1286,16 @@ HTML_TEMPLATE = """
             }
         };
 
-        window.deleteSlot = function(slotId) {
-            let slots = getSaveSlots();
-            const initialLength = slots.length;
-            slots = slots.filter(s => s.id !== slotId);
-            
-            if (slots.length < initialLength) {
-                saveSaveSlots(slots);
-                showStatus("Save slot deleted.", 'info');
-                loadSaveSlots(); 
+        window.deleteSlot = async function(slotId) {
+            try {
+                await (await getSaveStore()).remove(slotId);
+            } catch (e) {
+                console.error("Error deleting save:", e);
+                showStatus("Error: Could not delete save slot.", 'error');
+                return;
             }
+            showStatus("Save slot deleted.", 'info');
+            loadSaveSlots(); 
         };
 
         // --- Modal Control ---
@@ -478,21 +1309,39 @@ HTML_TEMPLATE = """
                 window.closeSaveLoadModal();
             }
         });
-        function loadSaveSlots() {
-            const slots = getSaveSlots();
+        // The modal lists saves newest first, one page at a time
+        const slotsPage = { offset: 0, generation: 0, loading: false };
+
+        // Show the first page of saves, or append the next page when `more` is set
+        async function loadSaveSlots(more = false) {
             const list = document.getElementById('slots-list');
             const noSavesMsg = document.getElementById('no-saves-msg');
+            const moreBtn = document.getElementById('more-saves-btn');
+            if (more && slotsPage.loading) return;
+
+            const timing = perfStart('loadSaveSlots');
+            const generation = more ? slotsPage.generation : ++slotsPage.generation;
+            const offset = more ? slotsPage.offset : 0;
+            let page;
+            slotsPage.loading = true;
+            try {
+                page = await (await getSaveStore()).page(offset, playerConfig.savesPageSize);
+            } catch (e) {
+                console.error("Error reading saves:", e);
+                page = { slots: [], hasMore: false };
+            } finally {
+                slotsPage.loading = false;
+            }
+            if (generation !== slotsPage.generation) return; // A newer refresh replaced this one
+
             // Only clear the list area so static elements (like the no-saves message)
             // are not accidentally removed from the DOM.
-            list.innerHTML = '';
-            
-            if (slots.length === 0) {
-                noSavesMsg.style.display = 'block';
-                return;
-            }
-            noSavesMsg.style.display = 'none';
+            if (!more) list.innerHTML = '';
+            slotsPage.offset = offset + page.slots.length;
+            noSavesMsg.style.display = slotsPage.offset === 0 ? 'block' : 'none';
+            moreBtn.style.display = page.hasMore ? 'block' : 'none';
 
-            slots.forEach(slot => {
+            page.slots.forEach(slot => {
                 const slotDiv = document.createElement('div');
                 slotDiv.className = 'save-slot';
                 slotDiv.innerHTML = `
@@ -507,12 +1356,17 @@ HTML_TEMPLATE = """
                 `;
                 list.appendChild(slotDiv);
             });
+            perfEnd(timing, { saves: page.slots.length, more });
         }
+
+        window.loadMoreSaveSlots = function() {
+            loadSaveSlots(true);
+        };
         
         window.handleSaveAction = function() {
             const input = document.getElementById('slot-name-input');
-            const slotName = input.value.trim() || `AutoSave @ ${formatTime(Date.now())}`;
-            window.saveGame(slotName);
+            // An empty name makes an autosave (named by time, subject to the autosave cap)
+            window.saveGame(input.value.trim());
             input.value = ''; // Clear input after saving
         }
 
@@ -538,127 +1392,2940 @@ HTML_TEMPLATE = """
             modalOverlay.classList.remove('modal-open');
         };
 
-        // --- Initialization ---
+        // --- Search ---
+        // Builds with --search carry an inverted index (build_search_index() in
+        // Converter.py): the sorted terms, and for each term the (scene, slot) pairs it
+        // occurs in, delta-encoded as base64 VLQ. Slot 0 is the scene title, slot k its
+        // k-th paragraph. The index is loaded on the first search, and a query only
+        // decodes the postings of its own terms instead of scanning storyData.
+        const SEARCH_TOKEN = /([\\u3040-\\u30ff\\u3400-\\u4dbf\\u4e00-\\u9fff\\uf900-\\ufaff\\uac00-\\ud7af\\u{20000}-\\u{2fa1f}]+)|((?:(?![\\u3040-\\u30ff\\u3400-\\u4dbf\\u4e00-\\u9fff\\uf900-\\ufaff\\uac00-\\ud7af\\u{20000}-\\u{2fa1f}])[\\p{L}\\p{N}])+)/gu;
+        const VLQ_DIGITS = 'ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz0123456789+/';
+        const SLOT_STRIDE = 2 ** 24; // A hit is stored as scene * SLOT_STRIDE + slot
+        const SEARCH_RESULT_LIMIT = 50;
+        const SEARCH_PREFIX_TERMS = 200; // Terms a prefix may expand to
+        let searchIndexPromise = null;
+        let searchGeneration = 0;
 
-        function initializeGame() {
-            // Check if there's a quick save to start with
-            const startKey = Object.keys(storyData)[0];
-            if (startKey) window.showScene(startKey);
-            // Ensure the modal is closed on start
-            window.closeSaveLoadModal(); 
+        function loadSearchIndex() {
+            if (!searchIndexPromise) {
+                searchIndexPromise = new Promise((resolve, reject) => {
+                    if (storyData.searchIndex === 'embedded') {
+                        return resolve(JSON.parse(document.getElementById('search-index').textContent));
+                    }
+                    window.storySearchIndex = resolve;
+                    const script = document.createElement('script');
+                    script.src = storyData.searchIndex;
+                    script.onload = () => script.remove();
+                    script.onerror = () => {
+                        script.remove();
+                        searchIndexPromise = null; // Allow a retry
+                        reject(new Error("Could not load " + script.src));
+                    };
+                    document.head.appendChild(script);
+                }).then((index) => ({ terms: index.terms.split(' '), postings: index.postings, decoded: new Map() }));
+            }
+            return searchIndexPromise;
         }
 
-        // Start the application initialization
-        initializeGame();
+        function decodePostings(encoded) {
+            const numbers = [];
+            let value = 0, shift = 0;
+            for (const digit of encoded) {
+                const chunk = VLQ_DIGITS.indexOf(digit);
+                value += (chunk & 31) * 2 ** shift;
+                if (chunk & 32) {
+                    shift += 5;
+                } else {
+                    numbers.push(value);
+                    value = shift = 0;
+                }
+            }
+            // (scene delta, slot) pairs; the slot is a delta too while the scene stays the same
+            const hits = [];
+            let scene = 0, slot = 0;
+            for (let i = 0; i < numbers.length; i += 2) {
+                slot = numbers[i] ? numbers[i + 1] : slot + numbers[i + 1];
+                scene += numbers[i];
+                hits.push(scene * SLOT_STRIDE + slot);
+            }
+            return hits;
+        }
 
-    </script>
-</body>
-</html>
-"""
+        // Terms are sorted by UTF-16 code units, which is how JavaScript compares strings
+        function postingsFor(index, term, prefix) {
+            let low = 0, high = index.terms.length;
+            while (low < high) {
+                const mid = (low + high) >> 1;
+                if (index.terms[mid] < term) low = mid + 1; else high = mid;
+            }
+            const hits = new Set();
+            for (let i = low, n = 0; i < index.terms.length && n < SEARCH_PREFIX_TERMS; i++, n++) {
+                if (prefix ? !index.terms[i].startsWith(term) : index.terms[i] !== term) break;
+                if (!index.decoded.has(i)) index.decoded.set(i, decodePostings(index.postings[i]));
+                index.decoded.get(i).forEach((hit) => hits.add(hit));
+            }
+            return hits;
+        }
 
-# ==========================================
-# PARSER LOGIC
-# ==========================================
+        // The query side of search_tokens() in Converter.py. CJK runs become their
+        // bigrams; a single CJK character, and the last word while it is still being
+        // typed, match every term they start.
+        function queryTerms(query) {
+            const terms = [];
+            const text = query.normalize('NFKC').toLowerCase();
+            for (const match of text.matchAll(SEARCH_TOKEN)) {
+                if (match[2]) {
+                    terms.push({ term: match[2], prefix: false });
+                    continue;
+                }
+                const chars = Array.from(match[1]);
+                if (chars.length === 1) terms.push({ term: chars[0], prefix: true });
+                for (let i = 0; i + 1 < chars.length; i++) terms.push({ term: chars[i] + chars[i + 1], prefix: false });
+            }
+            const last = terms[terms.length - 1];
+            if (last && !/\\s$/.test(query)) last.prefix = true;
+            return terms;
+        }
 
-def parse_docx(filename):
-    if not os.path.exists(filename):
-        print(f"Error: {filename} not found.")
-        return None
+        function plainText(html) {
+            const text = html.replace(/<[^>]*>/g, '');
+            if (!text.includes('&')) return text;
+            const decoder = document.createElement('textarea');
+            decoder.innerHTML = text;
+            return decoder.value;
+        }
 
-    doc = docx.Document(filename)
-    story = {}
-    
-    current_scene = None
-    current_text = []
-    
-    # Regex for metadata: looks for a line starting with 'METADATA:'
-    metadata_line_pattern = re.compile(r"^METADATA\s*:(.*)$", re.IGNORECASE)
-    # Internal regex to parse 'key=value' pairs (handles icon=X, color=#Y)
-    key_value_pattern = re.compile(r"(icon|color)\s*=\s*(.+?)(?:,\s*|\s*$)", re.IGNORECASE)
-    
-    # Regex for choice: [[Text -> Target]] or 【Text -> Target】
-    choice_pattern = re.compile(r"[\[【](.*?)\s*(?:->|=>|→)\s*(.*?)[\]】]")
+        // Plain text of a title or paragraph, or null while its sidecar shard is not loaded
+        function slotText(index, slot) {
+            if (slot === 0) return storyData.titles[index];
+            const scene = getScene(index);
+            if (!scene) return null;
+            const text = scene.text;
+            const paragraphs = text.startsWith('<p>') && text.endsWith('</p>') ? text.slice(3, -4).split('</p><p>') : [text];
+            return plainText(paragraphs[slot - 1] || '');
+        }
 
-    print(f"Reading {filename}...")
+        function searchStory(index, query) {
+            const terms = queryTerms(query);
+            if (terms.length === 0) return [];
+            // Intersect, smallest set first
+            const sets = terms.map(({ term, prefix }) => postingsFor(index, term, prefix)).sort((a, b) => a.size - b.size);
+            let hits = [...sets[0]];
+            for (const set of sets.slice(1)) hits = hits.filter((hit) => set.has(hit));
+            // Bigrams only say the characters occur, not in which order: check longer
+            // CJK phrases against the text wherever it is already loaded
+            const phrases = [...query.normalize('NFKC').toLowerCase().matchAll(SEARCH_TOKEN)]
+                .map((match) => match[1]).filter((run) => run && Array.from(run).length > 2);
+            return hits.sort((a, b) => a - b)
+                .map((hit) => ({ index: Math.floor(hit / SLOT_STRIDE), slot: hit % SLOT_STRIDE }))
+                .filter(({ index, slot }) => {
+                    const text = phrases.length ? slotText(index, slot) : null;
+                    if (text === null) return true;
+                    const normalized = text.normalize('NFKC').toLowerCase();
+                    return phrases.every((phrase) => normalized.includes(phrase));
+                });
+        }
 
-    for para in doc.paragraphs:
-        text = para.text.strip()
-        if not text:
-            continue
-            
-        # 1. Check for Heading 1 (New Scene)
-        if para.style.name.startswith('Heading 1'):
-            # Save previous scene
-            if current_scene:
-                story[current_scene]['text'] = "<p>" + "</p><p>".join(current_text) + "</p>"
-            
-            # Start new scene
-            current_scene = text
-            story[current_scene] = { "text": "", "choices": [], "icon": None, "color": None }
-            current_text = []
-            print(f"Found Scene: {current_scene}")
-        
-        else:
-            if not current_scene: continue
-
-            # 2. Check for Metadata Line (only immediately after a scene title)
-            meta_line_match = metadata_line_pattern.match(text)
-            if meta_line_match and not story[current_scene]['text']: # Only check metadata before main text starts
-                metadata_string = meta_line_match.group(1).strip()
-                
-                # Parse key=value pairs within the metadata string
-                for kv_match in key_value_pattern.finditer(metadata_string):
-                    key = kv_match.group(1).lower()
-                    value = kv_match.group(2).strip()
-
-                    if key == 'icon':
-                        story[current_scene]['icon'] = value
-                    elif key == 'color':
-                        # Simple hex validation
-                        if re.match(r"^#([0-9A-Fa-f]{3}){1,2}$", value):
-                            story[current_scene]['color'] = value.upper()
-                        else:
-                            print(f"  - Warning: Invalid color format '{value}'. Skipping.")
-                
-                continue # Do not add metadata line to story text
-
-            # 3. Check for Choices
-            choices_found = list(choice_pattern.finditer(text))
-            
-            if choices_found:
-                for match in choices_found:
-                    choice_text = match.group(1).strip()
-                    target_scene = match.group(2).strip()
-                    
-                    # Store the choice
-                    story[current_scene]['choices'].append({
-                        "text": choice_text,
-                        "next": target_scene
-                    })
-            else:
-                # 4. Regular Text
-                current_text.append(text)
+        function renderSearchResult({ index, slot }, query) {
+            const item = document.createElement('div');
+            item.className = 'search-result';
+            item.onclick = () => window.openSearchResult(index, slot);
+            const title = document.createElement('div');
+            title.className = 'search-title';
+            title.textContent = storyData.titles[index];
+            item.appendChild(title);
 
-    # Save last scene
-    if current_scene:
-        story[current_scene]['text'] = "<p>" + "</p><p>".join(current_text) + "</p>"
+            const text = slot > 0 ? slotText(index, slot) : null;
+            if (text) {
+                // Show the text around the first word or CJK run of the query
+                const first = query.normalize('NFKC').toLowerCase().match(SEARCH_TOKEN)[0];
+                const at = Math.max(0, text.toLowerCase().indexOf(first));
+                const start = Math.max(0, at - 40);
+                const snippet = document.createElement('div');
+                snippet.className = 'search-snippet';
+                const mark = document.createElement('mark');
+                mark.textContent = text.slice(at, at + first.length);
+                snippet.append((start > 0 ? '…' : '') + text.slice(start, at), mark,
+                               text.slice(at + first.length, at + 120) + (at + 120 < text.length ? '…' : ''));
+                item.appendChild(snippet);
+            }
+            return item;
+        }
+
+        window.runSearch = async function() {
+            const query = document.getElementById('search-input').value;
+            const status = document.getElementById('search-status');
+            const list = document.getElementById('search-results');
+            const generation = ++searchGeneration;
+            let index;
+            try {
+                index = await loadSearchIndex();
+            } catch (e) {
+                console.error(e);
+                status.textContent = 'Error: Could not load the search index.';
+                return;
+            }
+            if (generation !== searchGeneration) return; // The reader kept typing
+
+            const hits = searchStory(index, query);
+            const shown = hits.slice(0, SEARCH_RESULT_LIMIT);
+            status.textContent = !query.trim() ? '' : hits.length === 0 ? 'No matches.' :
+                hits.length > shown.length ? `First ${shown.length} of ${hits.length} matches` : `${hits.length} match(es)`;
+            list.replaceChildren(...shown.map((hit) => renderSearchResult(hit, query)));
+        };
+
+        window.toggleSearchPanel = function() {
+            const panel = document.getElementById('search-panel');
+            const open = panel.style.display === 'none';
+            panel.style.display = open ? 'block' : 'none';
+            if (open) {
+                document.getElementById('search-input').focus();
+                loadSearchIndex().catch(() => {}); // Start loading while the reader types
+            }
+        };
+
+        window.openSearchResult = function(index, slot) {
+            const ready = getScene(index) ? Promise.resolve() : fetchSidecarShard(index);
+            ready.then(() => {
+                window.toggleSearchPanel();
+                window.showScene(index);
+                if (slot === 0 || !currentView) return;
+                // A long scene may not have reached this paragraph yet
+                if (currentView.pending && currentView.next < slot) {
+                    appendParagraphs(currentView, slot - currentView.next);
+                }
+                const paragraph = currentView.textDiv.children[slot - 1];
+                if (!paragraph) return;
+                paragraph.scrollIntoView({ block: 'center' });
+                paragraph.classList.add('search-hit');
+                setTimeout(() => paragraph.classList.remove('search-hit'), 2000);
+            }, (e) => {
+                console.error(e);
+                showStatus(`Error: Could not load scene '${storyData.titles[index]}'.`, 'error');
+            });
+        };
+
+        // --- Live Updates (preview server, see dev_server.py) ---
+        // While the author writes, the preview server pushes the scenes that changed
+        // with every save of the document. They replace their records in storyData
+        // and the scene being read is rendered again at the same scroll position.
+        // A patch with titles replaces the whole story (scenes added, removed or
+        // renamed); the reader then stays on the scene with the same title.
+        function applyStoryPatch(patch) {
+            if (patch.error) return showStatus(patch.error, 'error');
+            let current = Boolean(patch.titles);
+            if (patch.titles) {
+                // Variables may have been added or reordered; keep their values by name
+                const state = storyStateByName();
+                storyData.titles = patch.titles;
+                storyData.scenes = patch.scenes;
+                storyData.vars = patch.vars;
+                restoreStoryState(state);
+                sceneIndexByKey = null;
+                renderCache.clear();
+            } else {
+                for (const [key, scene] of Object.entries(patch.scenes)) {
+                    const index = Number(key);
+                    storyData.scenes[index] = scene;
+                    renderCache.delete(index);
+                    if (index === currentSceneIndex) current = true;
+                }
+            }
+            if (patch.images) {
+                storyData.images = patch.images;
+                renderCache.clear();
+                current = true;
+            }
+            if (!current || currentSceneIndex < 0) return;
+
+            const index = patch.titles ? findSceneIndex(currentSceneId) : currentSceneIndex;
+            if (index < 0) return showStatus(`Scene '${currentSceneId}' is no longer in the story.`, 'error');
+            const scrollArea = document.getElementById('content-scroll-area');
+            const scrollTop = scrollArea.scrollTop;
+            window.showScene(index);
+            scrollArea.scrollTop = scrollTop;
+            showStatus('Story updated.', 'success');
+        }
+
+        function connectLiveUpdates() {
+            const live = playerConfig.liveUpdates;
+            if (!live || !window.EventSource) return;
+            // Reconnects send the last event id, so no update is missed or repeated
+            const events = new EventSource(`${live.url}?version=${live.version}`);
+            events.onmessage = (event) => applyStoryPatch(JSON.parse(event.data));
+        }
+
+        // --- Initialization ---
+
+        function initializeGame() {
+            const timing = perfStart('initializeGame');
+            // Check if there's a quick save to start with
+            if (storyData.titles.length > 0) window.showScene(0);
+            // Open the save store early (this also moves saves from older versions)
+            getSaveStore();
+            // Ensure the modal is closed on start
+            window.closeSaveLoadModal(); 
+            // Site builds: cache the player and visited scenes for offline reading
+            const worker = storyData.serviceWorker;
+            if (worker && 'serviceWorker' in navigator && location.protocol.startsWith('http')) {
+                navigator.serviceWorker.register(worker.script, { scope: worker.scope })
+                    .catch((e) => console.warn('Service worker not registered:', e));
+            }
+            if (storyData.searchIndex) document.getElementById('search-btn').style.display = '';
+            connectLiveUpdates();
+            perfEnd(timing);
+            if (perf) startPerfOverlay();
+        }
+
+        // Start the application initialization
+        initializeGame();
+
+    </script>
+</body>
+</html>
+"""
+
+# ==========================================
+# BUILD METRICS & LOGGING
+# ==========================================
+# Console output goes through log() so --quiet / --verbose apply everywhere.
+# BuildStats times the conversion phases (exclusive time: a nested phase pauses
+# the one around it) and counts what went through them.
+
+QUIET, NORMAL, VERBOSE = 0, 1, 2
+VERBOSITY = NORMAL
+
+
+def log(message, level=NORMAL):
+    if VERBOSITY >= level:
+        print(message)
+
+
+def warn(message):
+    # Warnings and errors are shown even with --quiet
+    log(message, QUIET)
+
+
+class BuildStats:
+    """Phase timings and counters for one conversion."""
+
+    def __init__(self):
+        self.phases = {}
+        self.counters = collections.Counter()
+        self._stack = []
+
+    def _switch(self, now):
+        if self._stack:
+            name, started = self._stack[-1]
+            self.phases[name] = self.phases.get(name, 0.0) + now - started
+
+    @contextlib.contextmanager
+    def phase(self, name):
+        now = time.perf_counter()
+        self._switch(now)
+        self._stack.append((name, now))
+        try:
+            yield
+        finally:
+            now = time.perf_counter()
+            self._switch(now)
+            self._stack.pop()
+            if self._stack:
+                self._stack[-1] = (self._stack[-1][0], now)
+
+    def timed_iter(self, name, iterable):
+        """Charge the time spent producing each item to phase `name`.
+
+        Called once per paragraph, so this avoids the phase() machinery: the time
+        is summed locally and moved out of the consuming phase at the end.
+        """
+        outer = self._stack[-1][0] if self._stack else None
+        clock = time.perf_counter
+        iterator = iter(iterable)
+        spent = 0.0
+        try:
+            while True:
+                start = clock()
+                try:
+                    item = next(iterator)
+                except StopIteration:
+                    return
+                finally:
+                    spent += clock() - start
+                yield item
+        finally:
+            self.phases[name] = self.phases.get(name, 0.0) + spent
+            if outer is not None:
+                self.phases[outer] = self.phases.get(outer, 0.0) - spent
+
+    def count(self, name, amount=1):
+        self.counters[name] += amount
+
+    def as_dict(self):
+        return {
+            "phases": {name: round(seconds, 6) for name, seconds in self.phases.items()},
+            "total_seconds": round(sum(self.phases.values()), 6),
+            "counters": dict(self.counters),
+        }
+
+    def report(self):
+        total = sum(self.phases.values()) or 1.0
+        log("Phase timings:", VERBOSE)
+        for name, seconds in self.phases.items():
+            log(f"  {name:<10} {seconds * 1000:10.1f} ms  {seconds / total:6.1%}", VERBOSE)
+        log("Counters:", VERBOSE)
+        for name, value in self.counters.items():
+            log(f"  {name:<18} {value:>12,}", VERBOSE)
+
+
+NO_PHASE = contextlib.nullcontext()
+
+# ==========================================
+# DOCX READER (Streaming)
+# ==========================================
+# A .docx file is a zip package. Rather than building the full python-docx object
+# model, the body of word/document.xml is streamed once and every top-level
+# paragraph is handed to the parser as a (style name, text) tuple. Inline pictures
+# appear in the text as IMAGE_MARK + content key + IMAGE_MARK (see IMAGES below).
+# With rich text, a format mark precedes every change of bold, italic, underline
+# or strikethrough, so runs that Word split apart but formatted alike arrive as
+# one stretch of text.
+
+W_NS = "{http://schemas.openxmlformats.org/wordprocessingml/2006/main}"
+REL_NS = "{http://schemas.openxmlformats.org/package/2006/relationships}"
+REL_TYPE_DOCUMENT = "http://schemas.openxmlformats.org/officeDocument/2006/relationships/officeDocument"
+REL_TYPE_STYLES = "http://schemas.openxmlformats.org/officeDocument/2006/relationships/styles"
+REL_TYPE_IMAGE = "http://schemas.openxmlformats.org/officeDocument/2006/relationships/image"
+R_NS = "{http://schemas.openxmlformats.org/officeDocument/2006/relationships}"
+A_BLIP = "{http://schemas.openxmlformats.org/drawingml/2006/main}blip"
+V_IMAGEDATA = "{urn:schemas-microsoft-com:vml}imagedata"
+MC_NS = "{http://schemas.openxmlformats.org/markup-compatibility/2006}"
+
+W_BODY = W_NS + "body"
+W_P = W_NS + "p"
+W_R = W_NS + "r"
+W_HYPERLINK = W_NS + "hyperlink"
+W_VAL = W_NS + "val"
+W_PPR = W_NS + "pPr"
+W_PSTYLE = W_NS + "pStyle"
+W_RPR = W_NS + "rPr"
+
+# Run formatting. For rich text the reader puts FORMAT_MARK + flags (a single
+# private-use character, U+E000-U+E00F) in front of every stretch of text whose
+# formatting differs from the stretch before.
+BOLD, ITALIC, UNDERLINE, STRIKE = 1, 2, 4, 8
+FORMAT_MARK = 0xE000
+format_mark_pattern = re.compile("([\ue000-\ue00f])")
+
+# Run children that can hold pictures (DrawingML, legacy VML, and Word's
+# AlternateContent wrapper that stores both)
+PICTURE_TAGS = (W_NS + "drawing", W_NS + "pict", MC_NS + "AlternateContent")
+
+# Text equivalents of run content, matching python-docx's Paragraph.text
+RUN_TEXT = {
+    W_NS + "tab": "\t",
+    W_NS + "ptab": "\t",
+    W_NS + "cr": "\n",
+    W_NS + "noBreakHyphen": "-",
+}
+
+# styles.xml stores built-in styles by their internal name ("heading 1"),
+# python-docx reports the UI name ("Heading 1"). Keep the two readers consistent.
+BUILTIN_STYLE_NAMES = {"caption": "Caption", "footer": "Footer", "header": "Header"}
+BUILTIN_STYLE_NAMES.update({f"heading {n}": f"Heading {n}" for n in range(1, 10)})
+
+
+def _part_rels_path(part_name):
+    folder, _, base = part_name.rpartition("/")
+    return f"{folder}/_rels/{base}.rels" if folder else f"_rels/{base}.rels"
+
+
+def _resolve_target(source_part, target):
+    if target.startswith("/"):
+        return target[1:]
+    folder = source_part.rpartition("/")[0] if source_part else ""
+    return posixpath.normpath(f"{folder}/{target}") if folder else target
+
+
+def _find_related_part(zf, source_part, rel_type, default):
+    """Resolve the target of a package relationship, e.g. the main document part."""
+    rels_path = _part_rels_path(source_part) if source_part else "_rels/.rels"
+    try:
+        rels = ET.fromstring(zf.read(rels_path))
+    except KeyError:
+        return default
+
+    for rel in rels.iter(REL_NS + "Relationship"):
+        if rel.get("Type") == rel_type:
+            return _resolve_target(source_part, rel.get("Target", ""))
+    return default
+
+
+class DocumentImages:
+    """The pictures a document part refers to, by relationship id.
+
+    Each media part is hashed the first time it is referenced, so a picture that
+    is pasted into many scenes (or stored twice by Word) gets a single key.
+    """
+
+    def __init__(self, zf, document_part):
+        self.zf = zf
+        self.parts = {}
+        self._keys = {}
+        try:
+            rels = ET.fromstring(zf.read(_part_rels_path(document_part)))
+        except KeyError:
+            return
+        for rel in rels.iter(REL_NS + "Relationship"):
+            # Linked (not embedded) pictures are left out
+            if rel.get("Type") == REL_TYPE_IMAGE and rel.get("TargetMode") != "External":
+                self.parts[rel.get("Id")] = _resolve_target(document_part, rel.get("Target", ""))
+
+    def key(self, rel_id):
+        part = self.parts.get(rel_id)
+        if part is not None and part not in self._keys:
+            try:
+                with self.zf.open(part) as f:
+                    self._keys[part] = image_key(f)
+            except KeyError:
+                self._keys[part] = None
+        return self._keys.get(part)
+
+    def keyed_parts(self):
+        """Content key -> media part, for every picture of the document."""
+        return { self.key(rel_id): part for rel_id, part in self.parts.items() if self.key(rel_id) }
+
+
+def _load_paragraph_styles(zf, styles_part):
+    """Build the styleId -> style name map once, plus the default paragraph style name."""
+    style_names = {}
+    default_name = "Normal"
+    try:
+        root = ET.fromstring(zf.read(styles_part))
+    except KeyError:
+        return style_names, default_name
+
+    for style in root.iter(W_NS + "style"):
+        if style.get(W_NS + "type") != "paragraph":
+            continue
+        name_el = style.find(W_NS + "name")
+        name = name_el.get(W_VAL) if name_el is not None else None
+        name = BUILTIN_STYLE_NAMES.get(name, name)
+        style_names[style.get(W_NS + "styleId")] = name
+        if style.get(W_NS + "default") in ("1", "true", "on"):
+            default_name = name
+    return style_names, default_name
+
+
+def _picture_tokens(element, parts, images):
+    if element.tag == MC_NS + "AlternateContent":
+        # The Choice and the Fallback hold the same picture; only read one of them
+        choice = element.find(MC_NS + "Choice")
+        element = choice if choice is not None else element.find(MC_NS + "Fallback")
+        if element is None:
+            return
+    for picture in element.iter():
+        rel_id = (picture.get(R_NS + "embed") if picture.tag == A_BLIP else
+                  picture.get(R_NS + "id") if picture.tag == V_IMAGEDATA else None)
+        key = images.key(rel_id) if rel_id else None
+        if key:
+            parts.append(IMAGE_MARK + key + IMAGE_MARK)
+
+
+def _run_text(run, parts, images=None):
+    for child in run:
+        tag = child.tag
+        if tag == W_NS + "t":
+            parts.append(child.text or "")
+        elif tag == W_NS + "br":
+            # Only text-wrapping breaks are line breaks; page/column breaks produce nothing
+            if child.get(W_NS + "type", "textWrapping") == "textWrapping":
+                parts.append("\n")
+        elif tag in RUN_TEXT:
+            parts.append(RUN_TEXT[tag])
+        elif tag in PICTURE_TAGS and images is not None:
+            _picture_tokens(child, parts, images)
+
+
+def _paragraph_text(p, images=None):
+    parts = []
+    for child in p:
+        if child.tag == W_R:
+            _run_text(child, parts, images)
+        elif child.tag == W_HYPERLINK:
+            for run in child.iterfind(W_R):
+                _run_text(run, parts, images)
+    return "".join(parts)
+
+
+# Run properties behind each format flag. w:u is an underline kind rather than a toggle
+RUN_FORMAT_TAGS = {
+    W_NS + "b": BOLD,
+    W_NS + "i": ITALIC,
+    W_NS + "u": UNDERLINE,
+    W_NS + "strike": STRIKE,
+    W_NS + "dstrike": STRIKE,
+}
+TOGGLE_OFF = ("0", "false", "off", "none")
+
+
+def format_mark(flags):
+    return chr(FORMAT_MARK + flags)
+
+
+def _apply_run_properties(rpr, flags):
+    """Format flags after applying one <w:rPr> (or a style's) on top of `flags`."""
+    for prop in rpr:
+        flag = RUN_FORMAT_TAGS.get(prop.tag)
+        if flag:
+            flags = flags & ~flag if prop.get(W_VAL) in TOGGLE_OFF else flags | flag
+    return flags
+
+
+def _load_style_formats(zf, styles_part):
+    """styleId -> format flags of every paragraph and character style, following
+    basedOn; None -> the flags of the default paragraph style."""
+    try:
+        root = ET.fromstring(zf.read(styles_part))
+    except KeyError:
+        return {}
+
+    own, based_on, default_id = {}, {}, None
+    for style in root.iter(W_NS + "style"):
+        if style.get(W_NS + "type") not in ("paragraph", "character"):
+            continue
+        style_id = style.get(W_NS + "styleId")
+        rpr = style.find(W_RPR)
+        own[style_id] = rpr
+        parent = style.find(W_NS + "basedOn")
+        if parent is not None:
+            based_on[style_id] = parent.get(W_VAL)
+        if style.get(W_NS + "type") == "paragraph" and style.get(W_NS + "default") in ("1", "true", "on"):
+            default_id = style_id
+
+    formats = {}
+
+    def resolve(style_id, seen=()):
+        if style_id not in formats:
+            parent = based_on.get(style_id)
+            # A basedOn loop in a damaged document just ends the chain
+            flags = resolve(parent, seen + (style_id,)) if parent in own and parent not in seen else 0
+            rpr = own.get(style_id)
+            formats[style_id] = _apply_run_properties(rpr, flags) if rpr is not None else flags
+        return formats[style_id]
+
+    for style_id in own:
+        resolve(style_id)
+    formats[None] = formats.get(default_id, 0)
+    return formats
+
+
+def _run_format(run, base, formats):
+    rpr = run.find(W_RPR)
+    if rpr is None:
+        return base
+    r_style = rpr.find(W_NS + "rStyle")
+    flags = base | formats.get(r_style.get(W_VAL), 0) if r_style is not None else base
+    return _apply_run_properties(rpr, flags)
+
+
+def _paragraph_rich_text(p, images, formats):
+    """_paragraph_text() with a format mark wherever the formatting changes."""
+    base = formats.get(_paragraph_style_id(p), formats.get(None, 0))
+    parts = []
+    current = 0
+    marked = False
+    for child in p:
+        if child.tag == W_R:
+            runs = (child,)
+        elif child.tag == W_HYPERLINK:
+            runs = child.findall(W_R)
+        else:
+            continue
+        for run in runs:
+            start = len(parts)
+            _run_text(run, parts, images)
+            if len(parts) == start:
+                continue
+            flags = _run_format(run, base, formats)
+            # Spaces between two bold words do not need bold of their own
+            if flags != current and ((flags ^ current) & ~(BOLD | ITALIC) or not "".join(parts[start:]).isspace()):
+                parts.insert(start, format_mark(flags))
+                current = flags
+                marked = True
+    text = "".join(parts)
+    if marked and not format_mark_pattern.sub("", text).strip():
+        # Formatting on an otherwise empty paragraph is dropped along with the paragraph
+        return format_mark_pattern.sub("", text)
+    return text
+
+
+def _paragraph_style_id(p):
+    # Two plain finds: a path expression goes through the much slower ElementPath
+    ppr = p.find(W_PPR)
+    p_style = ppr.find(W_PSTYLE) if ppr is not None else None
+    return p_style.get(W_VAL) if p_style is not None else None
+
+
+def _paragraph_style(p, style_names, default_name):
+    style_id = _paragraph_style_id(p)
+    if style_id is None:
+        return default_name
+    return style_names.get(style_id, default_name)
+
+
+def _iterparse_paragraphs(fh, images, style_names, default_name, formats=None):
+    depth = 0
+    body = None
+    for event, elem in ET.iterparse(fh, events=("start", "end")):
+        if event == "start":
+            depth += 1
+            if depth == 2 and elem.tag == W_BODY:
+                body = elem
+            continue
+
+        depth -= 1
+        # Only direct children of <w:body> count, like python-docx's doc.paragraphs
+        # (paragraphs nested in tables are skipped).
+        if depth == 2 and body is not None:
+            if elem.tag == W_P:
+                style = _paragraph_style(elem, style_names, default_name)
+                # Scene titles stay plain text
+                if formats is None or style and style.startswith("Heading 1"):
+                    yield style, _paragraph_text(elem, images)
+                else:
+                    yield style, _paragraph_rich_text(elem, images, formats)
+            # Drop finished elements so memory stays flat regardless of document length
+            body.clear()
+
+
+def _iterparse_body(zf, document_part, style_names, default_name, formats=None):
+    images = DocumentImages(zf, document_part)
+    with zf, zf.open(document_part) as fh:
+        yield from _iterparse_paragraphs(fh, images, style_names, default_name, formats)
+
+
+def stream_docx_paragraphs(filename, rich_text=False):
+    """Yield (style name, text) for every body paragraph without loading python-docx.
+
+    With rich_text, the text carries format marks (see FORMAT_MARK).
+    """
+    zf = zipfile.ZipFile(filename)
+    try:
+        document_part = _find_related_part(zf, None, REL_TYPE_DOCUMENT, "word/document.xml")
+        styles_part = _find_related_part(zf, document_part, REL_TYPE_STYLES, "word/styles.xml")
+        style_names, default_name = _load_paragraph_styles(zf, styles_part)
+        formats = _load_style_formats(zf, styles_part) if rich_text else None
+        zf.getinfo(document_part)
+    except Exception:
+        zf.close()
+        raise
+    return _iterparse_body(zf, document_part, style_names, default_name, formats)
+
+
+# Parallel reading of one large document: the body is cut into ranges at its
+# Heading 1 paragraphs by a plain byte scan, and every range is parsed on its own
+# as head + range + tail. A cut that lands inside a table or text box leaves tags
+# unclosed, so that range fails to parse instead of being read differently.
+body_open_pattern = re.compile(rb"<w:body\b[^>]*>")
+# Elements that hold paragraphs below the body level; no cut is made inside one
+NESTING_TAGS = (b"w:tbl", b"w:sdt", b"w:txbxContent")
+
+
+def _nesting_change(data, start, end, tags=NESTING_TAGS):
+    """How many more of `tags` are open at `end` than at `start`."""
+    return sum(data.count(b"<%s>" % tag, start, end) + data.count(b"<%s " % tag, start, end)
+               - data.count(b"</%s>" % tag, start, end) for tag in tags)
+
+
+def split_body(filename, ranges, rich_text=False, min_bytes=0):
+    """Cut document.xml into about `ranges` pieces that each start with a Heading 1
+    paragraph (the first starts with the body).
+
+    Returns (document part, reader settings, [range XML]) for read_body_range(),
+    or None if document.xml is smaller than `min_bytes` or cannot be cut.
+    """
+    with zipfile.ZipFile(filename) as zf:
+        document_part = _find_related_part(zf, None, REL_TYPE_DOCUMENT, "word/document.xml")
+        if zf.getinfo(document_part).file_size < min_bytes:
+            return None
+        styles_part = _find_related_part(zf, document_part, REL_TYPE_STYLES, "word/styles.xml")
+        style_names, default_name = _load_paragraph_styles(zf, styles_part)
+        formats = _load_style_formats(zf, styles_part) if rich_text else None
+        data = zf.read(document_part)
+
+    heading_ids = [style_id for style_id, name in style_names.items() if name and name.startswith("Heading 1")]
+    body_open = body_open_pattern.search(data)
+    body_end = data.rfind(b"</w:body>")
+    if not heading_ids or not body_open or body_end < 0:
+        return None
+    head, tail = data[:body_open.end()], data[body_end:]
+
+    heading_pattern = re.compile(rb'<w:pStyle w:val="(?:%s)"' % b"|".join(re.escape(i.encode()) for i in heading_ids))
+    step = (body_end - body_open.end()) // ranges
+    # Most manuscripts have no tables or text boxes at all
+    nesting = [tag for tag in NESTING_TAGS if b"</%s>" % tag in data]
+    cuts = [body_open.end()]
+    checked, depth = cuts[0], 0
+    position = cuts[0] + step
+    while position < body_end:
+        match = heading_pattern.search(data, position, body_end)
+        if not match:
+            break
+        # The paragraph the style belongs to starts at the last <w:p> before it (not <w:pPr>)
+        start = data.rfind(b"<w:p", checked, match.start())
+        while start > checked and data[start + 4:start + 5] not in (b">", b" "):
+            start = data.rfind(b"<w:p", checked, start)
+        if start > checked:
+            depth += _nesting_change(data, checked, start, nesting)
+            checked = start
+            if depth == 0:
+                cuts.append(start)
+        position = max(match.end(), cuts[-1] + step)
+    if len(cuts) == 1:
+        return None
+    cuts.append(body_end)
+
+    settings = (style_names, default_name, formats)
+    return document_part, settings, [head + data[start:end] + tail for start, end in zip(cuts, cuts[1:])]
+
+
+def read_body_range(filename, document_part, settings, xml):
+    """Yield (style name, text) for the paragraphs of one range from split_body()."""
+    zf = zipfile.ZipFile(filename)
+    with zf:
+        yield from _iterparse_paragraphs(io.BytesIO(xml), DocumentImages(zf, document_part), *settings)
+
+
+def _python_docx_paragraphs(filename):
+    # Text only: pictures and formatting are not extracted on this path
+    for para in docx.Document(filename).paragraphs:
+        yield para.style.name, para.text
+
+
+def read_paragraphs(filename, rich_text=False):
+    """Stream paragraphs from the .docx, falling back to python-docx if the package is unusual."""
+    try:
+        return stream_docx_paragraphs(filename, rich_text)
+    except (zipfile.BadZipFile, KeyError, ET.ParseError) as e:
+        if docx is None:
+            raise
+        warn(f"  - Warning: Streaming reader failed ({e}). Falling back to python-docx.")
+        return _python_docx_paragraphs(filename)
+
+# ==========================================
+# PARSE CACHE
+# ==========================================
+# Rebuilds during editing usually touch a single chapter. The cache remembers the
+# hash of the whole source file and, per Heading 1 section, the hash of its
+# paragraphs together with the parsed scene record and the warnings parsing it
+# gave, which are shown again whenever the section is reused.
+
+CACHE_DIR = ".story_cache"
+CACHE_VERSION = 4
+
+
+def file_hash(filename):
+    digest = hashlib.sha256()
+    with open(filename, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _converter_fingerprint():
+    # Any edit to the converter may change how scenes are parsed, so it invalidates the cache
+    with open(os.path.abspath(__file__), "rb") as f:
+        return f"{CACHE_VERSION}:{hashlib.sha256(f.read()).hexdigest()}"
+
+
+class ParseCache:
+    """On-disk cache of parsed scene records for one source document.
+
+    Scenes parsed as rich text differ from plain ones, so each mode has a cache
+    file of its own, and alternating --rich-text and plain builds keeps both.
+    """
+
+    def __init__(self, source_filename, cache_dir=None, rich_text=False):
+        source_filename = os.path.abspath(source_filename)
+        cache_dir = cache_dir or os.path.join(os.path.dirname(source_filename), CACHE_DIR)
+        self.path = os.path.join(cache_dir, os.path.basename(source_filename) + (".rich.json" if rich_text else ".json"))
+        self.media_dir = os.path.join(cache_dir, "media")  # Resized pictures, see prepare_images()
+        self.fingerprint = _converter_fingerprint()
+        self.source_hit = False
+        self.hits = 0
+        self.misses = 0
+        self._source_hash = None
+        self._order = []
+        self._sections = {}
+        self._fresh = {}
+        self._load()
+
+    def _load(self):
+        try:
+            with open(self.path, encoding="utf-8") as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return
+        if data.get("fingerprint") != self.fingerprint:
+            return
+        self._source_hash = data.get("source_hash")
+        self._order = data.get("order", [])
+        self._sections = data.get("sections", {})
+
+    def lookup_source(self, source_hash):
+        """Return the complete cached story if the source file is unchanged,
+        repeating the warnings its sections gave when they were parsed."""
+        if source_hash != self._source_hash or not all(k in self._sections for k in self._order):
+            return None
+        self.source_hit = True
+        self.hits = len(self._order)
+        story = {}
+        for key in self._order:
+            title, record, warnings = self._sections[key]
+            sys.stdout.write(warnings)
+            story[title] = Scene.from_record(record)
+        return story
+
+    def lookup_section(self, key):
+        """(title, scene, warnings) of a cached section, or None."""
+        entry = self._sections.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self._fresh[key] = entry
+        title, record, warnings = entry
+        return title, Scene.from_record(record), warnings
+
+    def store_section(self, key, title, scene, warnings=""):
+        self._fresh[key] = [title, scene.record(), warnings]
+
+    def save(self, source_hash, order):
+        # Only sections of the current document are kept, so the cache never outgrows it
+        data = {
+            "fingerprint": self.fingerprint,
+            "source_hash": source_hash,
+            "order": order,
+            "sections": self._fresh,
+        }
+        try:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            with open(self.path, "w", encoding="utf-8") as f:
+                json.dump(data, f, ensure_ascii=False, separators=(",", ":"))
+        except OSError as e:
+            warn(f"  - Warning: Could not write parse cache ({e}).")
+
+    def report(self):
+        if self.source_hit:
+            log(f"Cache: source unchanged, reused all {self.hits} scenes.")
+        else:
+            log(f"Cache: {self.hits} scenes reused, {self.misses} re-parsed.")
+
+# ==========================================
+# RELEASE BUILD (Minify + Precompress)
+# ==========================================
+# The template is written for humans: comments and indentation make up a good
+# share of a small story's output. Release builds strip them once per run. The
+# minifier is deliberately conservative: line breaks inside scripts are kept so
+# automatic semicolon insertion behaves exactly as in the source.
+
+try:
+    import brotli  # Optional, only needed for .br output
+except ImportError:
+    brotli = None
+
+# After these characters (or at the start), a "/" starts a regex literal, not a division
+JS_REGEX_PREFIX = set("(,=:[!&|?{};+-*%<>~^\n")
+
+
+def _scan_js(source):
+    """Split JavaScript into ('code', text) and ('literal', text) pieces, dropping comments."""
+    pieces = []
+    code = []
+    i, n = 0, len(source)
+
+    def last_significant():
+        for piece in reversed(code):
+            stripped = piece.rstrip(" \t")
+            if stripped:
+                return stripped[-1]
+        return "\n" if not pieces else "x"
+
+    while i < n:
+        c = source[i]
+        nxt = source[i + 1] if i + 1 < n else ""
+        if c == "/" and nxt == "/":
+            end = source.find("\n", i)
+            i = n if end == -1 else end
+        elif c == "/" and nxt == "*":
+            end = source.find("*/", i + 2)
+            i = n if end == -1 else end + 2
+            code.append(" ")
+        elif c in "'\"`" or (c == "/" and last_significant() in JS_REGEX_PREFIX):
+            start = i
+            i += 1
+            in_class = False
+            depth = 0
+            while i < n:
+                ch = source[i]
+                if ch == "\\":
+                    i += 2
+                    continue
+                if c == "`":
+                    if ch == "$" and source[i + 1:i + 2] == "{":
+                        depth += 1
+                    elif ch == "}" and depth:
+                        depth -= 1
+                    elif ch == "`" and not depth:
+                        break
+                elif c == "/":
+                    if ch == "[":
+                        in_class = True
+                    elif ch == "]":
+                        in_class = False
+                    elif ch == "/" and not in_class:
+                        break
+                elif ch == c:
+                    break
+                i += 1
+            i += 1
+            if c == "/":
+                # Regex flags
+                while i < n and (source[i].isalnum() or source[i] == "_"):
+                    i += 1
+            if code:
+                pieces.append(("code", "".join(code)))
+                code = []
+            pieces.append(("literal", source[start:i]))
+        else:
+            code.append(c)
+            i += 1
+
+    if code:
+        pieces.append(("code", "".join(code)))
+    return pieces
+
+
+def minify_js(source):
+    out = []
+    for kind, text in _scan_js(source):
+        if kind == "literal":
+            out.append(text)
+            continue
+        # Collapse whitespace, keeping one line break where there was one
+        text = re.sub(r"[ \t]*\n\s*", "\n", text)
+        text = re.sub(r"[ \t]+", " ", text)
+        # Drop spaces next to punctuation (never line breaks). Binary '+', '-' and
+        # '/' are only tightened between operands, so "a - -b" survives.
+        text = re.sub(r" ?([{}()\[\];,:=<>!&|?*%]) ?", r"\1", text)
+        text = re.sub(r"(?<=[\w)\]]) ([+\-/]) (?=[\w(\[])", r"\1", text)
+        out.append(text)
+
+    return "".join(out).strip()
+
+
+def minify_css(source):
+    source = re.sub(r"/\*.*?\*/", "", source, flags=re.DOTALL)
+    source = re.sub(r"\s+", " ", source)
+    source = re.sub(r" ?([{};,>]) ?", r"\1", source)
+    # "property: value" -> "property:value" (declarations only, selectors keep their spaces)
+    source = re.sub(r"([{;])([\w-]+): ", r"\1\2:", source)
+    return source.replace(";}", "}").strip()
+
+
+def minify_html(template):
+    """Minify the page template (before the story data is injected)."""
+    def replace_block(pattern, minifier):
+        def sub(match):
+            return match.group(1) + minifier(match.group(2)) + match.group(3)
+        return lambda text: re.sub(pattern, sub, text, flags=re.DOTALL)
+
+    # Protect script and style bodies from the markup rules below
+    blocks = []
+    def stash(match):
+        blocks.append(match.group(0))
+        return f"\x00{len(blocks) - 1}\x00"
+
+    html = replace_block(r"(<style>)(.*?)(</style>)", minify_css)(template)
+    html = replace_block(r"(<script>)(.*?)(</script>)", minify_js)(html)
+    html = re.sub(r"<(script|style)\b.*?</\1>", stash, html, flags=re.DOTALL)
+    html = re.sub(r"<!--.*?-->", "", html, flags=re.DOTALL)
+    html = re.sub(r">\s+<", "><", html)
+    html = re.sub(r"\s*\n\s*", "\n", html).strip()
+    return re.sub(r"\x00(\d+)\x00", lambda m: blocks[int(m.group(1))], html)
+
+
+def write_compressed_copies(filename, note=True, changed=True):
+    """Write .gz (and .br when brotli is installed) next to the output. Returns their paths.
+
+    When the output itself did not change, copies already written are kept.
+    """
+    paths = [filename + ".gz"] + ([filename + ".br"] if brotli is not None else [])
+    if not changed and all(os.path.exists(path) for path in paths):
+        return paths
+    with open(filename, "rb") as f:
+        raw = f.read()
+
+    # mtime=0 keeps the .gz byte-identical across rebuilds of the same story
+    outputs = [(filename + ".gz", gzip.compress(raw, compresslevel=9, mtime=0))]
+    if brotli is not None:
+        outputs.append((filename + ".br", brotli.compress(raw, quality=11)))
+    else:
+        if note:
+            log("  - Note: brotli is not installed (pip install brotli). Skipping .br output.")
+        # A .br from a build that had brotli would no longer match
+        remove_compressed_copies(filename, extensions=(".br",))
+
+    for path, data in outputs:
+        with open(path, "wb") as f:
+            f.write(data)
+    return [path for path, _ in outputs]
+
+
+def remove_compressed_copies(filename, extensions=(".gz", ".br")):
+    """Delete .gz/.br copies left by an earlier release build, which a server
+    with precompressed files enabled would otherwise send instead."""
+    for extension in extensions:
+        with contextlib.suppress(FileNotFoundError):
+            os.remove(filename + extension)
+
+
+def report_sizes(paths):
+    width = max(len(p) for p in paths)
+    for path in paths:
+        log(f"  {path:<{width}}  {os.path.getsize(path):>12,} bytes")
+
+# ==========================================
+# PARSER LOGIC
+# ==========================================
+
+# Regex for metadata: looks for a line starting with 'METADATA:'
+metadata_line_pattern = re.compile(r"^METADATA\s*:(.*)$", re.IGNORECASE)
+# Internal regex to parse 'key=value' pairs (handles icon=X, color=#Y)
+key_value_pattern = re.compile(r"(icon|color)\s*=\s*(.+?)(?:,\s*|\s*$)", re.IGNORECASE)
+hex_color_pattern = re.compile(r"^#([0-9A-Fa-f]{3}){1,2}$")
+
+# Regex for choice: [[Text -> Target]] or 【Text -> Target】
+choice_pattern = re.compile(r"[\[【](.*?)\s*(?:->|=>|→)\s*(.*?)[\]】]")
+
+# Paragraph token kinds produced by classify_paragraph()
+HEADING, METADATA, CHOICES, TEXT = "heading", "metadata", "choices", "text"
+
+# Pictures arrive from the reader as IMAGE_MARK + content key + IMAGE_MARK
+# (U+FFFC is the Unicode object replacement character). In story text they
+# become <img> tags that the player points at storyData.images.
+IMAGE_MARK = "\ufffc"
+image_token_pattern = re.compile(IMAGE_MARK + "([0-9a-f]{16})" + IMAGE_MARK)
+IMAGE_HTML = r'<img class="scene-image" data-image="\1" alt="" loading="lazy" decoding="async">'
+# Pictures that make up a whole paragraph are centred illustrations
+FIGURE_HTML = IMAGE_HTML.replace('"scene-image"', '"scene-image scene-figure"')
+image_reference_pattern = re.compile(r'data-image="([0-9a-f]{16})"')
+
+# Rich text (--rich-text): titles, metadata and choices are read without the
+# reader's format marks; story text becomes escaped HTML with tags only where
+# the formatting changes. Outermost tag first, so a change of the inner formats
+# keeps the outer tags open.
+FORMAT_HTML = ((BOLD, "b"), (ITALIC, "i"), (UNDERLINE, "u"), (STRIKE, "s"))
+# Entities typed into the document (&nbsp; for an empty line) are kept; any other & is escaped
+bare_ampersand_pattern = re.compile(r"&(?!(?:[A-Za-z][A-Za-z0-9]*|#[0-9]+|#[xX][0-9A-Fa-f]+);)")
+
+
+def escape_story_text(text):
+    return bare_ampersand_pattern.sub("&amp;", text).replace("<", "&lt;").replace(">", "&gt;")
+
+
+def rich_text_html(text, figure=False):
+    """Escaped HTML for one paragraph of marked text, pictures included.
+
+    Tags are only opened in front of text, so formatting that changes twice
+    without text in between leaves nothing behind, and tags still open stay
+    open across a change that does not concern them.
+    """
+    # Neither escaping nor the <img> tags touch the marks
+    text = escape_story_text(text)
+    if IMAGE_MARK in text:
+        text = image_token_pattern.sub(FIGURE_HTML if figure else IMAGE_HTML, text)
+    if not format_mark_pattern.search(text):
+        return text
+
+    out = []
+    open_tags = []  # (flag, tag), outermost first
+    flags = 0
+    # Split at the marks: text, mark, text, mark, ..., text
+    for position, piece in enumerate(format_mark_pattern.split(text)):
+        if position % 2:
+            flags = ord(piece) - FORMAT_MARK
+            continue
+        if not piece:
+            continue
+        keep = 0
+        while keep < len(open_tags) and open_tags[keep][0] & flags:
+            keep += 1
+        while len(open_tags) > keep:
+            out.append(f"</{open_tags.pop()[1]}>")
+        opened = sum(flag for flag, _ in open_tags)
+        for flag, tag in FORMAT_HTML:
+            if flags & flag and not opened & flag:
+                out.append(f"<{tag}>")
+                open_tags.append((flag, tag))
+        out.append(piece)
+    for _, tag in reversed(open_tags):
+        out.append(f"</{tag}>")
+    return "".join(out)
+
+
+def classify_paragraph(text, style=None):
+    """Classify one stripped, non-empty paragraph in a single pass.
+
+    Returns (kind, value): the title for HEADING, the key=value string for
+    METADATA, a list of (label, target) pairs for CHOICES, the text for TEXT.
+    Most paragraphs are prose, so the regexes only run when a cheap character
+    test shows they could match: metadata must start with 'M', and a choice
+    needs an opening bracket plus one of the arrows ('->', '=>', '→').
+    """
+    if style and style.startswith('Heading 1'):
+        return HEADING, text
+
+    if text[0] in "Mm":
+        meta_line_match = metadata_line_pattern.match(text)
+        if meta_line_match:
+            return METADATA, meta_line_match.group(1).strip()
+
+    if ("[" in text or "【" in text) and (">" in text or "→" in text):
+        choices = [(m.group(1).strip(), m.group(2).strip()) for m in choice_pattern.finditer(text)]
+        if choices:
+            return CHOICES, choices
+
+    return TEXT, text
+
+
+def classify_with_images(text):
+    """classify_paragraph() for a paragraph holding pictures.
+
+    Pictures become <img> tags in story text; in titles, metadata and choice
+    lines they are dropped.
+    """
+    plain = image_token_pattern.sub("", text).strip()
+    if not plain:
+        return TEXT, image_token_pattern.sub(FIGURE_HTML, text)
+    kind, value = classify_paragraph(plain)
+    if kind == TEXT:
+        return TEXT, image_token_pattern.sub(IMAGE_HTML, text)
+    return kind, value
+
+
+def classify_rich_text(text):
+    """classify_paragraph() for a paragraph of rich text (see rich_text_html())."""
+    plain = format_mark_pattern.sub("", text).strip()
+    words = image_token_pattern.sub("", plain).strip() if IMAGE_MARK in plain else plain
+    if not words:
+        return TEXT, rich_text_html(text, figure=True)
+    kind, value = classify_paragraph(words)
+    if kind == TEXT:
+        return TEXT, rich_text_html(text)
+    return kind, value
+
+
+def split_sections(paragraphs, leading=None):
+    """Group (style, text) paragraphs into Heading 1 sections.
+
+    Each section is a list of stripped, non-empty paragraph texts whose first
+    entry is the scene title. Paragraphs before the first heading are dropped,
+    or collected in the `leading` list if one is given.
+    """
+    section = None
+    for style, text in paragraphs:
+        text = text.strip()
+        if not text:
+            continue
+
+        if classify_paragraph(text, style)[0] == HEADING:
+            if section:
+                yield section
+            section = [image_token_pattern.sub("", text).strip() if IMAGE_MARK in text else text]
+        elif section:
+            section.append(text)
+        elif leading is not None:
+            leading.append(text)
+
+    if section:
+        yield section
+
+
+def section_hash(section):
+    return hashlib.sha1("\x1f".join(section).encode("utf-8")).hexdigest()
+
+
+class Scene:
+    """A parsed Heading 1 section. Choices are (label, target title) pairs, or
+    (label, target title, condition, effects) with bytecode from parse_choice().
+
+    Slotted, since a large story holds many thousands of them.
+    """
+    __slots__ = ("text", "icon", "color", "choices")
+
+    def __init__(self, text="", icon=None, color=None, choices=None):
+        self.text = text
+        self.icon = icon
+        self.color = color
+        self.choices = [] if choices is None else choices
+
+    def record(self):
+        """JSON form, as kept in the parse cache: [text, icon, color, [[label, target, ...], ...]]."""
+        return [self.text, self.icon, self.color, self.choices]
+
+    @classmethod
+    def from_record(cls, record):
+        text, icon, color, choices = record
+        return cls(text, icon, color, [tuple(choice) for choice in choices])
+
+
+def parse_metadata(metadata_string, scene, title):
+    # Parse key=value pairs within the metadata string
+    for kv_match in key_value_pattern.finditer(metadata_string):
+        key = kv_match.group(1).lower()
+        value = kv_match.group(2).strip()
+
+        if key == 'icon':
+            scene.icon = value
+        elif key == 'color':
+            # Simple hex validation
+            if hex_color_pattern.match(value):
+                scene.color = value.upper()
+            else:
+                warn(f"  - Warning: Invalid color format '{value}' in scene '{title}'. Skipping.")
+
+
+# Choice conditions and effects: clauses at the end of a choice's target,
+#     [Pay the guard → Gate {if gold >= 5 and not banned} {set gold -= 5, bribed}]
+# compiled once here into a flat stack bytecode (numbers, with variable names as
+# the operands of LOAD/STORE) that the player runs with a small loop, see
+# runStoryCode(). Nothing is parsed or eval()'d in the browser. Variables hold
+# integers (true/false are 1/0), start at 0 and are matched ignoring case.
+choice_clause_pattern = re.compile(r"\s*[{｛]\s*(if|set)\b([^{}｛｝]*)[}｝]\s*$", re.IGNORECASE)
+story_code_token_pattern = re.compile(r"\s*(?:(\d+)|([^\W\d]\w*)|(==|!=|<=|>=|\+=|-=|&&|\|\||[-+<>=!()≤≥≠]))")
+
+# Opcodes (the player has the same numbering). CONST, LOAD and STORE take an operand.
+(OP_CONST, OP_LOAD, OP_STORE, OP_NOT, OP_NEG, OP_ADD, OP_SUB,
+ OP_EQ, OP_NE, OP_LT, OP_LE, OP_GT, OP_GE, OP_AND, OP_OR) = range(15)
+OPERAND_OPS = (OP_CONST, OP_LOAD, OP_STORE)
+COMPARISON_OPS = { "==": OP_EQ, "=": OP_EQ, "!=": OP_NE, "≠": OP_NE, "<": OP_LT, "<=": OP_LE, "≤": OP_LE,
+                   ">": OP_GT, ">=": OP_GE, "≥": OP_GE }
+KEYWORD_OPERATORS = { "and": "&&", "or": "||", "not": "!" }
+
+
+class _StoryCodeParser:
+    """Recursive descent over one condition or effect; the methods return bytecode lists.
+
+    expression := and ("or" and)*      and := not ("and" not)*
+    not := "not" not | comparison      comparison := sum (("==" | "!=" | "<" | ...) sum)?
+    sum := unary (("+" | "-") unary)*  unary := "-" unary | number | true | false | name | "(" expression ")"
+    """
+
+    def __init__(self, source):
+        self.tokens = []
+        position = 0
+        source = source.rstrip()
+        while position < len(source):
+            match = story_code_token_pattern.match(source, position)
+            if not match:
+                raise ValueError(f"unexpected '{source[position:].strip()[:10]}'")
+            number, name, symbol = match.groups()
+            if name:
+                name = name.lower()
+                self.tokens.append(KEYWORD_OPERATORS.get(name, name if name not in ("true", "false") else
+                                                         int(name == "true")))
+            else:
+                self.tokens.append(int(number) if number else symbol)
+            position = match.end()
+        self.position = 0
+
+    def peek(self):
+        return self.tokens[self.position] if self.position < len(self.tokens) else None
+
+    def take(self, *expected):
+        token = self.peek()
+        if token is None or (expected and token not in expected):
+            wanted = " or ".join(f"'{e}'" for e in expected) or "a value"
+            raise ValueError(f"expected {wanted}" + (f" before '{token}'" if token is not None else " at the end"))
+        self.position += 1
+        return token
+
+    def name(self):
+        token = self.take()
+        if not isinstance(token, str) or not (token[0].isalpha() or token[0] == "_"):
+            raise ValueError(f"expected a variable name before '{token}'")
+        return token
+
+    def end(self):
+        if self.peek() is not None:
+            raise ValueError(f"unexpected '{self.peek()}'")
+
+    def expression(self):
+        code = self.conjunction()
+        while self.peek() == "||":
+            self.take()
+            code += self.conjunction() + [OP_OR]
+        return code
+
+    def conjunction(self):
+        code = self.negation()
+        while self.peek() == "&&":
+            self.take()
+            code += self.negation() + [OP_AND]
+        return code
 
+    def negation(self):
+        if self.peek() == "!":
+            self.take()
+            return self.negation() + [OP_NOT]
+        code = self.sum()
+        if self.peek() in COMPARISON_OPS:
+            op = COMPARISON_OPS[self.take()]
+            code += self.sum() + [op]
+        return code
+
+    def sum(self):
+        code = self.unary()
+        while self.peek() in ("+", "-"):
+            op = OP_ADD if self.take() == "+" else OP_SUB
+            code += self.unary() + [op]
+        return code
+
+    def unary(self):
+        token = self.take()
+        if token == "-":
+            return self.unary() + [OP_NEG]
+        if token == "(":
+            code = self.expression()
+            self.take(")")
+            return code
+        if isinstance(token, int):
+            return [OP_CONST, token]
+        self.position -= 1
+        return [OP_LOAD, self.name()]
+
+
+def compile_condition(source):
+    """Bytecode leaving 1 or 0 (any non-zero counts as true). Raises ValueError."""
+    parser = _StoryCodeParser(source)
+    code = parser.expression()
+    parser.end()
+    return code
+
+
+def compile_effects(source):
+    """Bytecode for comma- or semicolon-separated effects. Raises ValueError.
+
+    name = value, name += value, name -= value; a bare name sets it to 1 and
+    "not name" sets it to 0.
+    """
+    code = []
+    for statement in re.split(r"[,;，；]", source):
+        parser = _StoryCodeParser(statement)
+        if parser.peek() is None:
+            continue
+        if parser.peek() == "!":
+            parser.take()
+            code += [OP_CONST, 0, OP_STORE, parser.name()]
+            parser.end()
+            continue
+        name = parser.name()
+        op = parser.take("=", "+=", "-=") if parser.peek() is not None else None
+        value = parser.expression() if op else [OP_CONST, 1]
+        parser.end()
+        if op in ("+=", "-="):
+            value = [OP_LOAD, name] + value + [OP_ADD if op == "+=" else OP_SUB]
+        code += value + [OP_STORE, name]
+    if not code:
+        raise ValueError("nothing to set")
+    return code
+
+
+def iter_code(code):
+    """Yield (opcode, operand or None) for a bytecode list."""
+    position = 0
+    while position < len(code):
+        op = code[position]
+        if op in OPERAND_OPS:
+            yield op, code[position + 1]
+            position += 2
+        else:
+            yield op, None
+            position += 1
+
+
+def parse_choice(label, target, title):
+    """A choice as (label, target), or (label, target, condition, effects) if its
+    target ends with {if ...} or {set ...} clauses (None where one is absent)."""
+    if "{" not in target and "｛" not in target:
+        return label, target
+    condition = effects = None
+    # Clauses are taken off the end, so later ones are seen first
+    while True:
+        match = choice_clause_pattern.search(target)
+        if not match:
+            break
+        target = target[:match.start()]
+        keyword, source = match.group(1).lower(), match.group(2).strip()
+        try:
+            code = compile_condition(source) if keyword == "if" else compile_effects(source)
+        except ValueError as e:
+            problem = f"  - Warning: Invalid {{{keyword} {source}}} in choice '{label}' of scene '{title}' ({e})."
+            if keyword == "set":
+                warn(f"{problem} Skipping it.")
+                continue
+            # A gate that cannot be read stays closed rather than opening for every reader
+            warn(f"{problem} The choice stays hidden.")
+            code = [OP_CONST, 0]
+        if keyword == "if":
+            condition = code if condition is None else code + condition + [OP_AND]
+        else:
+            effects = code + (effects or [])
+    target = target.strip()
+    if condition is None and effects is None:
+        return label, target
+    return label, target, condition, effects
+
+
+def parse_section(section, stats=None, rich_text=False):
+    """Turn one Heading 1 section into (title, scene record)."""
+    title = section[0]
+    scene = Scene()
+    current_text = []
+
+    for text in section[1:]:
+        if rich_text:
+            kind, value = classify_rich_text(text)
+        else:
+            kind, value = classify_paragraph(text) if IMAGE_MARK not in text else classify_with_images(text)
+
+        if kind == METADATA:
+            # 2. Metadata Line: styles the scene and is not added to the story text
+            with stats.phase("metadata") if stats else NO_PHASE:
+                parse_metadata(value, scene, title)
+        elif kind == CHOICES:
+            # 3. Choices
+            scene.choices.extend(parse_choice(label, target, title) for label, target in value)
+        else:
+            # 4. Regular Text
+            current_text.append(value)
+
+    scene.text = "<p>" + "</p><p>".join(current_text) + "</p>"
+    return title, scene
+
+
+# Parallel parsing (see split_body()). Below this size of document.xml the worker
+# processes cost more than they save.
+PARALLEL_PARSE_MIN_BYTES = 4 << 20
+RANGES_PER_WORKER = 4  # Smaller ranges even out the work between the processes
+
+
+def _parse_logged(section, rich_text):
+    """(section hash, paragraph count, title, scene, console output of parsing it)"""
+    with contextlib.redirect_stdout(io.StringIO()) as output:
+        title, scene = parse_section(section, None, rich_text)
+    return section_hash(section), len(section), title, scene, output.getvalue()
+
+
+def _parse_range(job):
+    # Runs in a worker process. Warnings are returned with each section, to be
+    # printed in document order once every range has been parsed.
+    filename, document_part, settings, xml, rich_text = job
+    leading = []
+    parsed = []
+    section = None
+    for section in split_sections(read_body_range(filename, document_part, settings, xml), leading):
+        parsed.append(_parse_logged(section, rich_text))
+    return leading, parsed, section
+
+
+def parse_ranges(filename, workers, rich_text=False, stats=None):
+    """Parse a large document's sections in worker processes.
+
+    Returns [(section hash, paragraph count, title, scene, warnings)] in document
+    order, exactly as the sequential loop in parse_docx() would produce them, or
+    None if the document is below PARALLEL_PARSE_MIN_BYTES or cannot be cut.
+    """
+    stats = stats or BuildStats()
+    with stats.phase("scan"):
+        split = split_body(filename, workers * RANGES_PER_WORKER, rich_text, PARALLEL_PARSE_MIN_BYTES)
+    if split is None:
+        return None
+    document_part, settings, ranges = split
+    jobs = [(filename, document_part, settings, xml, rich_text) for xml in ranges]
+    del split, ranges
+
+    try:
+        with concurrent.futures.ProcessPoolExecutor(max_workers=min(workers, len(jobs)), initializer=_init_worker,
+                                                    initargs=(VERBOSITY,)) as pool:
+            results = pool.map(_parse_range, jobs)
+            sections = []
+            previous = None
+            for leading, parsed, last in results:
+                if leading and sections:
+                    # A range can start at a heading that turns out to be empty; its first
+                    # paragraphs then belong to the last section of the range before
+                    previous = previous + leading
+                    sections[-1] = _parse_logged(previous, rich_text)
+                sections += parsed
+                previous = last or previous
+    except ET.ParseError as e:
+        log(f"  - Note: Could not split {filename} for parallel parsing ({e}). Parsing it in one piece.", VERBOSE)
+        return None
+    log(f"Parsed {len(jobs)} ranges in {min(workers, len(jobs))} worker process(es).", VERBOSE)
+    return sections
+
+
+def source_label(source):
+    """How a document is named in messages: its path, or the name of an open file."""
+    if isinstance(source, (str, os.PathLike)):
+        return os.fspath(source)
+    return getattr(source, "name", None) or "the uploaded document"
+
+
+def source_size(source):
+    if isinstance(source, (str, os.PathLike)):
+        return os.path.getsize(source)
+    size = source.seek(0, io.SEEK_END)
+    source.seek(0)
+    return size
+
+
+def parse_docx(filename, cache=None, stats=None, rich_text=False, workers=1):
+    """Parse the document into {title: Scene}. With rich_text, story text keeps
+    its bold, italic, underline and strikethrough and is HTML-escaped. Large
+    documents are parsed in up to `workers` processes (see parse_ranges()).
+
+    `filename` can also be a seekable binary file object (see convert_bytes());
+    that is always parsed in this process and without the cache.
+    """
+    in_memory = not isinstance(filename, (str, os.PathLike))
+    if in_memory:
+        cache, workers = None, 1
+    elif not os.path.exists(filename):
+        warn(f"Error: {filename} not found.")
+        return None
+
+    stats = stats or BuildStats()
+    log(f"Reading {source_label(filename)}...")
+    stats.count("input_bytes", source_size(filename))
+
+    source_hash = None
+    if cache is not None:
+        # Untouched source: reuse the whole story without opening the document
+        with stats.phase("cache"):
+            source_hash = file_hash(filename)
+            story = cache.lookup_source(source_hash)
+        if story is not None:
+            count_story(story, stats)
+            return story
+
+    story = {}
+    section_keys = []
+    parsed = None
+    if workers > 1:
+        with stats.phase("classify"):
+            parsed = parse_ranges(filename, workers, rich_text, stats)
+
+    if parsed is not None:
+        for key, paragraphs, title, scene, warnings in parsed:
+            sys.stdout.write(warnings)
+            stats.count("paragraphs", paragraphs)
+            if cache is not None:
+                section_keys.append(key)
+                # Every section was parsed anyway; this keeps the cache entries and counts current
+                if not cache.lookup_section(key):
+                    cache.store_section(key, title, scene, warnings)
+            story[title] = scene
+            log(f"Found Scene: {title}", VERBOSE)
+    else:
+        with stats.phase("load"):
+            reader = read_paragraphs(filename, rich_text)
+
+        with stats.phase("classify"):
+            for section in split_sections(stats.timed_iter("load", reader)):
+                # 1. Each Heading 1 section becomes a scene
+                stats.count("paragraphs", len(section))
+                cached = None
+                if cache is not None:
+                    key = section_hash(section)
+                    section_keys.append(key)
+                    cached = cache.lookup_section(key)
+
+                if cached:
+                    title, scene, warnings = cached
+                    sys.stdout.write(warnings)
+                elif cache is not None:
+                    # The warnings are cached too, so a reused section still reports its problems
+                    with contextlib.redirect_stdout(io.StringIO()) as output:
+                        title, scene = parse_section(section, stats, rich_text)
+                    sys.stdout.write(output.getvalue())
+                    cache.store_section(key, title, scene, output.getvalue())
+                else:
+                    title, scene = parse_section(section, stats, rich_text)
+
+                story[title] = scene
+                log(f"Found Scene: {title}", VERBOSE)
+
+    if cache is not None:
+        with stats.phase("cache"):
+            cache.save(source_hash, section_keys)
+
+    count_story(story, stats)
     return story
 
-def generate_html(story_data):
+def count_story(story, stats):
+    stats.count("scenes", len(story))
+    stats.count("choices", sum(len(scene.choices) for scene in story.values()))
+
+# ==========================================
+# IMAGES (Extraction, Resizing, Embedding)
+# ==========================================
+# Pictures are stored once per distinct content: the reader keys every media part
+# by a hash of its bytes, and scene text only carries that key. At build time the
+# referenced pictures are read back from the .docx, oversized ones are scaled down
+# and re-encoded (in a process pool, if Pillow is installed), and the page gets a
+# key -> [src, width, height] table: data: URIs for single-file output, files in a
+# "<name>_media" folder next to the page for the sidecar payload.
+
+try:
+    from PIL import Image  # Optional: resizing and re-encoding of pictures
+except ImportError:
+    Image = None
+
+MAX_IMAGE_SIZE = 1600  # Longest side in pixels after resizing
+MEDIA_EXTENSIONS = {
+    "image/png": ".png", "image/jpeg": ".jpg", "image/gif": ".gif",
+    "image/webp": ".webp", "image/svg+xml": ".svg",
+}
+media_file_pattern = re.compile(r"^[0-9a-f]{16}\.(png|jpg|gif|webp|svg)$")
+
+
+def image_key(f):
+    """Content key of a picture: the first 16 hex digits of its SHA-256."""
+    digest = hashlib.sha256()
+    for chunk in iter(lambda: f.read(1 << 16), b""):
+        digest.update(chunk)
+    return digest.hexdigest()[:16]
+
+
+def _jpeg_size(data):
+    i = 2
+    while i + 9 < len(data):
+        if data[i] != 0xFF:
+            return None, None
+        marker = data[i + 1]
+        # SOF0..SOF15 carry the frame size; C4 (DHT), C8 (JPG) and CC (DAC) do not
+        if 0xC0 <= marker <= 0xCF and marker not in (0xC4, 0xC8, 0xCC):
+            height, width = struct.unpack(">HH", data[i + 5:i + 9])
+            return width, height
+        i += 2 + struct.unpack(">H", data[i + 2:i + 4])[0]
+    return None, None
+
+
+def sniff_image(data):
+    """(MIME type, width, height) from the file header. The type is None for
+    formats browsers cannot show (EMF, WMF, TIFF, ...); sizes may be None."""
+    if data.startswith(b"\x89PNG\r\n\x1a\n"):
+        return ("image/png",) + struct.unpack(">II", data[16:24])
+    if data.startswith(b"\xff\xd8"):
+        return ("image/jpeg",) + _jpeg_size(data)
+    if data[:6] in (b"GIF87a", b"GIF89a"):
+        return ("image/gif",) + struct.unpack("<HH", data[6:10])
+    if data[:4] == b"RIFF" and data[8:12] == b"WEBP":
+        return "image/webp", None, None
+    if b"<svg" in data[:1024]:
+        return "image/svg+xml", None, None
+    return None, None, None
+
+
+def _reencode(data, max_size):
+    """Scale a picture down to max_size and re-encode it as PNG (transparency) or JPEG."""
+    with Image.open(io.BytesIO(data)) as picture:
+        picture.thumbnail((max_size, max_size), Image.LANCZOS)
+        out = io.BytesIO()
+        if picture.mode in ("RGBA", "LA") or "transparency" in picture.info:
+            picture.save(out, "PNG", optimize=True)
+            mime = "image/png"
+        else:
+            picture.convert("RGB").save(out, "JPEG", quality=85, optimize=True, progressive=True)
+            mime = "image/jpeg"
+        return out.getvalue(), mime, picture.size
+
+
+def _prepare_image(job):
+    """Runs in the image pool. Returns (key, mime, data, width, height, re-encoded);
+    mime is None if the picture cannot be shown in a browser."""
+    key, data, max_size = job
+    mime, width, height = sniff_image(data)
+    # Animated GIFs and vector graphics are kept as they are
+    if Image is None or mime in ("image/gif", "image/svg+xml"):
+        return key, mime, data, width, height, False
+    try:
+        with Image.open(io.BytesIO(data)) as picture:
+            width, height = picture.size  # Read from the header, nothing is decoded yet
+        if mime is not None and max(width, height) <= max_size:
+            return key, mime, data, width, height, False
+        data, mime, (width, height) = _reencode(data, max_size)
+        return key, mime, data, width, height, True
+    except Exception:  # Pillow raises many error types for damaged files; keep the original
+        return key, mime, data, width, height, False
+
+
+def _media_cache_path(media_cache, key, max_size):
+    return os.path.join(media_cache, f"{key}-{max_size}") if media_cache else None
+
+
+def _cached_image(path):
+    for extension in MEDIA_EXTENSIONS.values():
+        if os.path.exists(path + extension):
+            with open(path + extension, "rb") as f:
+                data = f.read()
+            return sniff_image(data)[0], data
+    return None, None
+
+
+def prepare_images(source_filename, story_data, max_size=MAX_IMAGE_SIZE, workers=1, media_cache=None,
+                   stats=None):
+    """Read, resize and re-encode the pictures the story uses.
+
+    Returns {key: (mime, data, width, height)}. Re-encoded pictures are kept in
+    `media_cache` (if given) so unchanged ones are not processed again.
+    """
+    stats = stats or BuildStats()
+    keys = { key for scene in story_data.values() for key in image_reference_pattern.findall(scene.text) }
+    if not keys:
+        return {}
+
+    prepared = {}
+    jobs = []
+    with zipfile.ZipFile(source_filename) as zf:
+        document_part = _find_related_part(zf, None, REL_TYPE_DOCUMENT, "word/document.xml")
+        parts = DocumentImages(zf, document_part).keyed_parts()
+        for key in sorted(keys):
+            if key not in parts:
+                warn(f"  - Warning: Picture {key} is no longer in {source_label(source_filename)}. Skipping.")
+                continue
+            cache_path = _media_cache_path(media_cache, key, max_size)
+            mime, data = _cached_image(cache_path) if cache_path else (None, None)
+            if mime:
+                prepared[key] = (mime, data) + sniff_image(data)[1:]
+            else:
+                jobs.append((key, zf.read(parts[key]), max_size))
+
+    if workers > 1 and Image is not None and len(jobs) > 1:
+        with concurrent.futures.ProcessPoolExecutor(max_workers=min(workers, len(jobs))) as pool:
+            results = list(pool.map(_prepare_image, jobs))
+    else:
+        results = [_prepare_image(job) for job in jobs]
+
+    oversized = 0
+    for key, mime, data, width, height, reencoded in results:
+        if mime is None:
+            warn(f"  - Warning: Picture {key} is in a format browsers cannot show (e.g. EMF/WMF). Skipping.")
+            continue
+        if reencoded and media_cache:
+            os.makedirs(media_cache, exist_ok=True)
+            write_if_changed(_media_cache_path(media_cache, key, max_size) + MEDIA_EXTENSIONS[mime], data)
+        if not reencoded and width and max(width, height) > max_size:
+            oversized += 1
+        prepared[key] = (mime, data, width, height)
+
+    if oversized and Image is None:
+        log(f"  - Note: {oversized} picture(s) are larger than {max_size}px. "
+            f"Install Pillow (pip install Pillow) to scale them down.")
+    stats.count("images", len(prepared))
+    stats.count("image_bytes", sum(len(entry[1]) for entry in prepared.values()))
+    return dict(sorted(prepared.items()))
+
+
+def media_dir(output_filename):
+    return os.path.splitext(output_filename)[0] + "_media"
+
+
+def image_table(images, media_path=None):
+    """key -> [src, width, height] for the player: data: URIs, or file paths under media_path."""
+    table = {}
+    for key, (mime, data, width, height) in images.items():
+        if media_path is None:
+            src = f"data:{mime};base64,{base64.b64encode(data).decode('ascii')}"
+        else:
+            src = f"{media_path}/{key}{MEDIA_EXTENSIONS[mime]}"
+        table[key] = [src, width, height]
+    return table
+
+
+def write_media_files(images, folder):
+    os.makedirs(folder, exist_ok=True)
+    expected = set()
+    for key, (mime, data, _, _) in images.items():
+        name = key + MEDIA_EXTENSIONS[mime]
+        expected.add(name)
+        write_if_changed(os.path.join(folder, name), data)
+
+    # Remove pictures the story no longer uses
+    for name in os.listdir(folder):
+        if media_file_pattern.match(name) and name not in expected:
+            os.remove(os.path.join(folder, name))
+
+
+# ==========================================
+# LINK CHECKING (Story Graph)
+# ==========================================
+# Runs between parsing and generation. Choice targets are resolved exactly as the
+# player resolves them, so a broken link is reported at build time instead of as
+# "Scene not found" in the browser. Everything here is linear in scenes + choices.
+
+def normalize_scene_key(title):
+    # Same normalization as the player's title lookup (trim + lower case)
+    return title.strip().lower()
+
+def loose_scene_key(title):
+    # For suggestions only: also ignores whitespace and full-width/half-width forms
+    return "".join(unicodedata.normalize("NFKC", title).casefold().split())
+
+def scene_index_by_key(titles):
+    """Normalized title -> scene index. The first scene wins, like the player's lookup."""
+    index_by_key = {}
+    for index, title in enumerate(titles):
+        index_by_key.setdefault(normalize_scene_key(title), index)
+    return index_by_key
+
+class StoryGraph:
+    """Adjacency index over the scenes of a parsed story."""
+
+    def __init__(self, story_data):
+        self.titles = list(story_data)
+        self.index_by_key = scene_index_by_key(self.titles)
+        self.edges = []
+        self.dangling = []  # (scene index, choice label, raw target)
+
+        for index, title in enumerate(self.titles):
+            targets = []
+            for label, next_title, *_ in story_data[title].choices:
+                target = self.index_by_key.get(normalize_scene_key(next_title))
+                if target is None:
+                    self.dangling.append((index, label, next_title))
+                else:
+                    targets.append(target)
+            self.edges.append(targets)
+
+    def reachable(self, start=0):
+        """Scene indexes reachable from `start` (breadth-first), as a set."""
+        if not self.titles:
+            return set()
+        seen = {start}
+        queue = collections.deque([start])
+        while queue:
+            for target in self.edges[queue.popleft()]:
+                if target not in seen:
+                    seen.add(target)
+                    queue.append(target)
+        return seen
+
+    def shadowed_titles(self):
+        """Pairs of titles the player cannot tell apart; links always go to the first."""
+        return [(self.titles[self.index_by_key[normalize_scene_key(title)]], title)
+                for index, title in enumerate(self.titles)
+                if self.index_by_key[normalize_scene_key(title)] != index]
+
+    def suggestions(self):
+        """Map each dangling target to the scene title it most likely meant (or None)."""
+        loose = {}
+        for title in self.titles:
+            loose.setdefault(loose_scene_key(title), title)
+        return { target: loose.get(loose_scene_key(target)) for _, _, target in self.dangling }
+
+def _report_list(header, lines, emit=warn, limit=10):
+    emit(header)
+    shown = lines if VERBOSITY >= VERBOSE else lines[:limit]
+    for line in shown:
+        emit(f"    {line}")
+    if len(shown) < len(lines):
+        emit(f"    ... and {len(lines) - len(shown)} more (use -v to list all)")
+
+def story_variables(story_data):
+    """({name: first scene reading it}, {name: first scene setting it}) over all choice conditions and effects."""
+    read, written = {}, {}
+    for title, scene in story_data.items():
+        for choice in scene.choices:
+            for code in choice[2:]:
+                for op, operand in iter_code(code or ()):
+                    if op == OP_LOAD:
+                        read.setdefault(operand, title)
+                    elif op == OP_STORE:
+                        written.setdefault(operand, title)
+    return read, written
+
+def check_links(story_data, prune=False, stats=None):
+    """Report dangling choices and unreachable scenes; optionally drop the latter.
+
+    Returns the story to generate from (a pruned copy when `prune` is set).
+    """
+    stats = stats or BuildStats()
+    graph = StoryGraph(story_data)
+    reachable = graph.reachable(0)
+    unreachable = [title for index, title in enumerate(graph.titles) if index not in reachable]
+    stats.count("dangling_links", len(graph.dangling))
+    stats.count("unreachable_scenes", len(unreachable))
+
+    for first, other in graph.shadowed_titles():
+        warn(f"  - Warning: Scene titles '{first}' and '{other}' only differ in case or surrounding spaces; "
+             f"links always open '{first}'.")
+
+    if graph.dangling:
+        suggestions = graph.suggestions()
+        lines = []
+        for index, label, target in graph.dangling:
+            hint = suggestions[target]
+            hint = f" (did you mean '{hint}'?)" if hint else ""
+            lines.append(f"'{graph.titles[index]}': [{label} → {target}]{hint}")
+        _report_list(f"  - Warning: {len(graph.dangling)} choice(s) point to scenes that do not exist:", lines)
+
+    read, written = story_variables(story_data)
+    stats.count("variables", len(read.keys() | written.keys()))
+    never_set = [f"{name} (used in '{read[name]}')" for name in read if name not in written]
+    if never_set:
+        _report_list(f"  - Warning: {len(never_set)} variable(s) are used by choices but never set, "
+                     f"so they are always 0:", never_set)
+
+    if unreachable:
+        if not prune:
+            _report_list(f"  - Warning: No choice leads to {len(unreachable)} unreachable scene(s):", unreachable)
+        else:
+            _report_list(f"  - Note: Removing {len(unreachable)} unreachable scene(s):", unreachable, emit=log)
+            return { title: story_data[title] for index, title in enumerate(graph.titles) if index in reachable }
+
+    return story_data
+
+def build_story_table(story_data, by_name=False):
+    """Lay the story out as index-addressed arrays for the player.
+
+    Choice targets are resolved to scene indexes here, so following a choice in
+    the browser is a plain array access. Targets that match no scene keep their
+    raw title and show the "Scene not found" status when clicked, as before.
+
+    With `by_name`, resolved targets are the exact title of their scene and
+    conditions and effects keep their variable names, so that a scene's record
+    does not depend on where other scenes and variables are (site shards; the
+    player links them when they load, see storyShard()).
+    """
+    titles = list(story_data)
+    index_by_key = scene_index_by_key(titles)
+
+    scenes = []
+    variables = {}  # Name -> index in storyData.vars, in order of first use
+
+    def encode(code):
+        linked = link_code(code, variables)  # Numbers the variables either way
+        return code if by_name else linked
+
+    for title in titles:
+        scene = story_data[title]
+        choices = []
+        for label, next_title, *logic in scene.choices:
+            target = index_by_key.get(normalize_scene_key(next_title))
+            if target is None:
+                choice = [label, next_title]
+            else:
+                choice = [label, titles[target] if by_name else target]
+            if logic:
+                # [label, next, condition or 0, effects] (effects left out when there are none)
+                condition, effects = logic
+                choice.append(encode(condition) if condition else 0)
+                if effects:
+                    choice.append(encode(effects))
+            choices.append(choice)
+        scenes.append([scene.text, scene.icon, scene.color, choices])
+
+    table = { "titles": titles, "scenes": scenes }
+    if variables:
+        table["vars"] = list(variables)
+    return table
+
+def link_code(code, variables):
+    """Copy of `code` with variable names replaced by their index in `variables` (extended as needed)."""
+    linked = []
+    for op, operand in iter_code(code):
+        linked.append(op)
+        if op in (OP_LOAD, OP_STORE):
+            linked.append(variables.setdefault(operand, len(variables)))
+        elif operand is not None:
+            linked.append(operand)
+    return linked
+
+def intern_story_strings(table, stats=None):
+    """Move strings repeated across scenes into a shared table["strings"].
+
+    Scene texts, icons, colors and choice labels that occur more than once are
+    replaced by their index in the table when that makes the page smaller; the
+    most frequent get the shortest indexes. Choice targets are left alone (a
+    number there is already a scene index). Returns the bytes saved in compact
+    JSON.
+    """
+    counts = collections.Counter()
+    for text, icon, color, choices in table["scenes"]:
+        counts.update(value for value in (text, icon, color) if value is not None)
+        counts.update(choice[0] for choice in choices)
+
+    strings, index_of, saved = [], {}, 0
+    for value, count in counts.most_common():
+        if count < 2:
+            break
+        size = len(script_safe_json(value).encode("utf-8"))
+        # Each use shrinks to the index; the table holds the string once, plus a comma
+        gain = count * (size - len(str(len(strings)))) - size - 1
+        if gain > 0:
+            index_of[value] = len(strings)
+            strings.append(value)
+            saved += gain
+    if not strings:
+        return 0
+
+    table["strings"] = strings
+    table["scenes"] = [
+        [index_of.get(text, text), index_of.get(icon, icon), index_of.get(color, color),
+         [[index_of.get(label, label), *rest] for label, *rest in choices]]
+        for text, icon, color, choices in table["scenes"]
+    ]
+    if stats is not None:
+        stats.count("interned_strings", len(strings))
+        stats.count("interned_bytes_saved", saved)
+    log(f"String table: {len(strings):,} repeated string(s), {saved:,} bytes saved.", VERBOSE)
+    return saved
+
+# Scene payload layouts: one inline JSON literal (default), one JSON block per
+# scene inside the page, one script file per scene next to the page, or a
+# multi-file site with versioned assets and a service worker
+PAYLOAD_MODES = ("inline", "shards", "sidecar", "site")
+
+template_placeholder_pattern = re.compile(r"(STORY_DATA_PLACEHOLDER|STORY_SHARDS_PLACEHOLDER|PLAYER_CONFIG_PLACEHOLDER)")
+
+# Player settings baked into the page as `playerConfig`
+PLAYER_DEFAULTS = {
+    "autosaveCap": 50,              # Oldest unnamed saves beyond this are deleted
+    "savesPageSize": 20,            # Saves listed per page in the save/load modal
+    "renderCacheSize": 24,          # Rendered scenes kept for back/forth navigation and prefetching
+    "progressiveThreshold": 20000,  # Scene texts longer than this (characters) render over several frames
+    "perf": False,                  # Timing overlay (also turned on by opening the page with ?perf=1)
+}
+
+def player_config(**overrides):
+    config = dict(PLAYER_DEFAULTS)
+    config.update({ key: value for key, value in overrides.items() if value is not None })
+    return config
+
+@functools.lru_cache(maxsize=None)
+def template_parts(template):
+    """The template split once at its placeholders: (text, placeholder, text, ..., text)."""
+    return tuple(template_placeholder_pattern.split(template))
+
+def iter_template(template, values):
+    """Yield the filled-in template piece by piece. A value is a string or an iterable of strings.
+
+    Single pass, so story text that happens to contain a placeholder name is left alone.
+    """
+    for position, part in enumerate(template_parts(template)):
+        if position % 2 == 0:
+            yield part
+        elif isinstance(values[part], str):
+            yield values[part]
+        else:
+            yield from values[part]
+
+def fill_template(template, values):
+    return "".join(iter_template(template, values))
+
+def script_safe_json(data, **kwargs):
+    # Story text must not be able to close the <script> element it is embedded in
+    text = json.dumps(data, ensure_ascii=False, **kwargs)
+    return re.sub(r"</(script)", r"<\\/\1", text, flags=re.IGNORECASE)
+
+def iter_json(data, indent=None, depth=2):
+    """Yield script_safe_json(data) in pieces: containers down to `depth` levels are
+    streamed item by item, so the text of a whole story is never built at once.
+
+    The pieces join to exactly what json.dumps() gives with the same `indent`
+    (compact separators when indent is None).
+    """
+    item_separator, key_separator = (",", ":") if indent is None else (",", ": ")
+    if depth == 0 or not isinstance(data, (dict, list)) or not data:
+        yield script_safe_json(data, indent=indent, separators=(item_separator, key_separator))
+        return
+
+    inner, outer = ("", "") if indent is None else ("\n" + " " * indent, "\n")
+    is_dict = isinstance(data, dict)
+    yield "{" if is_dict else "["
+    for position, item in enumerate(data.items() if is_dict else data):
+        yield (item_separator if position else "") + inner
+        if is_dict:
+            key, item = item
+            yield script_safe_json(key) + key_separator
+        for piece in iter_json(item, indent, depth - 1):
+            # Nested lines move in by one level
+            yield piece if indent is None else piece.replace("\n", "\n" + " " * indent)
+    yield outer + ("}" if is_dict else "]")
+
+def join_pieces(separator, pieces):
+    for position, piece in enumerate(pieces):
+        yield (separator if position else "") + piece
+
+def write_if_changed(filename, content):
+    """Write a text (str) or binary (bytes) file unless it already holds exactly this content.
+
+    Returns True if written.
+    """
+    binary = isinstance(content, bytes)
+    if os.path.exists(filename):
+        with open(filename, "rb") if binary else open(filename, encoding="utf-8") as f:
+            if f.read() == content:
+                return False
+
+    return write_stream_if_changed(filename, [content], binary)
+
+def write_stream_if_changed(filename, pieces, binary=False):
+    """Write an iterable of str (or bytes) pieces to filename without holding them all.
+
+    The pieces go to a temporary file that replaces filename in one rename, so
+    readers (and a build that fails halfway) never see a half-written file. An
+    existing file with the same content is left alone, with its modification time.
+    Returns True if written.
+    """
+    temp = f"{filename}.{os.getpid()}.tmp"
+    try:
+        with open(temp, "wb") if binary else open(temp, "w", encoding="utf-8") as f:
+            for piece in pieces:
+                f.write(piece)
+        if os.path.exists(filename) and filecmp.cmp(temp, filename, shallow=False):
+            os.remove(temp)
+            return False
+        os.replace(temp, filename)
+        return True
+    except BaseException:
+        with contextlib.suppress(OSError):
+            os.remove(temp)
+        raise
+
+SEARCH_INDEX_FILE = "search-index.js"
+
+def sidecar_dir(output_filename):
+    return os.path.splitext(output_filename)[0] + "_scenes"
+
+def write_sidecar_shards(scene_json, shard_dir):
+    os.makedirs(shard_dir, exist_ok=True)
+    expected = set()
+    for index, scene in enumerate(scene_json):
+        name = f"scene-{index}.js"
+        expected.add(name)
+        write_if_changed(os.path.join(shard_dir, name), f"storyShard({index}, {scene});\n")
+
+    # Remove shards left over from a previous build with more scenes
+    for name in os.listdir(shard_dir):
+        if name.startswith("scene-") and name.endswith(".js") and name not in expected:
+            os.remove(os.path.join(shard_dir, name))
+
+@functools.lru_cache(maxsize=None)
+def release_template():
+    return minify_html(HTML_TEMPLATE)
+
+def serialize_story(story_data, payload, release, shard_path=None, images=None, search_index=None, stats=None):
+    """Return (story JSON, embedded shard blocks, sidecar shards) for the page.
+
+    All three are lazy iterables of strings (sidecar shards: one per scene, or
+    None), serialized while generate_html() writes them out.
+    """
+    table = build_story_table(story_data)
+    if payload != "sidecar":
+        # Not for scenes in files of their own: the table is renumbered on every
+        # build, so one edit could rewrite every shard
+        intern_story_strings(table, stats)
+    if images:
+        table["images"] = images
+    shard_blocks = []
+    sidecar_scenes = None
+    # Release builds use compact JSON
+    json_format = { "separators": (",", ":") } if release else {}
+
+    if payload == "shards":
+        # Only the title index is parsed up front; each scene is parsed on first visit
+        scenes = table.pop("scenes")
+        table.update({ "scenes": [], "shards": "embedded" })
+        shard_blocks = (
+            f'<script type="application/json" id="scene-shard-{index}">{script_safe_json(scene, **json_format)}</script>'
+            for index, scene in enumerate(scenes)
+        )
+    elif payload == "sidecar":
+        scenes = table.pop("scenes")
+        table.update({ "scenes": [], "shards": "sidecar", "shardPath": shard_path })
+        sidecar_scenes = (script_safe_json(scene, **json_format) for scene in scenes)
+
+    if search_index and payload == "sidecar":
+        # Written next to the scene shards by generate_html(), loaded on the first search
+        table["searchIndex"] = f"{shard_path}/{SEARCH_INDEX_FILE}"
+    elif search_index:
+        # Parsed on the first search. Compact even in debug builds: it is not meant to be read
+        table["searchIndex"] = "embedded"
+        block = f'<script type="application/json" id="search-index">{search_index_json(search_index)}</script>'
+        shard_blocks = itertools.chain(shard_blocks, [block])
+
+    json_data = iter_json(table, None if release else 4)
+    return json_data, join_pieces("\n" if release else "\n    ", shard_blocks), sidecar_scenes
+
+def render_page(story_data, payload="inline", release=False, config=None, images=None, search_index=None,
+                shard_path=None, media_path=None, stats=None):
+    """Return (page, sidecar shards): the player page as a lazy iterable of strings,
+    and serialize_story()'s sidecar shards. Pictures are data: URIs unless
+    `media_path` is given."""
+    picture_table = image_table(images, media_path) if images else None
+    json_data, shard_blocks, sidecar_scenes = serialize_story(
+        story_data, payload, release, shard_path, picture_table, search_index, stats)
+    # Release builds use the minified template
+    page = iter_template(release_template() if release else HTML_TEMPLATE, {
+        "STORY_DATA_PLACEHOLDER": json_data,
+        "STORY_SHARDS_PLACEHOLDER": shard_blocks,
+        "PLAYER_CONFIG_PLACEHOLDER": json.dumps(config or player_config()),
+    })
+    return page, sidecar_scenes
+
+def generate_html(story_data, output_filename=OUTPUT_FILENAME, payload="inline", release=False, config=None,
+                  images=None, search=False, stats=None):
+    """Write the player page. `images` comes from prepare_images(): embedded as data:
+    URIs in a single-file page, written to a media folder for the sidecar payload.
+    `search` adds the full-text search index and panel."""
     if not story_data:
-        print("No scenes found. Please check Heading 1 styles and try again.")
+        warn("No scenes found. Please check Heading 1 styles and try again.")
         return
 
-    # Convert to JSON and inject
-    json_data = json.dumps(story_data, indent=4, ensure_ascii=False)
-    final_html = HTML_TEMPLATE.replace("STORY_DATA_PLACEHOLDER", json_data)
-    
-    with open(OUTPUT_FILENAME, "w", encoding="utf-8") as f:
-        f.write(final_html)
-    
-    print(f"Done! Created {OUTPUT_FILENAME}")
+    stats = stats or BuildStats()
+    search_index = None
+    if search:
+        with stats.phase("search"):
+            search_index = build_search_index(story_data, stats)
+
+    if payload == "site":
+        with stats.phase("serialize"):
+            files, shell = build_site(story_data, output_filename, release, config, images, search_index, stats)
+        with stats.phase("write"):
+            write_site(files, shell, output_filename, release)
+            stats.count("output_bytes", sum(len(c if isinstance(c, bytes) else c.encode("utf-8"))
+                                            for c in files.values()))
+        return
+
+    shard_dir = sidecar_dir(output_filename)
+    picture_dir = media_dir(output_filename) if images and payload == "sidecar" else None
+
+    # Choice targets can only be resolved once every title is known, so scenes are
+    # not written while parsing. The finished table is serialized a piece at a time
+    # straight into the file instead of into one big string. The folders are
+    # referred to by URL, so names with '#', '?' or '%' are quoted (as in build_site()).
+    shard_url = urllib.parse.quote(os.path.basename(shard_dir))
+    picture_url = picture_dir and urllib.parse.quote(os.path.basename(picture_dir))
+    with stats.phase("serialize"):
+        page, sidecar_scenes = render_page(story_data, payload, release, config, images, search_index,
+                                           shard_url, picture_url, stats)
+
+    with stats.phase("write"):
+        if sidecar_scenes is not None:
+            write_sidecar_shards(stats.timed_iter("serialize", sidecar_scenes), shard_dir)
+            search_file = os.path.join(shard_dir, SEARCH_INDEX_FILE)
+            if search_index:
+                write_if_changed(search_file, search_index_script(search_index))
+            elif os.path.exists(search_file):
+                os.remove(search_file)
+        if picture_dir:
+            write_media_files(images, picture_dir)
+
+        # Leave the file (and its modification time) alone when nothing changed
+        changed = write_stream_if_changed(output_filename, stats.timed_iter("serialize", page))
+        if changed:
+            log(f"Done! Created {output_filename}")
+        else:
+            log(f"Done! {output_filename} is already up to date.")
+        stats.count("output_bytes", os.path.getsize(output_filename))
+
+        if release:
+            artifacts = [output_filename] + write_compressed_copies(output_filename, changed=changed)
+            report_sizes(artifacts)
+            for path in artifacts[1:]:
+                stats.count(path.rpartition(".")[2] + "_bytes", os.path.getsize(path))
+        else:
+            remove_compressed_copies(output_filename)
+
+# ==========================================
+# SEARCH INDEX (Full-Text, CJK-Aware)
+# ==========================================
+# --search adds an inverted index so the player can find a remembered line
+# without scanning every scene. Latin (and other space-separated) text is
+# indexed by word. Chinese, Japanese and Korean runs are indexed as overlapping
+# character bigrams plus the run's last character, so any substring of two or
+# more characters is the intersection of its bigrams, and single characters are
+# found by prefix. Postings point at (scene, slot): slot 0 is the title, slot
+# k the k-th paragraph. They are delta-encoded and written as base64 VLQ digits
+# (as in source maps), which keeps the index a fraction of the story's size.
+# The player tokenizes queries the same way (searchTokens()).
+
+CJK_RANGES = "\u3040-\u30ff\u3400-\u4dbf\u4e00-\u9fff\uf900-\ufaff\uac00-\ud7af\U00020000-\U0002fa1f"
+search_token_pattern = re.compile(f"([{CJK_RANGES}]+)|([^\\W_{CJK_RANGES}]+)")
+html_tag_pattern = re.compile(r"<[^>]*>")
+VLQ_DIGITS = "ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz0123456789+/"
+
+
+def search_tokens(text):
+    """Index terms of plain text: lower-cased words, CJK bigrams and run-final characters."""
+    tokens = []
+    for cjk, word in search_token_pattern.findall(unicodedata.normalize("NFKC", text).lower()):
+        if word:
+            tokens.append(word)
+        else:
+            tokens.extend(cjk[i:i + 2] for i in range(len(cjk) - 1))
+            tokens.append(cjk[-1])
+    return tokens
+
+
+def scene_slots(title, text):
+    """Title and paragraphs of a scene as plain text, in index slot order."""
+    paragraphs = text[3:-4].split("</p><p>") if text.startswith("<p>") and text.endswith("</p>") else [text]
+    return [title] + [html.unescape(html_tag_pattern.sub("", paragraph)) for paragraph in paragraphs]
+
+
+def _vlq(numbers):
+    digits = []
+    for number in numbers:
+        while number > 31:
+            digits.append(VLQ_DIGITS[32 | number & 31])
+            number >>= 5
+        digits.append(VLQ_DIGITS[number])
+    return "".join(digits)
+
+
+def build_search_index(story_data, stats=None):
+    """Return {"terms": space-separated sorted terms, "postings": one VLQ string per term}."""
+    stats = stats or BuildStats()
+    postings = collections.defaultdict(list)
+    for index, (title, scene) in enumerate(story_data.items()):
+        for slot, plain in enumerate(scene_slots(title, scene.text)):
+            for token in set(search_tokens(plain)):
+                postings[token].append((index, slot))
+
+    # In UTF-16 code unit order, the order of JavaScript string comparison (the
+    # player binary-searches this list)
+    terms = sorted(postings, key=lambda term: term.encode("utf-16-be"))
+    encoded = []
+    for term in terms:
+        # (scene delta, slot) pairs; within one scene the slot is a delta as well
+        numbers = []
+        last_scene = last_slot = 0
+        for scene, slot in postings[term]:
+            numbers += (scene - last_scene, slot - last_slot if scene == last_scene else slot)
+            last_scene, last_slot = scene, slot
+        encoded.append(_vlq(numbers))
+    stats.count("search_terms", len(terms))
+    return { "terms": " ".join(terms), "postings": encoded }
+
+
+def search_index_json(search_index):
+    return script_safe_json(search_index, separators=(",", ":"))
+
+
+def search_index_script(search_index):
+    # Sidecar and site builds load the index as a script, like the scene shards
+    return f"storySearchIndex({search_index_json(search_index)});\n"
+
+
+# ==========================================
+# SITE OUTPUT (Versioned Assets + Service Worker)
+# ==========================================
+# --payload site splits the page into files named after a hash of their content:
+# the player's CSS and JavaScript, the story index, one script per scene and the
+# pictures, all in a "<name>_assets" folder. A service worker ("<name>.sw.js")
+# precaches the page shell and caches every other asset the first time it is
+# used, so a reader who comes back after an update only downloads the files whose
+# content changed. Everything is loaded with plain <link> and <script> tags, so
+# the site also works from file:// (where service workers are not available).
+
+template_style_pattern = re.compile(r"<style>(.*?)</style>", re.DOTALL)
+template_script_pattern = re.compile(r"<script>(.*?)</script>", re.DOTALL)
+
+SERVICE_WORKER_TEMPLATE = """// Service worker for SCOPE_NAME, generated by Converter.py
+const CACHE_PREFIX = 'interactive-novel:SCOPE_NAME:';
+const SHELL_CACHE = CACHE_PREFIX + 'shell-SHELL_VERSION';
+const ASSET_CACHE = CACHE_PREFIX + 'assets';
+const PAGES = PAGE_URLS;
+const SHELL = SHELL_URLS;
+const STORY_INDEX = STORY_INDEX_URL;
+const ASSETS = ASSETS_URL;
+
+const absolute = (path) => new URL(path, self.location).href;
+
+self.addEventListener('install', (event) => {
+    event.waitUntil(caches.open(SHELL_CACHE)
+        .then((cache) => cache.addAll(SHELL))
+        .then(() => self.skipWaiting()));
+});
+
+self.addEventListener('activate', (event) => {
+    event.waitUntil((async () => {
+        for (const name of await caches.keys()) {
+            if (name.startsWith(CACHE_PREFIX) && name !== SHELL_CACHE && name !== ASSET_CACHE) {
+                await caches.delete(name);
+            }
+        }
+        // Forget the scenes and pictures the current story no longer uses
+        const index = await (await caches.match(absolute(STORY_INDEX))).text();
+        const story = JSON.parse(index.slice(index.indexOf('{'), index.lastIndexOf('}') + 1));
+        const keep = new Set(story.shardFiles.map((name) => absolute(story.shardPath + '/' + name)));
+        Object.values(story.images || {}).forEach(([src]) => keep.add(absolute(src)));
+        if (story.searchIndex) keep.add(absolute(story.searchIndex));
+        const assets = await caches.open(ASSET_CACHE);
+        for (const request of await assets.keys()) {
+            if (!keep.has(request.url)) await assets.delete(request);
+        }
+        await self.clients.claim();
+    })());
+});
+
+self.addEventListener('fetch', (event) => {
+    const request = event.request;
+    if (request.method !== 'GET') return;
+    const url = request.url.split('#')[0].split('?')[0];
+
+    if (PAGES.some((page) => absolute(page) === url)) {
+        // The page: network first so updates show up, the cached shell when offline
+        event.respondWith(fetch(request).catch(() => caches.match(absolute(PAGES[0]))));
+    } else if (url.startsWith(absolute(ASSETS))) {
+        // Asset names carry a content hash, so a cached copy is never out of date
+        event.respondWith(caches.match(request).then((cached) => cached || fetch(request).then((response) => {
+            if (response.ok) {
+                const copy = response.clone();
+                caches.open(ASSET_CACHE).then((cache) => cache.put(request, copy));
+            }
+            return response;
+        })));
+    }
+});
+"""
+
+service_worker_placeholder_pattern = re.compile(
+    r"SCOPE_NAME|SHELL_VERSION|PAGE_URLS|SHELL_URLS|STORY_INDEX_URL|ASSETS_URL")
+
+
+def content_hash(content):
+    data = content if isinstance(content, bytes) else content.encode("utf-8")
+    return hashlib.sha256(data).hexdigest()[:10]
+
+
+def site_assets_dir(output_filename):
+    return os.path.splitext(output_filename)[0] + "_assets"
+
+
+def build_site(story_data, output_filename, release=False, config=None, images=None, search_index=None,
+               stats=None):
+    """Lay out the site. Returns ({path: content}, shell paths); paths are relative
+    to the page's folder and the page itself is included."""
+    page = os.path.basename(output_filename)
+    stem = os.path.splitext(page)[0]
+    assets = os.path.basename(site_assets_dir(output_filename))
+    json_format = { "separators": (",", ":") } if release else {}
+    files = {}
+
+    def add(folder, name, extension, content):
+        path = f"{folder}/{name}.{content_hash(content)}{extension}"
+        files[path] = content
+        return path
+
+    # Scenes: one script per scene, loaded on first visit like the sidecar payload.
+    # A shard names its scene, choice targets and variables instead of using their
+    # indexes, and there is no shared string table (see serialize_story()), so
+    # its file, and its hash, only change when the scene itself does: not when a
+    # scene is added or removed before it.
+    table = build_story_table(story_data, by_name=True)
+    shard_files = []
+    for title, scene in zip(table["titles"], table.pop("scenes")):
+        path = add(f"{assets}/scenes", "scene", ".js",
+                   f"storyShard({script_safe_json(title)}, {script_safe_json(scene, **json_format)});\n")
+        shard_files.append(path.rpartition("/")[2])
+    table.update({
+        "scenes": [],
+        "shards": "sidecar",
+        "shardPath": urllib.parse.quote(f"{assets}/scenes"),
+        "shardFiles": shard_files,
+        "serviceWorker": { "script": urllib.parse.quote(stem + ".sw.js"),
+                           # index.html is also served as the folder itself
+                           "scope": "./" if stem == "index" else "./" + urllib.parse.quote(stem) },
+    })
+    if images:
+        table["images"] = image_table(images, urllib.parse.quote(f"{assets}/media"))
+        for key, (mime, data, _, _) in images.items():
+            files[f"{assets}/media/{key}{MEDIA_EXTENSIONS[mime]}"] = data
+    if search_index:
+        # Fetched (and cached) the first time the reader searches
+        table["searchIndex"] = urllib.parse.quote(add(assets, "search", ".js", search_index_script(search_index)))
+
+    # The player itself does not depend on the story, so it stays cached across updates
+    template = release_template() if release else HTML_TEMPLATE
+    player_js = fill_template(template_script_pattern.search(template).group(1), {
+        "STORY_DATA_PLACEHOLDER": "window.storyIndex",
+        "PLAYER_CONFIG_PLACEHOLDER": json.dumps(config or player_config()),
+        "STORY_SHARDS_PLACEHOLDER": "",
+    })
+    css = add(assets, "player", ".css", template_style_pattern.search(template).group(1))
+    player = add(assets, "player", ".js", player_js)
+    story_index = add(assets, "story", ".js",
+                      f"window.storyIndex = {script_safe_json(table, **(json_format or { 'indent': 4 }))};\n")
+
+    page_html = template_style_pattern.sub(
+        lambda m: f'<link rel="stylesheet" href="{urllib.parse.quote(css)}">', template, count=1)
+    page_html = template_script_pattern.sub(
+        lambda m: f'<script src="{urllib.parse.quote(story_index)}"></script>'
+                  f'<script src="{urllib.parse.quote(player)}"></script>', page_html, count=1)
+    files[page] = page_html.replace("STORY_SHARDS_PLACEHOLDER", "")
+
+    shell = [page, css, player, story_index]
+    worker = service_worker_placeholder_pattern.sub(lambda m: {
+        "SCOPE_NAME": re.sub(r"[^\w.-]", "_", stem),
+        "SHELL_VERSION": content_hash("".join(shell)),  # Names already carry the content hashes
+        "PAGE_URLS": json.dumps(["./" + urllib.parse.quote(page)] + (["./"] if stem == "index" else [])),
+        "SHELL_URLS": json.dumps([urllib.parse.quote(path) for path in shell]),
+        "STORY_INDEX_URL": json.dumps(urllib.parse.quote(story_index)),
+        "ASSETS_URL": json.dumps(urllib.parse.quote(assets + "/")),
+    }[m.group(0)], SERVICE_WORKER_TEMPLATE)
+    files[stem + ".sw.js"] = worker
+    return files, shell
+
+
+def write_site(files, shell, output_filename, release=False):
+    """Write the site next to output_filename and remove assets of earlier builds."""
+    root = os.path.dirname(output_filename)
+    assets = site_assets_dir(output_filename)
+    expected = { os.path.normpath(os.path.join(root, path)) for path in files }
+    if release:
+        expected.update(os.path.normpath(os.path.join(root, path + ext)) for path in shell for ext in (".gz", ".br"))
+
+    changed = set()
+    for path, content in files.items():
+        filename = os.path.join(root, path)
+        os.makedirs(os.path.dirname(filename) or ".", exist_ok=True)
+        if write_if_changed(filename, content):
+            changed.add(path)
+    log(f"Site: {len(files)} file(s), {len(changed)} changed.", VERBOSE)
+
+    # Hashed names change with the content, so old versions are left behind otherwise
+    for folder, _, names in os.walk(assets):
+        for name in names:
+            if os.path.normpath(os.path.join(folder, name)) not in expected:
+                os.remove(os.path.join(folder, name))
+    log(f"Done! Created {output_filename} with its assets and service worker")
+
+    if release:
+        artifacts = []
+        for index, path in enumerate(shell):
+            filename = os.path.join(root, path)
+            artifacts += [filename] + write_compressed_copies(filename, note=index == 0, changed=path in changed)
+        report_sizes(artifacts)
+    else:
+        for path in shell:
+            remove_compressed_copies(os.path.join(root, path))
+
+# ==========================================
+# LIBRARY API (In-Memory Conversion)
+# ==========================================
+# For programs that hold the document in memory, such as an upload handler:
+# the .docx comes in as bytes or a file object and the page goes out as bytes
+# or into a binary stream. Nothing is written to disk and the parse cache is
+# not used. Only the single-file payloads are available; sidecar and site
+# output are folders of files.
+#
+#     html = Converter.convert_bytes(upload, release=True)
+#     Converter.convert_stream(request.stream, response, payload="shards")
+
+STREAM_PAYLOADS = ("inline", "shards")
+STREAM_CHUNK_BYTES = 64 * 1024
+
+
+def _open_source(source):
+    if isinstance(source, (bytes, bytearray, memoryview)):
+        return io.BytesIO(source)
+    if not source.seekable():
+        # A pipe or socket: the ZIP directory is at the end of the file
+        return io.BytesIO(source.read())
+    return source
+
+
+def convert_stream(source, out, payload="inline", release=False, config=None, prune_unreachable=False,
+                   max_image_size=MAX_IMAGE_SIZE, search=False, rich_text=False, stats=None):
+    """Convert a .docx given as bytes or a binary file object, writing the page to `out`.
+
+    Returns the number of bytes written. Raises ValueError if the document has
+    no scenes, and zipfile.BadZipFile or ET.ParseError if it is not a readable .docx.
+    """
+    if payload not in STREAM_PAYLOADS:
+        raise ValueError(f"Payload {payload!r} writes several files; use one of {', '.join(STREAM_PAYLOADS)}.")
+    stats = stats or BuildStats()
+    source = _open_source(source)
+    data = parse_docx(source, stats=stats, rich_text=rich_text)
+    if not data:
+        raise ValueError("No scenes found. Please check Heading 1 styles and try again.")
+    with stats.phase("links"):
+        data = check_links(data, prune=prune_unreachable, stats=stats)
+    with stats.phase("images"):
+        images = prepare_images(source, data, max_image_size, stats=stats)
+    search_index = None
+    if search:
+        with stats.phase("search"):
+            search_index = build_search_index(data, stats)
+    with stats.phase("serialize"):
+        page, _ = render_page(data, payload, release, config, images, search_index, stats=stats)
+
+    # The page comes in many small pieces; a socket should not get one write per piece
+    written = 0
+    with stats.phase("write"):
+        chunk = bytearray()
+        for piece in stats.timed_iter("serialize", page):
+            chunk += piece.encode("utf-8")
+            if len(chunk) >= STREAM_CHUNK_BYTES:
+                out.write(chunk)
+                written += len(chunk)
+                chunk.clear()
+        out.write(chunk)
+        written += len(chunk)
+    stats.count("output_bytes", written)
+    return written
+
+
+def convert_bytes(source, **options):
+    """Convert a .docx given as bytes or a binary file object; returns the page as bytes.
+
+    Takes the keyword options of convert_stream().
+    """
+    out = io.BytesIO()
+    convert_stream(source, out, **options)
+    return out.getvalue()
+
+# ==========================================
+# COMMAND LINE (Single File + Batch)
+# ==========================================
+
+def convert_file(input_filename, output_filename, use_cache=True, payload="inline", release=False, config=None,
+                 prune_unreachable=False, analytics=False, max_image_size=MAX_IMAGE_SIZE, image_workers=1,
+                 search=False, rich_text=False, parse_workers=1, stats=None):
+    """Convert one document. Returns True if an HTML file was produced."""
+    stats = stats or BuildStats()
+    cache = ParseCache(input_filename, rich_text=rich_text) if use_cache else None
+    data = parse_docx(input_filename, cache=cache, stats=stats, rich_text=rich_text, workers=parse_workers)
+    images = None
+    if data:
+        with stats.phase("links"):
+            data = check_links(data, prune=prune_unreachable, stats=stats)
+        with stats.phase("images"):
+            images = prepare_images(input_filename, data, max_image_size, image_workers,
+                                    cache.media_dir if cache is not None else None, stats)
+    generate_html(data, output_filename, payload=payload, release=release, config=config, images=images,
+                  search=search, stats=stats)
+    if analytics and data:
+        import story_analytics  # Imported here: it builds on this module
+        with stats.phase("analytics"):
+            report_path = story_analytics.analytics_path(output_filename)
+            story_analytics.write_report(story_analytics.analyze_story(data), report_path)
+        log(f"Analytics saved to {report_path}")
+    if cache is not None and data:
+        cache.report()
+    return bool(data)
+
+def _init_worker(verbosity):
+    global VERBOSITY
+    VERBOSITY = verbosity
+
+def _convert_job(job):
+    # Runs in a worker process: any failure is reported back instead of stopping the batch
+    input_filename, output_filename, options = job
+    stats = BuildStats()
+    start = time.perf_counter()
+    try:
+        error = None if convert_file(input_filename, output_filename, stats=stats, **options) else "no scenes produced"
+    except Exception as e:
+        error = f"{type(e).__name__}: {e}"
+    return input_filename, output_filename, error, time.perf_counter() - start, stats.as_dict()
+
+def collect_inputs(paths):
+    """Expand directories into the .docx files they contain (Word lock files are skipped)."""
+    inputs = []
+    for path in paths:
+        if os.path.isdir(path):
+            for name in sorted(os.listdir(path)):
+                if name.lower().endswith(".docx") and not name.startswith("~$"):
+                    inputs.append(os.path.join(path, name))
+        else:
+            inputs.append(path)
+    return inputs
+
+def output_for(input_filename, output_dir):
+    stem = os.path.splitext(os.path.basename(input_filename))[0]
+    return os.path.join(output_dir or os.path.dirname(input_filename), stem + ".html")
+
+def run_batch(jobs, workers):
+    """Convert all jobs; returns (results, elapsed seconds)."""
+    start = time.perf_counter()
+    if workers > 1 and len(jobs) > 1:
+        with concurrent.futures.ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                                                    initargs=(VERBOSITY,)) as pool:
+            results = list(pool.map(_convert_job, jobs))
+    else:
+        results = [_convert_job(job) for job in jobs]
+    elapsed = time.perf_counter() - start
+
+    failed = [r for r in results if r[2]]
+    log(f"\nConverted {len(results) - len(failed)} of {len(results)} file(s) in {elapsed:.2f}s "
+        f"({min(workers, len(jobs))} worker(s))")
+    for input_filename, output_filename, error, seconds, _ in results:
+        if error:
+            warn(f"  FAILED {seconds:7.2f}s  {input_filename}: {error}")
+        else:
+            log(f"  OK     {seconds:7.2f}s  {input_filename} -> {output_filename}")
+    return results, elapsed
+
+def _convert(args, inputs, options, workers):
+    """Run the conversion(s) and return the --stats-json document."""
+    if len(inputs) == 1 and not args.batch:
+        stats = BuildStats()
+        start = time.perf_counter()
+        # A single document can use the worker processes for its pictures, and to parse it if it is large
+        ok = convert_file(inputs[0], args.output, image_workers=workers, parse_workers=workers, stats=stats,
+                          **options)
+        stats.report()
+        result = (inputs[0], args.output, None if ok else "no scenes produced",
+                  time.perf_counter() - start, stats.as_dict())
+        results, elapsed = [result], result[3]
+    else:
+        jobs = [(path, output_for(path, args.output_dir), options) for path in inputs]
+        results, elapsed = run_batch(jobs, workers)
+
+    return {
+        "total_seconds": round(elapsed, 6),
+        "files": [
+            { "input": i, "output": o, "error": e, "seconds": round(t, 6), **stats }
+            for i, o, e, t, stats in results
+        ],
+    }
+
+def main(argv=None):
+    global VERBOSITY
+    parser = argparse.ArgumentParser(description="Convert Word stories into interactive HTML novels.")
+    parser.add_argument("inputs", nargs="*", default=[INPUT_FILENAME], metavar="input",
+                        help=f"source .docx files or folders of them (default: {INPUT_FILENAME})")
+    parser.add_argument("-o", "--output", help=f"HTML file to write for a single input (default: {OUTPUT_FILENAME})")
+    parser.add_argument("-d", "--output-dir", help="folder for the HTML files (default: next to each input)")
+    parser.add_argument("-j", "--jobs", type=int, default=os.cpu_count() or 1,
+                        help="worker processes for batch conversion, or for the pictures and parsing of a single "
+                             "large document (default: one per CPU)")
+    parser.add_argument("--no-cache", action="store_true", help="re-parse every scene and do not touch the parse cache")
+    parser.add_argument("--payload", choices=PAYLOAD_MODES, default="inline",
+                        help="inline: one JSON literal (default); shards: one JSON block per scene, parsed on first visit; "
+                             "sidecar: one script file per scene in a folder next to the HTML; "
+                             "site: content-hashed CSS/JS/scene files plus a service worker for offline reading")
+    parser.add_argument("--release", action="store_true",
+                        help="compact JSON, minified CSS/JS, plus .gz/.br copies of the output")
+    parser.add_argument("--prune-unreachable", action="store_true",
+                        help="leave out scenes that no chain of choices from the first scene reaches")
+    parser.add_argument("--max-image-size", type=int, default=MAX_IMAGE_SIZE, metavar="PX",
+                        help=f"scale pictures down to at most PX pixels on their longest side (needs Pillow; "
+                             f"default: {MAX_IMAGE_SIZE})")
+    parser.add_argument("--rich-text", action="store_true",
+                        help="keep bold, italic, underline and strikethrough from Word in the story text "
+                             "(the text is then HTML-escaped rather than passed through)")
+    parser.add_argument("--search", action="store_true",
+                        help="add a full-text search panel (words, and character pairs for Chinese/Japanese/Korean)")
+    parser.add_argument("--analytics", action="store_true",
+                        help="also write playthrough counts, routes to each ending and visit probabilities "
+                             "to <output>.analytics.json")
+    parser.add_argument("--autosave-cap", type=int, metavar="N",
+                        help=f"keep at most N unnamed saves per browser (default: {PLAYER_DEFAULTS['autosaveCap']})")
+    parser.add_argument("--render-cache", type=int, metavar="N",
+                        help=f"scenes the player keeps rendered, including prefetched choice targets "
+                             f"(default: {PLAYER_DEFAULTS['renderCacheSize']}, 0 disables)")
+    parser.add_argument("--progressive-threshold", type=int, metavar="CHARS",
+                        help=f"render scene texts longer than this a few paragraphs per frame "
+                             f"(default: {PLAYER_DEFAULTS['progressiveThreshold']}, 0 disables)")
+    parser.add_argument("--perf", action="store_true",
+                        help="show a timing overlay in the player (scene rendering, saves, DOM size) with a JSON "
+                             "export; any build shows it when opened with ?perf=1")
+    verbosity = parser.add_mutually_exclusive_group()
+    verbosity.add_argument("-q", "--quiet", action="store_true", help="only print warnings and errors")
+    verbosity.add_argument("-v", "--verbose", action="store_true",
+                           help="list every scene and print phase timings and counters")
+    parser.add_argument("--serve", action="store_true",
+                        help="preview the story in the browser and update open pages whenever the document is saved")
+    parser.add_argument("--service", action="store_true",
+                        help="run a local HTTP conversion service instead: POST a .docx to /convert and get the page "
+                             "back, converted in -j warm worker processes (see conversion_service.py)")
+    parser.add_argument("--port", type=int, default=8000, help="port for --serve and --service (default: 8000)")
+    parser.add_argument("--stats-json", metavar="PATH", help="write phase timings and counters as JSON")
+    parser.add_argument("--profile", metavar="PATH",
+                        help="run the conversion under cProfile and save the profile (batches run in-process)")
+    args = parser.parse_args(argv)
+
+    VERBOSITY = QUIET if args.quiet else VERBOSE if args.verbose else NORMAL
+    options = {
+        "use_cache": not args.no_cache,
+        "payload": args.payload,
+        "release": args.release,
+        "config": player_config(autosaveCap=args.autosave_cap, renderCacheSize=args.render_cache,
+                                progressiveThreshold=args.progressive_threshold, perf=args.perf or None),
+        "prune_unreachable": args.prune_unreachable,
+        "analytics": args.analytics,
+        "search": args.search,
+        "rich_text": args.rich_text,
+        "max_image_size": args.max_image_size,
+    }
+    if args.service:
+        if args.payload not in STREAM_PAYLOADS:
+            parser.error(f"--service produces single-file pages; use --payload {' or '.join(STREAM_PAYLOADS)}")
+        import conversion_service  # Imported here: it builds on this module
+        service_options = { key: value for key, value in options.items() if key not in ("use_cache", "analytics") }
+        return conversion_service.serve(service_options, args.port, workers=max(1, args.jobs))
+
+    inputs = collect_inputs(args.inputs)
+    if not inputs:
+        parser.error("no .docx files found")
+
+    if args.serve:
+        if len(inputs) > 1:
+            parser.error("--serve previews a single input")
+        import dev_server  # Imported here: it builds on this module
+        return dev_server.serve(inputs[0], options, args.port)
+
+    # One file keeps the classic behaviour: convert in-process, no batch summary
+    args.batch = len(inputs) > 1 or any(os.path.isdir(p) for p in args.inputs)
+    if not args.batch:
+        args.output = args.output or (output_for(inputs[0], args.output_dir) if args.output_dir else OUTPUT_FILENAME)
+    else:
+        if args.output:
+            parser.error("-o/--output needs a single input; use --output-dir for several")
+        if args.output_dir:
+            os.makedirs(args.output_dir, exist_ok=True)
+        outputs = [output_for(path, args.output_dir) for path in inputs]
+        duplicates = sorted({o for o in outputs if outputs.count(o) > 1})
+        if duplicates:
+            parser.error("several inputs would write " + ", ".join(duplicates))
+
+    # Worker processes are invisible to the profiler, so a profiled batch runs in-process
+    workers = 1 if args.profile else max(1, args.jobs)
+    if args.profile:
+        profiler = cProfile.Profile()
+        report = profiler.runcall(_convert, args, inputs, options, workers)
+        profiler.dump_stats(args.profile)
+        log(f"Profile saved to {args.profile} (view with: python -m pstats {args.profile})")
+        if VERBOSITY >= VERBOSE:
+            pstats.Stats(profiler).sort_stats("cumulative").print_stats(15)
+    else:
+        report = _convert(args, inputs, options, workers)
+
+    if args.stats_json:
+        with open(args.stats_json, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+
+    return 1 if any(entry["error"] for entry in report["files"]) else 0
 
 if __name__ == "__main__":
-    data = parse_docx(INPUT_FILENAME)
-    generate_html(data)
+    sys.exit(main())
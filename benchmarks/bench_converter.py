@@ -0,0 +1,200 @@
+"""
+Benchmark suite for Converter.py.
+
+Each case generates a synthetic manuscript (see synthetic_docx.py) and runs
+the conversion phases in a fresh Python process, so peak RSS is measured
+per case rather than accumulated over the whole run. Memory per phase is the
+peak of Python allocations (tracemalloc) during that phase alone, taken in an
+extra untimed run so that tracing does not slow the timed ones. Results are
+written as JSON and can be compared against an earlier run:
+
+    python benchmarks/bench_converter.py -o results.json
+    python benchmarks/bench_converter.py --cases medium-latin --compare results.json
+"""
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(BENCH_DIR)
+
+# Manuscript shapes, in the parameters of synthetic_docx.write_docx
+CASES = {
+    "small-latin": { "scenes": 100, "paragraphs": 10, "choices": 2, "text": "latin" },
+    "medium-latin": { "scenes": 1000, "paragraphs": 20, "choices": 3, "text": "latin" },
+    "medium-cjk": { "scenes": 1000, "paragraphs": 20, "choices": 3, "text": "cjk" },
+    "prose-latin": { "scenes": 200, "paragraphs": 200, "choices": 1, "text": "latin", "metadata": 0.1 },
+    "many-choices": { "scenes": 2000, "paragraphs": 3, "choices": 8, "text": "mixed" },
+    "large-mixed": { "scenes": 5000, "paragraphs": 30, "choices": 3, "text": "mixed" },
+}
+DEFAULT_CASES = ("small-latin", "medium-latin", "medium-cjk", "prose-latin", "many-choices")
+
+
+def peak_rss_bytes():
+    try:
+        import resource
+    except ImportError:  # Windows
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, macOS bytes
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+def peak_allocated_bytes(func):
+    """Peak Python memory allocated while func runs, on top of what was allocated before."""
+    tracemalloc.start()
+    try:
+        func()
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def timed(repeat, func):
+    """Run func `repeat` times; return (best wall time, last result)."""
+    best = None
+    result = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best, result
+
+
+def run_case(spec, workdir, repeat=1):
+    """Worker side: generate the manuscript and time each phase in this process."""
+    sys.path.insert(0, REPO_DIR)
+    sys.path.insert(0, BENCH_DIR)
+    import Converter
+    import synthetic_docx
+
+    source = os.path.join(workdir, "Story.docx")
+    output = os.path.join(workdir, "Interactive_novel.html")
+    paragraphs = synthetic_docx.write_docx(source, **spec)
+    phases = {}
+
+    def record(name, seconds, func, **extra):
+        phases[name] = dict(wall_seconds=round(seconds, 6),
+                            paragraphs_per_second=round(paragraphs / seconds) if seconds else None,
+                            peak_alloc_bytes=peak_allocated_bytes(func), **extra)
+
+    # The converter reports progress on stdout; keep it out of the measurements
+    with contextlib.redirect_stdout(io.StringIO()):
+        rss_start = peak_rss_bytes()
+        # Converter.BuildStats splits each phase further (load/classify/serialize/...)
+        stats = Converter.BuildStats()
+        seconds, story = timed(repeat, lambda: Converter.parse_docx(source, stats=stats))
+        record("parse", seconds, lambda: Converter.parse_docx(source), scenes=len(story))
+
+        def generate(stats=None):
+            if os.path.exists(output):
+                os.remove(output)
+            Converter.generate_html(story, output, stats=stats)
+        seconds, _ = timed(repeat, lambda: generate(stats))
+        record("generate", seconds, generate, output_bytes=os.path.getsize(output))
+
+    return {
+        "spec": spec,
+        "paragraphs": paragraphs,
+        "input_bytes": os.path.getsize(source),
+        "rss_start_bytes": rss_start,
+        # Process peak over all phases and repeats (ru_maxrss never goes down)
+        "peak_rss_bytes": peak_rss_bytes(),
+        "phases": phases,
+        # Summed over all repeats
+        "breakdown_seconds": stats.as_dict()["phases"],
+    }
+
+
+def run_isolated(name, spec, repeat):
+    with tempfile.TemporaryDirectory(prefix="bench-") as workdir:
+        proc = subprocess.run(
+            [sys.executable, os.path.abspath(__file__), "--worker", json.dumps(spec), workdir, str(repeat)],
+            capture_output=True, text=True)
+    if proc.returncode != 0:
+        raise RuntimeError(f"case {name} failed:\n{proc.stderr}")
+    return json.loads(proc.stdout.strip().splitlines()[-1])
+
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=REPO_DIR,
+                              capture_output=True, text=True).stdout.strip() or None
+    except OSError:
+        return None
+
+
+def print_results(results):
+    print(f"{'case':<14} {'phase':<10} {'seconds':>9} {'para/s':>10} {'peak alloc MB':>14} {'output KB':>10}")
+    for name, case in results["cases"].items():
+        for phase, m in case["phases"].items():
+            alloc = f"{m['peak_alloc_bytes'] / 2**20:.1f}" if m.get("peak_alloc_bytes") else "-"
+            size = f"{m['output_bytes'] / 1024:.0f}" if "output_bytes" in m else ""
+            print(f"{name:<14} {phase:<10} {m['wall_seconds']:>9.3f} {m['paragraphs_per_second'] or 0:>10,} "
+                  f"{alloc:>14} {size:>10}")
+        if case.get("peak_rss_bytes"):
+            print(f"{name:<14} {'(process peak RSS, all phases)':<35} {case['peak_rss_bytes'] / 2**20:>14.1f}")
+
+
+def print_comparison(results, baseline):
+    print(f"\nCompared with {baseline.get('commit') or 'baseline'}:")
+    for name, case in results["cases"].items():
+        old_case = baseline.get("cases", {}).get(name)
+        if not old_case:
+            continue
+        for phase, m in case["phases"].items():
+            old = old_case["phases"].get(phase)
+            if not old:
+                continue
+            ratio = m["wall_seconds"] / old["wall_seconds"] if old["wall_seconds"] else float("nan")
+            line = f"  {name:<14} {phase:<10} time x{ratio:.2f}"
+            if m.get("peak_alloc_bytes") and old.get("peak_alloc_bytes"):
+                line += f"  alloc x{m['peak_alloc_bytes'] / old['peak_alloc_bytes']:.2f}"
+            if "output_bytes" in m and old.get("output_bytes"):
+                line += f"  size x{m['output_bytes'] / old['output_bytes']:.2f}"
+            print(line)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark parse_docx and generate_html on synthetic stories.")
+    parser.add_argument("--cases", nargs="+", choices=sorted(CASES), default=list(DEFAULT_CASES))
+    parser.add_argument("--repeat", type=int, default=3, help="runs per phase; the best wall time is kept")
+    parser.add_argument("-o", "--output", help="write the results as JSON")
+    parser.add_argument("--compare", help="earlier results JSON to compare against")
+    args = parser.parse_args(argv)
+
+    results = {
+        "commit": git_commit(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "cases": {},
+    }
+    for name in args.cases:
+        print(f"Running {name}...", file=sys.stderr)
+        results["cases"][name] = run_isolated(name, CASES[name], args.repeat)
+
+    print_results(results)
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            print_comparison(results, json.load(f))
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+        print(f"\nSaved {args.output}")
+
+
+if __name__ == "__main__":
+    if len(sys.argv) == 5 and sys.argv[1] == "--worker":
+        print(json.dumps(run_case(json.loads(sys.argv[2]), sys.argv[3], int(sys.argv[4]))))
+    else:
+        main()
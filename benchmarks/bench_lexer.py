@@ -0,0 +1,93 @@
+"""
+Micro-benchmark for paragraph classification.
+
+Compares Converter.classify_paragraph (single pass with character
+prefilters) against the previous per-paragraph regex cascade on the
+paragraph streams of synthetic manuscripts, prose-heavy ones in particular.
+Both classifiers are checked to agree on every paragraph before timing.
+
+    python benchmarks/bench_lexer.py
+    python benchmarks/bench_lexer.py --cases prose-latin prose-cjk -o lexer.json
+"""
+import argparse
+import json
+import os
+import re
+import sys
+import time
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCH_DIR))
+sys.path.insert(0, BENCH_DIR)
+
+import Converter  # noqa: E402
+import synthetic_docx  # noqa: E402
+
+CASES = {
+    "prose-latin": { "scenes": 200, "paragraphs": 200, "choices": 1, "text": "latin", "metadata": 0.1 },
+    "prose-cjk": { "scenes": 200, "paragraphs": 200, "choices": 1, "text": "cjk", "metadata": 0.1 },
+    "choice-heavy": { "scenes": 2000, "paragraphs": 3, "choices": 8, "text": "mixed", "metadata": 1.0 },
+}
+
+# The classification as it was done before classify_paragraph()
+metadata_line_pattern = re.compile(r"^METADATA\s*:(.*)$", re.IGNORECASE)
+choice_pattern = re.compile(r"[\[【](.*?)\s*(?:->|=>|→)\s*(.*?)[\]】]")
+
+
+def legacy_classify(text):
+    meta_line_match = metadata_line_pattern.match(text)
+    if meta_line_match:
+        return Converter.METADATA, meta_line_match.group(1).strip()
+    choices_found = list(choice_pattern.finditer(text))
+    if choices_found:
+        return Converter.CHOICES, [(m.group(1).strip(), m.group(2).strip()) for m in choices_found]
+    return Converter.TEXT, text
+
+
+def body_paragraphs(spec):
+    return [text for style, text in synthetic_docx.iter_manuscript(**spec) if not style]
+
+
+def best_time(func, paragraphs, repeat):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for text in paragraphs:
+            func(text)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Compare paragraph classifiers on synthetic manuscripts.")
+    parser.add_argument("--cases", nargs="+", choices=sorted(CASES), default=sorted(CASES))
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("-o", "--output", help="write the results as JSON")
+    args = parser.parse_args(argv)
+
+    results = {}
+    print(f"{'case':<14} {'paragraphs':>10} {'legacy ms':>10} {'lexer ms':>10} {'speedup':>8}")
+    for name in args.cases:
+        paragraphs = body_paragraphs(CASES[name])
+        for text in paragraphs:
+            if legacy_classify(text) != Converter.classify_paragraph(text):
+                raise SystemExit(f"classifiers disagree on {text!r}")
+
+        legacy = best_time(legacy_classify, paragraphs, args.repeat)
+        lexer = best_time(Converter.classify_paragraph, paragraphs, args.repeat)
+        results[name] = {
+            "paragraphs": len(paragraphs),
+            "legacy_seconds": round(legacy, 6),
+            "lexer_seconds": round(lexer, 6),
+            "speedup": round(legacy / lexer, 2),
+        }
+        print(f"{name:<14} {len(paragraphs):>10,} {legacy * 1000:>10.1f} {lexer * 1000:>10.1f} {legacy / lexer:>7.2f}x")
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,109 @@
+"""
+Benchmark for the rich-text path (--rich-text).
+
+Parses synthetic manuscripts with formatted stretches that Word-style split
+over several runs, once as plain text and once as rich text, and compares
+parse time and the size of the scene texts. The size the story text would
+have if every run were wrapped in tags of its own (no coalescing) is shown
+for comparison.
+
+    python benchmarks/bench_rich_text.py
+    python benchmarks/bench_rich_text.py --cases prose-latin --repeat 5 -o rich.json
+"""
+import argparse
+import contextlib
+import io
+import json
+import os
+import sys
+import tempfile
+import time
+import zipfile
+import xml.etree.ElementTree as ET
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCH_DIR))
+sys.path.insert(0, BENCH_DIR)
+
+import Converter  # noqa: E402
+import synthetic_docx  # noqa: E402
+
+CASES = {
+    "prose-latin": { "scenes": 200, "paragraphs": 50, "choices": 2, "text": "latin", "formatted": 0.3 },
+    "prose-cjk": { "scenes": 200, "paragraphs": 50, "choices": 2, "text": "cjk", "formatted": 0.3 },
+    "heavily-formatted": { "scenes": 500, "paragraphs": 10, "choices": 3, "text": "mixed", "formatted": 1.0 },
+}
+
+
+def text_bytes(story):
+    return sum(len(scene.text.encode("utf-8")) for scene in story.values())
+
+
+def best_parse(filename, rich_text, repeat):
+    best, story = None, None
+    for _ in range(repeat):
+        with contextlib.redirect_stdout(io.StringIO()):
+            start = time.perf_counter()
+            story = Converter.parse_docx(filename, rich_text=rich_text)
+            elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best, story
+
+
+def per_run_overhead(filename):
+    """Extra bytes of story text if each run were wrapped on its own rather than coalesced."""
+    with zipfile.ZipFile(filename) as zf:
+        formats = Converter._load_style_formats(zf, "word/styles.xml")
+        root = ET.fromstring(zf.read("word/document.xml"))
+    base = formats.get(None, 0)
+    extra = 0
+    for p in root.iter(Converter.W_P):
+        if p.find(f"{Converter.W_NS}pPr/{Converter.W_NS}pStyle") is not None:
+            continue  # Scene titles
+        marked = Converter._paragraph_rich_text(p, None, formats).strip()
+        if not marked or Converter.classify_rich_text(marked)[0] != Converter.TEXT:
+            continue
+        per_run = []
+        for run in p.iter(Converter.W_R):
+            pieces = []
+            Converter._run_text(run, pieces)
+            flags = Converter._run_format(run, base, formats)
+            per_run.append(Converter.rich_text_html(Converter.format_mark(flags) + "".join(pieces)))
+        extra += len("".join(per_run).strip().encode("utf-8")) - len(Converter.rich_text_html(marked).encode("utf-8"))
+    return extra
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Compare plain-text and rich-text parsing on synthetic manuscripts.")
+    parser.add_argument("--cases", nargs="+", choices=sorted(CASES), default=sorted(CASES))
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("-o", "--output", help="write the results as JSON")
+    args = parser.parse_args(argv)
+
+    results = {}
+    print(f"{'case':<18} {'plain ms':>9} {'rich ms':>9} {'plain KB':>9} {'rich KB':>9} {'per-run KB':>11}")
+    for name in args.cases:
+        with tempfile.TemporaryDirectory(prefix="bench-") as workdir:
+            source = os.path.join(workdir, "Story.docx")
+            synthetic_docx.write_docx(source, **CASES[name])
+            plain_seconds, plain = best_parse(source, False, args.repeat)
+            rich_seconds, rich = best_parse(source, True, args.repeat)
+            per_run = text_bytes(rich) + per_run_overhead(source)
+
+        results[name] = {
+            "plain_seconds": round(plain_seconds, 6),
+            "rich_seconds": round(rich_seconds, 6),
+            "plain_text_bytes": text_bytes(plain),
+            "rich_text_bytes": text_bytes(rich),
+            "per_run_text_bytes": per_run,
+        }
+        print(f"{name:<18} {plain_seconds * 1000:>9.1f} {rich_seconds * 1000:>9.1f} {text_bytes(plain) / 1024:>9.0f} "
+              f"{text_bytes(rich) / 1024:>9.0f} {per_run / 1024:>11.0f}")
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,158 @@
+"""
+Synthetic manuscript generator for the converter benchmarks.
+
+Writes a .docx package directly (no python-docx needed) so that even very
+large stories can be generated quickly and with flat memory. The documents
+use the same conventions as a real Story.docx: Heading 1 scene titles,
+optional METADATA lines, prose paragraphs and bracketed choices.
+
+    python benchmarks/synthetic_docx.py out.docx --scenes 2000 --paragraphs 20 --text cjk
+"""
+import argparse
+import random
+import zipfile
+from xml.sax.saxutils import escape
+
+LATIN_WORDS = (
+    "the castle guard stood at gate while rain fell on old stones and you wonder "
+    "whether any road leads home through forest night river lantern shadow voice "
+    "silver letter promise king merchant diplomat sword map tower bridge market "
+    "quiet storm morning ember whisper door stair window courtyard banner"
+).split()
+
+CJK_CHARS = (
+    "的一是在不了有和人这中大为上个我以要他时来用们生到作地于出就分对成会可主发年同工也能下过子说"
+    "种面而方后多定行学法所民得经十三之进着等部度家力里如水化高自二理起小物现实加量都两体制机当使点"
+    "从本去把性好应开它合还因由其些然前外天四日那义事平形相全表间样与关各重新线内数正心反你明看原又"
+    "么利比或但质气第向道命此变条只没结解问意建月公无系很情者最立代想已通并提直题程展五果料象员位入"
+)
+
+ARROWS = ("→", "->", "=>")
+BRACKETS = (("[", "]"), ("【", "】"))
+ICONS = ("🏰", "📜", "🗝️", "⚔️", "🌙", "🔥")
+# Run properties for formatted stretches; Strong is a character style in STYLES
+EMPHASIS = ("<w:b/>", "<w:i/>", "<w:b/><w:i/>", '<w:u w:val="single"/>', '<w:rStyle w:val="Strong"/>')
+
+CONTENT_TYPES = """<?xml version="1.0" encoding="UTF-8" standalone="yes"?>
+<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">
+<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>
+<Default Extension="xml" ContentType="application/xml"/>
+<Override PartName="/word/document.xml" ContentType="application/vnd.openxmlformats-officedocument.wordprocessingml.document.main+xml"/>
+<Override PartName="/word/styles.xml" ContentType="application/vnd.openxmlformats-officedocument.wordprocessingml.styles+xml"/>
+</Types>"""
+
+PACKAGE_RELS = """<?xml version="1.0" encoding="UTF-8" standalone="yes"?>
+<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">
+<Relationship Id="rId1" Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/officeDocument" Target="word/document.xml"/>
+</Relationships>"""
+
+DOCUMENT_RELS = """<?xml version="1.0" encoding="UTF-8" standalone="yes"?>
+<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">
+<Relationship Id="rId1" Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/styles" Target="styles.xml"/>
+</Relationships>"""
+
+STYLES = """<?xml version="1.0" encoding="UTF-8" standalone="yes"?>
+<w:styles xmlns:w="http://schemas.openxmlformats.org/wordprocessingml/2006/main">
+<w:style w:type="paragraph" w:default="1" w:styleId="Normal"><w:name w:val="Normal"/></w:style>
+<w:style w:type="paragraph" w:styleId="Heading1"><w:name w:val="heading 1"/><w:basedOn w:val="Normal"/></w:style>
+<w:style w:type="character" w:styleId="Strong"><w:name w:val="Strong"/><w:rPr><w:b/></w:rPr></w:style>
+</w:styles>"""
+
+DOCUMENT_HEAD = ('<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+                 '<w:document xmlns:w="http://schemas.openxmlformats.org/wordprocessingml/2006/main"><w:body>')
+DOCUMENT_TAIL = "<w:sectPr/></w:body></w:document>"
+
+
+def _sentence(rng, text_kind, words):
+    if text_kind == "cjk" or (text_kind == "mixed" and rng.random() < 0.5):
+        return "".join(rng.choice(CJK_CHARS) for _ in range(words * 2)) + "。"
+    sentence = " ".join(rng.choice(LATIN_WORDS) for _ in range(words))
+    return sentence[0].upper() + sentence[1:] + "."
+
+
+def _paragraph_xml(text, style=None, runs=1, rng=None, emphasis=None):
+    ppr = f'<w:pPr><w:pStyle w:val="{style}"/></w:pPr>' if style else ""
+    # Word rarely stores a paragraph as one run; split prose into a few
+    pieces = [text]
+    if runs > 1 and len(text) > runs:
+        cuts = sorted(rng.sample(range(1, len(text)), runs - 1))
+        pieces = [text[i:j] for i, j in zip([0] + cuts, cuts + [len(text)])]
+    # A formatted stretch spans several runs that all carry the same properties
+    formatted = range(0)
+    if emphasis and len(pieces) > 2:
+        start = rng.randrange(1, len(pieces) - 1)
+        formatted = range(start, rng.randrange(start + 1, len(pieces)))
+    body = "".join(f'<w:r>{f"<w:rPr>{emphasis}</w:rPr>" if i in formatted else ""}'
+                   f'<w:t xml:space="preserve">{escape(piece)}</w:t></w:r>' for i, piece in enumerate(pieces))
+    return f"<w:p>{ppr}{body}</w:p>"
+
+
+def scene_title(index):
+    return f"Scene {index + 1}"
+
+
+def iter_manuscript(scenes=100, paragraphs=10, choices=2, text="latin", metadata=0.5,
+                    words=40, seed=0):
+    """Yield (style, text) paragraphs of a synthetic branching story."""
+    rng = random.Random(seed)
+    for index in range(scenes):
+        yield "Heading1", scene_title(index)
+        if rng.random() < metadata:
+            yield None, f"METADATA: color=#{rng.randrange(0x1000000):06X}, icon={rng.choice(ICONS)}"
+        for _ in range(paragraphs):
+            yield None, " ".join(_sentence(rng, text, words // 3 or 1) for _ in range(3))
+        # The last scene is an ending; every other scene links forward (and sometimes back)
+        if index < scenes - 1:
+            for c in range(choices):
+                target = index + 1 if c == 0 else rng.randrange(scenes)
+                open_b, close_b = rng.choice(BRACKETS)
+                yield None, f"{open_b}Option {c + 1} {rng.choice(ARROWS)} {scene_title(target)}{close_b}"
+
+
+def write_docx(filename, seed=0, formatted=0.0, **options):
+    """Write a synthetic manuscript and return the number of paragraphs in it.
+
+    `formatted` is the fraction of paragraphs with a bold/italic/underlined stretch.
+    """
+    rng = random.Random(seed + 1)
+    count = 0
+    with zipfile.ZipFile(filename, "w", zipfile.ZIP_DEFLATED) as zf:
+        zf.writestr("[Content_Types].xml", CONTENT_TYPES)
+        zf.writestr("_rels/.rels", PACKAGE_RELS)
+        zf.writestr("word/_rels/document.xml.rels", DOCUMENT_RELS)
+        zf.writestr("word/styles.xml", STYLES)
+        with zf.open("word/document.xml", "w") as f:
+            f.write(DOCUMENT_HEAD.encode("utf-8"))
+            for style, text in iter_manuscript(seed=seed, **options):
+                runs = 1 if style else rng.randint(1, 4)
+                emphasis = None
+                if formatted and not style and rng.random() < formatted:
+                    runs, emphasis = rng.randint(4, 8), rng.choice(EMPHASIS)
+                f.write(_paragraph_xml(text, style, runs, rng, emphasis).encode("utf-8"))
+                count += 1
+            f.write(DOCUMENT_TAIL.encode("utf-8"))
+    return count
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Generate a synthetic story .docx for benchmarking.")
+    parser.add_argument("output", help=".docx file to write")
+    parser.add_argument("--scenes", type=int, default=100)
+    parser.add_argument("--paragraphs", type=int, default=10, help="prose paragraphs per scene")
+    parser.add_argument("--choices", type=int, default=2, help="choices per scene")
+    parser.add_argument("--text", choices=("latin", "cjk", "mixed"), default="latin")
+    parser.add_argument("--metadata", type=float, default=0.5, help="fraction of scenes with a METADATA line")
+    parser.add_argument("--words", type=int, default=40, help="approximate words per paragraph")
+    parser.add_argument("--formatted", type=float, default=0.0,
+                        help="fraction of paragraphs with a bold/italic/underlined stretch")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args(argv)
+
+    count = write_docx(args.output, scenes=args.scenes, paragraphs=args.paragraphs, choices=args.choices,
+                       text=args.text, metadata=args.metadata, words=args.words, seed=args.seed,
+                       formatted=args.formatted)
+    print(f"Wrote {args.output}: {args.scenes} scenes, {count} paragraphs")
+
+
+if __name__ == "__main__":
+    main()
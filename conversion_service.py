@@ -0,0 +1,329 @@
+"""
+Local conversion service for publishing backends.
+
+Converts .docx uploads sent over HTTP in a pool of worker processes that stay
+up between requests, so a backend neither starts a Python process (and imports
+python-docx) per upload nor writes temporary files:
+
+    python conversion_service.py --port 8100 -j 4
+    python Converter.py --service --port 8100 --release
+    curl --data-binary @Story.docx "http://localhost:8100/convert?search=1" -o story.html
+
+POST /convert  The body is the .docx; the page comes back as text/html.
+               Query options (overriding the service defaults): payload=inline|shards,
+               release, search, rich_text, prune_unreachable (=1 or =0), max_image_size=PX
+GET /stats     Request counts and latency percentiles as JSON
+GET /health    "ok" while the workers are up
+
+At most --max-pending uploads are taken at once, counting those being converted
+and those waiting for a worker; any more are turned away with 503 and a
+Retry-After header. Every response reports its latency in a Server-Timing
+header (time waiting for a worker, converting, and in total).
+"""
+import argparse
+import collections
+import concurrent.futures
+import http.server
+import json
+import os
+import sys
+import threading
+import time
+import urllib.parse
+import zipfile
+import xml.etree.ElementTree as ET
+
+import Converter
+
+DEFAULT_PORT = 8100
+MAX_UPLOAD_BYTES = 64 << 20
+REQUEST_TIMEOUT = 60   # Seconds a client may take to send its upload
+LATENCY_WINDOW = 1000  # Recent requests the latency percentiles are taken over
+RETRY_AFTER = 1
+FLAG_OPTIONS = ("release", "search", "rich_text", "prune_unreachable")
+
+
+# ==========================================
+# WORKERS
+# ==========================================
+
+def _init_service_worker(verbosity):
+    Converter._init_worker(verbosity)
+    # Done once per worker rather than on its first release build
+    Converter.release_template()
+
+
+def _convert_upload(job):
+    # Runs in a worker process. Problems with the document itself come back as a
+    # status; anything else is a bug and reaches the caller as an exception.
+    data, options = job
+    stats = Converter.BuildStats()
+    start = time.perf_counter()
+    try:
+        page, status, error = Converter.convert_bytes(data, stats=stats, **options), 200, None
+    except ValueError as e:
+        page, status, error = None, 422, str(e)
+    except (zipfile.BadZipFile, KeyError, ET.ParseError) as e:
+        page, status, error = None, 400, f"Not a readable .docx ({type(e).__name__}: {e})"
+    return page, status, error, time.perf_counter() - start, stats.as_dict()
+
+
+class ServiceBusy(Exception):
+    """Raised when --max-pending uploads are already in progress."""
+
+
+class ConversionService:
+    """The worker pool, the limit on uploads in progress, and the latency record."""
+
+    def __init__(self, options, workers=1, max_pending=None):
+        self.options = options
+        self.workers = workers
+        self.max_pending = max_pending or 2 * workers
+        self.slots = threading.BoundedSemaphore(self.max_pending)
+        self.lock = threading.Lock()
+        self.pending = 0
+        self.statuses = collections.Counter()
+        self.latencies = collections.deque(maxlen=LATENCY_WINDOW)
+        self.pool = self._start_pool()
+
+    def _start_pool(self):
+        # The server logs a line per request; workers only add warnings, or every scene with -v
+        verbosity = Converter.VERBOSE if Converter.VERBOSITY >= Converter.VERBOSE else Converter.QUIET
+        pool = concurrent.futures.ProcessPoolExecutor(max_workers=self.workers, initializer=_init_service_worker,
+                                                      initargs=(verbosity,))
+        # Start every worker now, not when the first uploads arrive
+        concurrent.futures.wait([pool.submit(os.getpid) for _ in range(self.workers)])
+        return pool
+
+    def convert(self, data, options):
+        """Convert one upload; returns (page, status, error, timings in seconds, stats).
+
+        Raises ServiceBusy instead of queueing beyond max_pending.
+        """
+        if not self.slots.acquire(blocking=False):
+            raise ServiceBusy()
+        start = time.perf_counter()
+        with self.lock:
+            self.pending += 1
+            pool = self.pool
+        try:
+            page, status, error, seconds, stats = pool.submit(_convert_upload, (data, options)).result()
+        except concurrent.futures.BrokenExecutor:
+            # A worker died (out of memory, killed): later uploads get a fresh pool
+            with self.lock:
+                if self.pool is pool:
+                    self.pool = self._start_pool()
+            pool.shutdown(wait=False)
+            raise
+        finally:
+            with self.lock:
+                self.pending -= 1
+            self.slots.release()
+        total = time.perf_counter() - start
+        return page, status, error, { "queue": total - seconds, "convert": seconds, "total": total }, stats
+
+    def record(self, status, seconds):
+        with self.lock:
+            self.statuses[status] += 1
+            self.latencies.append(seconds)
+
+    def report(self):
+        """Counts and latency percentiles (milliseconds) for GET /stats."""
+        with self.lock:
+            latencies = sorted(self.latencies)
+            report = {
+                "workers": self.workers,
+                "max_pending": self.max_pending,
+                "pending": self.pending,
+                "requests": sum(self.statuses.values()),
+                "statuses": { str(status): count for status, count in sorted(self.statuses.items()) },
+            }
+        if latencies:
+            def percentile(p):
+                return round(latencies[min(len(latencies) - 1, int(p / 100 * len(latencies)))] * 1000, 1)
+            report["latency_ms"] = {
+                "window": len(latencies),
+                "mean": round(sum(latencies) / len(latencies) * 1000, 1),
+                "p50": percentile(50),
+                "p90": percentile(90),
+                "p99": percentile(99),
+                "max": round(latencies[-1] * 1000, 1),
+            }
+        return report
+
+    def close(self):
+        self.pool.shutdown()
+
+
+# ==========================================
+# SERVER
+# ==========================================
+
+def request_options(defaults, query):
+    """The service defaults overridden by the query string; raises ValueError for bad values."""
+    options = dict(defaults)
+    for name, values in query.items():
+        value = values[-1]
+        if name == "payload":
+            if value not in Converter.STREAM_PAYLOADS:
+                raise ValueError(f"payload must be one of {', '.join(Converter.STREAM_PAYLOADS)}")
+            options[name] = value
+        elif name in FLAG_OPTIONS:
+            if value not in ("0", "1", "true", "false"):
+                raise ValueError(f"{name} must be 1 or 0")
+            options[name] = value in ("1", "true")
+        elif name == "max_image_size":
+            if not value.isdigit() or int(value) < 1:
+                raise ValueError("max_image_size must be a positive number of pixels")
+            options[name] = int(value)
+        else:
+            raise ValueError(f"unknown option {name}")
+    return options
+
+
+def server_timing(timings):
+    return ", ".join(f"{name};dur={seconds * 1000:.1f}" for name, seconds in timings.items())
+
+
+class ConversionHandler(http.server.BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    timeout = REQUEST_TIMEOUT
+
+    def do_GET(self):
+        path = urllib.parse.urlsplit(self.path).path
+        if path == "/health":
+            self._send(200, "text/plain", b"ok")
+        elif path == "/stats":
+            self._send(200, "application/json", json.dumps(self.server.service.report(), indent=2).encode("utf-8"))
+        else:
+            self._send(404, "text/plain", b"Not found")
+
+    def do_POST(self):
+        start = time.perf_counter()
+        url = urllib.parse.urlsplit(self.path)
+        if url.path != "/convert":
+            self._fail(404, "Not found", start)
+            return
+        length = self.headers.get("Content-Length")
+        if length is None or not length.isdigit():
+            self._fail(411, "Send the .docx as the request body, with a Content-Length", start)
+            return
+        if int(length) > MAX_UPLOAD_BYTES:
+            self._fail(413, f"Uploads are limited to {MAX_UPLOAD_BYTES >> 20} MB", start)
+            return
+        try:
+            options = request_options(self.server.service.options, urllib.parse.parse_qs(url.query))
+        except ValueError as e:
+            self._fail(400, str(e), start)
+            return
+        data = self.rfile.read(int(length))
+
+        service = self.server.service
+        try:
+            page, status, error, timings, stats = service.convert(data, options)
+        except ServiceBusy:
+            self._fail(503, f"All {service.max_pending} conversion slots are busy; try again shortly", start,
+                       { "Retry-After": str(RETRY_AFTER) })
+            return
+        except Exception as e:
+            Converter.warn(f"  - Error: conversion failed ({type(e).__name__}: {e})")
+            self._fail(500, f"Conversion failed ({type(e).__name__})", start)
+            return
+        if error:
+            self._fail(status, error, start, { "Server-Timing": server_timing(timings) })
+            return
+
+        # Reading the upload counts towards the reported total
+        timings["total"] = time.perf_counter() - start
+        self._send(200, "text/html; charset=utf-8", page, {
+            "Server-Timing": server_timing(timings),
+            "X-Story-Scenes": str(stats["counters"].get("scenes", 0)),
+        })
+        service.record(200, timings["total"])
+        Converter.log(f"POST {self.path} 200 {len(data):,} -> {len(page):,} bytes in {timings['total']:.2f}s "
+                      f"(waited {timings['queue']:.2f}s)")
+
+    def _fail(self, status, message, start, headers=None):
+        # The upload may not have been read, so the connection cannot take another request
+        headers = dict(headers or {}, Connection="close")
+        self._send(status, "text/plain; charset=utf-8", (message + "\n").encode("utf-8"), headers)
+        self.server.service.record(status, time.perf_counter() - start)
+        Converter.log(f"POST {self.path} {status}: {message}")
+
+    def _send(self, status, content_type, body, headers=None):
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        Converter.log(f"  {self.address_string()} {format % args}", Converter.VERBOSE)
+
+
+class ConversionServer(http.server.ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address, service):
+        super().__init__(address, ConversionHandler)
+        self.service = service
+
+
+def serve(options, port=DEFAULT_PORT, host="127.0.0.1", workers=1, max_pending=None):
+    """Serve conversions until interrupted. Returns the process exit code.
+
+    `options` are the convert_stream() keyword options used when a request
+    does not set them.
+    """
+    service = ConversionService(options, workers, max_pending)
+    try:
+        server = ConversionServer((host, port), service)
+    except OSError as e:
+        service.close()
+        Converter.warn(f"Error: could not listen on {host}:{port} ({e})")
+        return 1
+    Converter.log(f"Converting uploads on http://{host}:{server.server_address[1]}/convert with {workers} "
+                  f"worker(s), at most {service.max_pending} at a time (Ctrl+C to stop)")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        Converter.log("\nStopped.")
+    finally:
+        server.server_close()
+        service.close()
+    return 0
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Convert uploaded Word stories over HTTP with warm worker processes.")
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT, help=f"(default: {DEFAULT_PORT})")
+    parser.add_argument("--host", default="127.0.0.1", help="address to listen on (default: this computer only)")
+    parser.add_argument("-j", "--jobs", type=int, default=os.cpu_count() or 1,
+                        help="worker processes (default: one per CPU)")
+    parser.add_argument("--max-pending", type=int, metavar="N",
+                        help="uploads taken at once, converting or waiting; more get 503 (default: twice --jobs)")
+    parser.add_argument("--payload", choices=Converter.STREAM_PAYLOADS, default="inline",
+                        help="default payload (default: inline)")
+    parser.add_argument("--release", action="store_true", help="compact JSON and minified CSS/JS by default")
+    parser.add_argument("--search", action="store_true", help="add the search panel by default")
+    parser.add_argument("--rich-text", action="store_true",
+                        help="keep bold, italic, underline and strikethrough by default")
+    parser.add_argument("-v", "--verbose", action="store_true", help="log every scene and request")
+    args = parser.parse_args(argv)
+
+    Converter.VERBOSITY = Converter.VERBOSE if args.verbose else Converter.NORMAL
+    options = {
+        "payload": args.payload,
+        "release": args.release,
+        "config": Converter.player_config(),
+        "prune_unreachable": False,
+        "search": args.search,
+        "rich_text": args.rich_text,
+        "max_image_size": Converter.MAX_IMAGE_SIZE,
+    }
+    return serve(options, args.port, args.host, max(1, args.jobs), args.max_pending)
+
+if __name__ == "__main__":
+    sys.exit(main())
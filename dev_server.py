@@ -0,0 +1,391 @@
+"""
+Live preview server for writing sessions.
+
+Serves the novel on http://localhost:8000/ and watches the source document
+(inotify on Linux, polling elsewhere). After every save it parses the story
+again, works out which scenes changed and pushes only those scene records to
+the open pages over Server-Sent Events. The page patches its storyData in
+place and re-renders the scene the reader is on, so there is nothing to
+reload and the current scene is not lost.
+
+    python dev_server.py Story.docx
+    python Converter.py Story.docx --serve --port 8080
+
+The preview page is built in memory; run Converter.py as usual to produce the
+files you publish.
+"""
+import argparse
+import ctypes
+import ctypes.util
+import http.server
+import json
+import os
+import queue
+import select
+import struct
+import sys
+import threading
+import time
+import urllib.parse
+
+import Converter
+
+DEFAULT_PORT = 8000
+POLL_INTERVAL = 0.25   # Seconds between checks when inotify is not available
+SETTLE_SECONDS = 0.05  # Quiet time after a change before the document is read
+KEEPALIVE_SECONDS = 15
+EVENTS_URL = "/events"
+MEDIA_URL = "media"
+
+
+# ==========================================
+# FILE WATCHING
+# ==========================================
+# Editors rarely write a document in place: Word and LibreOffice save to a
+# temporary file and rename it over the original. The inotify watch is
+# therefore on the folder, filtered by file name, and a change counts once the
+# file has been closed after writing or moved into place.
+
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_CLOEXEC = 0o2000000
+inotify_event_header = struct.Struct("iIII")  # wd, mask, cookie, len (name follows)
+
+
+class InotifyWatcher:
+    """Waits for changes to one file with Linux inotify (through ctypes)."""
+
+    def __init__(self, filename):
+        libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+        self.name = os.fsencode(os.path.basename(filename))
+        self.fd = libc.inotify_init1(IN_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        folder = os.fsencode(os.path.dirname(os.path.abspath(filename)))
+        if libc.inotify_add_watch(self.fd, folder, IN_CLOSE_WRITE | IN_MOVED_TO) < 0:
+            errno = ctypes.get_errno()
+            os.close(self.fd)
+            raise OSError(errno, "inotify_add_watch failed")
+
+    def _read_events(self, timeout):
+        """Return True if the watched file was among the events that arrived within timeout."""
+        if not select.select([self.fd], [], [], timeout)[0]:
+            return False
+        buffer = os.read(self.fd, 64 * 1024)
+        offset = 0
+        touched = False
+        while offset < len(buffer):
+            _, _, _, length = inotify_event_header.unpack_from(buffer, offset)
+            offset += inotify_event_header.size
+            touched |= buffer[offset:offset + length].rstrip(b"\0") == self.name
+            offset += length
+        return touched
+
+    def wait(self, timeout=None):
+        """Block until the file changed (True) or timeout seconds passed (False)."""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        # Events for other files in the folder (the editor's temporary files) are skipped
+        while not self._read_events(None if deadline is None else max(0, deadline - time.monotonic())):
+            if deadline is not None and time.monotonic() >= deadline:
+                return False
+        # Editors that save in several steps produce a burst of events
+        while self._read_events(SETTLE_SECONDS):
+            pass
+        return True
+
+    def close(self):
+        os.close(self.fd)
+
+
+class PollingWatcher:
+    """Waits for changes to one file by comparing its size and modification time."""
+
+    def __init__(self, filename, interval=POLL_INTERVAL):
+        self.filename = filename
+        self.interval = interval
+        self.signature = self._signature()
+
+    def _signature(self):
+        try:
+            info = os.stat(self.filename)
+        except OSError:
+            return None  # Missing for a moment while the editor replaces it
+        return info.st_mtime_ns, info.st_size
+
+    def wait(self, timeout=None):
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while deadline is None or time.monotonic() < deadline:
+            time.sleep(self.interval)
+            signature = self._signature()
+            if signature is not None and signature != self.signature:
+                # Let a save in progress finish
+                time.sleep(SETTLE_SECONDS)
+                self.signature = self._signature()
+                return True
+        return False
+
+    def close(self):
+        pass
+
+
+def open_watcher(filename):
+    if sys.platform.startswith("linux"):
+        try:
+            return InotifyWatcher(filename)
+        except (OSError, AttributeError) as e:
+            Converter.log(f"  - Note: inotify is not available ({e}); checking for changes every "
+                          f"{POLL_INTERVAL}s instead.")
+    return PollingWatcher(filename)
+
+
+# ==========================================
+# LIVE STORY
+# ==========================================
+
+def story_patch(old, new):
+    """The part of story table `new` that differs from `old` (both from build_story_table).
+
+    Only changed scenes are sent while the scene list stays the same. Adding,
+    removing or renaming a scene moves the choice indexes, and so does adding or
+    removing a story variable, so then the whole table is sent.
+    """
+    if old is None or old["titles"] != new["titles"] or old.get("vars") != new.get("vars"):
+        return { "titles": new["titles"], "scenes": new["scenes"], "vars": new.get("vars") }
+    return { "scenes": { index: scene for index, (before, scene) in enumerate(zip(old["scenes"], new["scenes"]))
+                         if before != scene } }
+
+
+class LiveStory:
+    """The latest successful build of the source document, kept in memory."""
+
+    def __init__(self, source_filename, options):
+        self.source = source_filename
+        self.options = options
+        self.lock = threading.Lock()
+        self.version = 0
+        self.table = None
+        self.images = {}
+
+    def _build(self):
+        rich_text = self.options["rich_text"]
+        cache = Converter.ParseCache(self.source, rich_text=rich_text) if self.options["use_cache"] else None
+        story = Converter.parse_docx(self.source, cache=cache, rich_text=rich_text)
+        if not story:
+            raise ValueError(f"No scenes found in {self.source}.")
+        story = Converter.check_links(story, prune=self.options["prune_unreachable"])
+        images = Converter.prepare_images(self.source, story, self.options["max_image_size"],
+                                          media_cache=cache.media_dir if cache is not None else None)
+        table = Converter.build_story_table(story)
+        table["images"] = Converter.image_table(images, MEDIA_URL) if images else None
+        return table, images
+
+    def rebuild(self):
+        """Parse the document again; returns the patch to push (None if nothing changed)."""
+        table, images = self._build()
+        with self.lock:
+            patch = story_patch(self.table, table)
+            if table["images"] != (self.table or {}).get("images"):
+                patch["images"] = table["images"] or {}
+            if "titles" not in patch and not patch["scenes"] and "images" not in patch:
+                return None
+            self.table, self.images = table, images
+            self.version += 1
+            patch["version"] = self.version
+            return patch
+
+    def full_patch(self):
+        with self.lock:
+            return dict(story_patch(None, self.table), images=self.table["images"] or {}, version=self.version)
+
+    def page(self):
+        with self.lock:
+            table = { key: value for key, value in self.table.items() if value is not None }
+            version = self.version
+        config = dict(self.options["config"], liveUpdates={ "url": EVENTS_URL, "version": version })
+        return Converter.fill_template(Converter.HTML_TEMPLATE, {
+            "STORY_DATA_PLACEHOLDER": Converter.script_safe_json(table, indent=4),
+            "STORY_SHARDS_PLACEHOLDER": "",
+            "PLAYER_CONFIG_PLACEHOLDER": json.dumps(config),
+        })
+
+    def picture(self, name):
+        """(mime, data) of a picture under the media URL, or None."""
+        key = os.path.splitext(name)[0]
+        with self.lock:
+            entry = self.images.get(key)
+        if entry is None or key + Converter.MEDIA_EXTENSIONS[entry[0]] != name:
+            return None
+        return entry[0], entry[1]
+
+
+# ==========================================
+# SERVER
+# ==========================================
+
+class EventHub:
+    """Fans story patches out to the connected pages."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.clients = set()
+
+    def subscribe(self):
+        client = queue.Queue()
+        with self.lock:
+            self.clients.add(client)
+        return client
+
+    def unsubscribe(self, client):
+        with self.lock:
+            self.clients.discard(client)
+
+    def publish(self, event):
+        with self.lock:
+            for client in self.clients:
+                client.put(event)
+            return len(self.clients)
+
+
+def sse_message(event):
+    data = json.dumps(event, ensure_ascii=False, separators=(",", ":"))
+    event_id = f"id: {event['version']}\n" if "version" in event else ""
+    return f"{event_id}data: {data}\n\n".encode("utf-8")
+
+
+class PreviewHandler(http.server.BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        url = urllib.parse.urlsplit(self.path)
+        if url.path in ("/", "/index.html"):
+            self._send(200, "text/html; charset=utf-8", self.server.story.page().encode("utf-8"))
+        elif url.path == EVENTS_URL:
+            self._stream_events(urllib.parse.parse_qs(url.query))
+        elif url.path.startswith(f"/{MEDIA_URL}/"):
+            picture = self.server.story.picture(url.path[len(MEDIA_URL) + 2:])
+            if picture:
+                self._send(200, *picture)
+            else:
+                self._send(404, "text/plain", b"Not found")
+        else:
+            self._send(404, "text/plain", b"Not found")
+
+    def _send(self, status, content_type, body):
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.send_header("Cache-Control", "no-store")
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _stream_events(self, query):
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Cache-Control", "no-store")
+        self.end_headers()
+        self.close_connection = True
+
+        hub = self.server.hub
+        client = hub.subscribe()
+        try:
+            # A page built from an older version (or reconnecting after missing
+            # updates) gets the whole story first
+            seen = self.headers.get("Last-Event-ID") or query.get("version", [""])[0]
+            if seen != str(self.server.story.version):
+                self.wfile.write(sse_message(self.server.story.full_patch()))
+                self.wfile.flush()
+            while not self.server.stopping.is_set():
+                try:
+                    message = sse_message(client.get(timeout=KEEPALIVE_SECONDS))
+                except queue.Empty:
+                    message = b": keep-alive\n\n"
+                self.wfile.write(message)
+                self.wfile.flush()
+        except (BrokenPipeError, ConnectionResetError):
+            pass  # The page was closed or reloaded
+        finally:
+            hub.unsubscribe(client)
+
+    def log_message(self, format, *args):
+        Converter.log(f"  {self.address_string()} {format % args}", Converter.VERBOSE)
+
+
+class PreviewServer(http.server.ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address, story):
+        super().__init__(address, PreviewHandler)
+        self.story = story
+        self.hub = EventHub()
+        self.stopping = threading.Event()
+
+
+def serve(source_filename, options, port=DEFAULT_PORT, host="127.0.0.1"):
+    """Serve the preview until interrupted. Returns the process exit code."""
+    if not os.path.exists(source_filename):
+        Converter.warn(f"Error: {source_filename} not found.")
+        return 1
+    story = LiveStory(source_filename, options)
+    try:
+        story.rebuild()
+    except Exception as e:
+        Converter.warn(f"Error: could not build {source_filename} ({type(e).__name__}: {e})")
+        return 1
+
+    server = PreviewServer((host, port), story)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    watcher = open_watcher(source_filename)
+    Converter.log(f"Previewing {source_filename} on http://{host}:{server.server_address[1]}/ "
+                  f"(Ctrl+C to stop)")
+    try:
+        while True:
+            if not watcher.wait():
+                continue
+            start = time.perf_counter()
+            try:
+                patch = story.rebuild()
+            except Exception as e:
+                # Usually a document caught halfway through saving; the next save fixes it
+                message = f"Could not rebuild {os.path.basename(source_filename)}: {type(e).__name__}: {e}"
+                Converter.warn(f"  - Warning: {message}")
+                server.hub.publish({ "error": message })
+                continue
+            if patch is None:
+                Converter.log("No scene changed.")
+                continue
+            pages = server.hub.publish(patch)
+            changed = f"{len(patch['scenes'])} scene(s)" + (" (scene list changed)" if "titles" in patch else "")
+            Converter.log(f"Rebuilt in {time.perf_counter() - start:.2f}s: {changed} sent to {pages} page(s)")
+    except KeyboardInterrupt:
+        Converter.log("\nStopped.")
+    finally:
+        server.stopping.set()
+        server.shutdown()
+        server.server_close()
+        watcher.close()
+    return 0
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Preview a story in the browser while you edit it.")
+    parser.add_argument("input", nargs="?", default=Converter.INPUT_FILENAME,
+                        help=f"source .docx (default: {Converter.INPUT_FILENAME})")
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT, help=f"(default: {DEFAULT_PORT})")
+    parser.add_argument("--host", default="127.0.0.1", help="address to listen on (default: this computer only)")
+    parser.add_argument("--no-cache", action="store_true", help="re-parse every scene and do not touch the parse cache")
+    parser.add_argument("--rich-text", action="store_true", help="keep bold, italic, underline and strikethrough")
+    parser.add_argument("-v", "--verbose", action="store_true", help="list every scene and request")
+    args = parser.parse_args(argv)
+
+    Converter.VERBOSITY = Converter.VERBOSE if args.verbose else Converter.NORMAL
+    options = {
+        "use_cache": not args.no_cache,
+        "config": Converter.player_config(),
+        "prune_unreachable": False,
+        "rich_text": args.rich_text,
+        "max_image_size": Converter.MAX_IMAGE_SIZE,
+    }
+    return serve(args.input, options, args.port, args.host)
+
+if __name__ == "__main__":
+    sys.exit(main())
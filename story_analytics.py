@@ -0,0 +1,489 @@
+"""
+Story analytics for converted novels.
+
+Answers the questions a plain walk over the story cannot: how many distinct
+playthroughs exist, the shortest and longest routes to each ending (a scene
+without choices), and how likely a reader who picks choices uniformly at
+random is to see each scene.
+
+Cycles are collapsed into strongly connected components first (Tarjan), so
+path counts and route lengths are dynamic programs over the resulting DAG
+rather than an exponential search. A route that can pass through a cycle has
+no upper bound and is reported as "unbounded". Visit probabilities come from
+the random reader's transition matrix, solved one component at a time in
+topological order (with numpy when it is installed).
+
+    python story_analytics.py Story.docx -o Story.analytics.json
+    python Converter.py Story.docx --analytics
+"""
+import argparse
+import collections
+import json
+import os
+import random
+import sys
+
+try:
+    import numpy as np  # Optional: vectorized solves for large cycles
+except ImportError:
+    np = None
+
+import Converter
+
+UNBOUNDED = "unbounded"
+
+# Cycles up to this many scenes are solved exactly with a dense inverse, which also
+# gives the probability of reaching each of their scenes. Larger ones use a sparse
+# iterative solver.
+DENSE_COMPONENT_LIMIT = 2000 if np is not None else 200
+ITERATION_TOLERANCE = 1e-10
+MAX_ITERATIONS = 5000
+
+
+# ==========================================
+# GRAPH STRUCTURE
+# ==========================================
+
+def strongly_connected_components(edges):
+    """Tarjan's algorithm, without recursion so long chains of scenes are fine.
+
+    Returns (component id of each node, list of components in topological order).
+    Component ids follow the same order: every edge goes to the same or a later id.
+    """
+    count = len(edges)
+    order = [None] * count
+    low = [0] * count
+    on_stack = [False] * count
+    component = [None] * count
+    stack = []
+    found = []  # Tarjan emits components sinks first
+    counter = 0
+
+    for root in range(count):
+        if order[root] is not None:
+            continue
+        order[root] = low[root] = counter
+        counter += 1
+        stack.append(root)
+        on_stack[root] = True
+        work = [(root, 0)]
+        while work:
+            node, position = work[-1]
+            targets = edges[node]
+            if position < len(targets):
+                work[-1] = (node, position + 1)
+                target = targets[position]
+                if order[target] is None:
+                    order[target] = low[target] = counter
+                    counter += 1
+                    stack.append(target)
+                    on_stack[target] = True
+                    work.append((target, 0))
+                elif on_stack[target] and order[target] < low[node]:
+                    low[node] = order[target]
+                continue
+
+            work.pop()
+            if work:
+                parent = work[-1][0]
+                if low[node] < low[parent]:
+                    low[parent] = low[node]
+            if low[node] == order[node]:
+                members = []
+                while True:
+                    member = stack.pop()
+                    on_stack[member] = False
+                    members.append(member)
+                    if member == node:
+                        break
+                found.append(members)
+
+    found.reverse()
+    for cid, members in enumerate(found):
+        for member in members:
+            component[member] = cid
+    return component, found
+
+def shortest_routes(edges, start=0):
+    """Breadth-first distances (in choices) and parents from `start`."""
+    depth = [None] * len(edges)
+    parent = [None] * len(edges)
+    if not edges:
+        return depth, parent
+    depth[start] = 0
+    queue = collections.deque([start])
+    while queue:
+        node = queue.popleft()
+        for target in edges[node]:
+            if depth[target] is None:
+                depth[target] = depth[node] + 1
+                parent[target] = node
+                queue.append(target)
+    return depth, parent
+
+def count_routes(edges, components, cyclic, start=0):
+    """Number of routes from `start` and longest route to every scene.
+
+    One pass over the condensation in topological order. Two choices leading to
+    the same scene are two routes. Scenes that can be reached through a cycle get
+    None for both (unbounded); unreachable scenes get 0 routes and no length.
+    Returns (paths, longest, parent on a longest route).
+    """
+    count = len(edges)
+    paths = [0] * count
+    longest = [None] * count
+    parent = [None] * count
+    unbounded = [False] * count
+    if not edges:
+        return paths, longest, parent
+    paths[start] = 1
+    longest[start] = 0
+
+    for cid, members in enumerate(components):
+        if cyclic[cid] and any(paths[m] or unbounded[m] for m in members):
+            for member in members:
+                unbounded[member] = True
+        for node in members:
+            if unbounded[node]:
+                for target in edges[node]:
+                    unbounded[target] = True
+            elif paths[node]:
+                for target in edges[node]:
+                    paths[target] += paths[node]
+                    if longest[target] is None or longest[node] + 1 > longest[target]:
+                        longest[target] = longest[node] + 1
+                        parent[target] = node
+
+    for node in range(count):
+        if unbounded[node]:
+            paths[node] = longest[node] = parent[node] = None
+    return paths, longest, parent
+
+def route_to(node, parent, titles):
+    route = []
+    while node is not None:
+        route.append(titles[node])
+        node = parent[node]
+    route.reverse()
+    return route
+
+
+# ==========================================
+# RANDOM READER (Visit Probabilities)
+# ==========================================
+# Each choice of a scene is taken with equal probability; a choice whose target
+# does not exist ends the read ("Scene not found"). Mass flows forward through the
+# condensation: a scene outside any cycle is visited at most once, so its expected
+# number of visits is its visit probability. Inside a cycle the expected visits x
+# solve x (I - Q) = b, with Q the transitions within the cycle and b the mass
+# arriving from earlier scenes. With M = (I - Q)^-1, the probability of ever
+# seeing scene j is x_j / M_jj (M_jj being the expected visits once there).
+
+def _invert(matrix):
+    """Gauss-Jordan inverse with partial pivoting (pure Python fallback for numpy)."""
+    size = len(matrix)
+    rows = [row[:] + [1.0 if i == j else 0.0 for j in range(size)] for i, row in enumerate(matrix)]
+    for col in range(size):
+        pivot = max(range(col, size), key=lambda r: abs(rows[r][col]))
+        rows[col], rows[pivot] = rows[pivot], rows[col]
+        pivot_row = rows[col]
+        scale = pivot_row[col]
+        for k in range(col, 2 * size):
+            pivot_row[k] /= scale
+        for r in range(size):
+            factor = rows[r][col]
+            if r != col and factor:
+                row = rows[r]
+                for k in range(col, 2 * size):
+                    row[k] -= factor * pivot_row[k]
+    return [row[size:] for row in rows]
+
+def _solve_dense(inflow, internal, size):
+    """Expected visits and visit probabilities inside one cycle, exactly."""
+    if np is not None:
+        matrix = np.eye(size)
+        for source, target, weight in internal:
+            matrix[source, target] -= weight
+        inverse = np.linalg.inv(matrix)
+        visits = np.asarray(inflow) @ inverse
+        return visits.tolist(), (visits / np.diag(inverse)).tolist()
+
+    matrix = [[1.0 if i == j else 0.0 for j in range(size)] for i in range(size)]
+    for source, target, weight in internal:
+        matrix[source][target] -= weight
+    inverse = _invert(matrix)
+    visits = [sum(inflow[i] * inverse[i][j] for i in range(size) if inflow[i]) for j in range(size)]
+    return visits, [visits[j] / inverse[j][j] for j in range(size)]
+
+def _vector_ops(internal, size):
+    """(matvec, dot, combine) for v -> v (I - Q) over the transitions of one cycle."""
+    if np is not None:
+        sources = np.array([s for s, _, _ in internal], dtype=np.intp)
+        targets = np.array([t for _, t, _ in internal], dtype=np.intp)
+        weights = np.array([w for _, _, w in internal])
+
+        def matvec(v):
+            return v - np.bincount(targets, weights=v[sources] * weights, minlength=size)
+        return matvec, lambda a, b: float(np.dot(a, b)), lambda a, x, b, y: a * x + b * y
+
+    def matvec(v):
+        result = list(v)
+        for source, target, weight in internal:
+            result[target] -= weight * v[source]
+        return result
+
+    def dot(a, b):
+        return sum(x * y for x, y in zip(a, b))
+
+    def combine(a, x, b, y):
+        return [a * xi + b * yi for xi, yi in zip(x, y)]
+    return matvec, dot, combine
+
+def _solve_sparse(inflow, internal, size):
+    """Expected visits inside a large cycle, solving x (I - Q) = b with BiCGSTAB.
+
+    Only the transitions are stored, so memory stays linear in the choices.
+    Returns (visits, converged); visit probabilities are not available this way.
+    """
+    matvec, dot, combine = _vector_ops(internal, size)
+    b = np.asarray(inflow, dtype=float) if np is not None else list(inflow)
+    x = b
+    r = combine(1.0, b, -1.0, matvec(x))
+    limit = (ITERATION_TOLERANCE * dot(b, b) ** 0.5) ** 2
+    shadow = random.Random(0)
+    r_hat = None
+
+    for _ in range(MAX_ITERATIONS):
+        if dot(r, r) <= limit:
+            return list(x), True
+        if r_hat is None:
+            # (Re)start with a pseudo-random shadow residual: b is mostly zeros, so the
+            # textbook choice r_hat = r soon becomes orthogonal to the residuals
+            r_hat = [shadow.uniform(0.5, 1.5) for _ in range(size)]
+            r_hat = np.array(r_hat) if np is not None else r_hat
+            p = v = combine(0.0, r, 0.0, r)
+            rho = alpha = omega = 1.0
+        rho_next = dot(r_hat, r)
+        if not rho_next:
+            r_hat = None
+            continue
+        p = combine(1.0, r, (rho_next / rho) * (alpha / omega), combine(1.0, p, -omega, v))
+        v = matvec(p)
+        projected = dot(r_hat, v)
+        if not projected:
+            r_hat = None
+            continue
+        alpha = rho_next / projected
+        s = combine(1.0, r, -alpha, v)
+        if dot(s, s) <= limit:
+            return list(combine(1.0, x, alpha, p)), True
+        t = matvec(s)
+        omega = dot(t, s) / dot(t, t)
+        x = combine(1.0, combine(1.0, x, alpha, p), omega, s)
+        r = combine(1.0, s, -omega, t)
+        rho = rho_next
+        if not omega:
+            r_hat = None
+    return list(x), dot(r, r) <= limit
+
+def random_reader(edges, degree, component, components, cyclic, start=0):
+    """Expected visits and visit probability per scene for a uniformly random reader.
+
+    Returns (visits, probability, outcome totals, approximate). visits is inf for
+    scenes in a cycle the reader can never leave; probability is None where a
+    cycle was too large to solve exactly.
+    """
+    count = len(edges)
+    inflow = [0.0] * count
+    visits = [0.0] * count
+    probability = [0.0] * count
+    outcome = { "ending": 0.0, "broken_link": 0.0, "trapped": 0.0 }
+    approximate = False
+    if not edges:
+        return visits, probability, outcome, approximate
+    inflow[start] = 1.0
+
+    for cid, members in enumerate(components):
+        arriving = sum(inflow[m] for m in members)
+        if not arriving:
+            continue
+
+        if not cyclic[cid]:
+            node = members[0]
+            visits[node] = probability[node] = inflow[node]
+        else:
+            local = { node: i for i, node in enumerate(members) }
+            internal = []
+            leaks = False
+            for node in members:
+                for target in edges[node]:
+                    if component[target] == cid:
+                        internal.append((local[node], local[target], 1.0 / degree[node]))
+                    else:
+                        leaks = True
+                leaks = leaks or len(edges[node]) < degree[node]
+
+            if not leaks:
+                # A closed loop: once inside, the reader sees all of it, forever
+                outcome["trapped"] += arriving
+                for node in members:
+                    visits[node] = float("inf")
+                    probability[node] = arriving
+                continue
+
+            b = [inflow[node] for node in members]
+            if len(members) <= DENSE_COMPONENT_LIMIT:
+                solved, reached = _solve_dense(b, internal, len(members))
+            else:
+                solved, converged = _solve_sparse(b, internal, len(members))
+                reached = [None] * len(members)
+                approximate = approximate or not converged
+            for i, node in enumerate(members):
+                visits[node] = solved[i]
+                probability[node] = reached[i] if reached[i] is None else min(1.0, reached[i])
+
+        # Push the mass leaving these scenes onward
+        for node in members:
+            if not degree[node]:
+                outcome["ending"] += visits[node]
+                continue
+            share = visits[node] / degree[node]
+            for target in edges[node]:
+                if component[target] != cid:
+                    inflow[target] += share
+            outcome["broken_link"] += share * (degree[node] - len(edges[node]))
+
+    return visits, probability, outcome, approximate
+
+
+# ==========================================
+# REPORT
+# ==========================================
+
+def _number(value, digits=6):
+    if value is None:
+        return None
+    if value == float("inf"):
+        return UNBOUNDED
+    return round(value, digits)
+
+def analyze_story(story_data, start=0):
+    """Build the analytics report (a JSON-ready dict) for a parsed story."""
+    graph = Converter.StoryGraph(story_data)
+    titles, edges = graph.titles, graph.edges
+    degree = [len(story_data[title].choices) for title in titles]
+    component, components = strongly_connected_components(edges)
+    cyclic = [len(members) > 1 or members[0] in edges[members[0]] for members in components]
+
+    depth, bfs_parent = shortest_routes(edges, start)
+    paths, longest, long_parent = count_routes(edges, components, cyclic, start)
+    visits, probability, outcome, approximate = random_reader(edges, degree, component, components, cyclic, start)
+
+    endings = []
+    for node, title in enumerate(titles):
+        if degree[node]:
+            continue
+        entry = { "title": title, "paths": UNBOUNDED if paths[node] is None else paths[node],
+                  "probability": _number(visits[node]) }
+        if depth[node] is None:
+            entry["shortest"] = entry["longest"] = None
+        else:
+            entry["shortest"] = { "choices": depth[node], "route": route_to(node, bfs_parent, titles) }
+            entry["longest"] = UNBOUNDED if longest[node] is None else \
+                { "choices": longest[node], "route": route_to(node, long_parent, titles) }
+        endings.append(entry)
+
+    reachable = [node for node in range(len(titles)) if depth[node] is not None]
+    ending_paths = [paths[node] for node in reachable if not degree[node]]
+    expected_read = sum(visits[node] for node in reachable)
+
+    return {
+        "scenes": len(titles),
+        "choices": sum(degree),
+        "reachable_scenes": len(reachable),
+        "endings": len(endings),
+        "components": {
+            "count": len(components),
+            "cyclic": sum(cyclic),
+            "largest": max((len(members) for members in components), default=0),
+        },
+        "playthroughs": UNBOUNDED if None in ending_paths else sum(ending_paths),
+        "random_reader": {
+            "ending_probability": _number(outcome["ending"]),
+            "broken_link_probability": _number(outcome["broken_link"]),
+            "trapped_probability": _number(outcome["trapped"]),
+            "expected_scenes_read": _number(expected_read),
+            "approximate": approximate,
+        },
+        "ending_routes": endings,
+        "scene_stats": [
+            {
+                "title": title,
+                "depth": depth[node],
+                "paths": UNBOUNDED if paths[node] is None else paths[node],
+                "expected_visits": _number(visits[node]),
+                "visit_probability": _number(probability[node]),
+                "component": component[node],
+            }
+            for node, title in enumerate(titles)
+        ],
+    }
+
+def analytics_path(output_filename):
+    return os.path.splitext(output_filename)[0] + ".analytics.json"
+
+def write_report(report, filename):
+    with open(filename, "w", encoding="utf-8") as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+
+def summarize(report, limit=10):
+    """Console summary of a report (the JSON file has everything)."""
+    reader = report["random_reader"]
+    lines = [
+        f"Scenes: {report['scenes']} ({report['reachable_scenes']} reachable), choices: {report['choices']}, "
+        f"cycles: {report['components']['cyclic']} (largest component: {report['components']['largest']} scene(s))",
+        f"Playthroughs: {report['playthroughs']:,}" if report["playthroughs"] != UNBOUNDED
+        else f"Playthroughs: {UNBOUNDED} (some endings can be reached through a loop)",
+        f"Random reader: ending {reader['ending_probability']:.1%}, broken link {reader['broken_link_probability']:.1%}, "
+        f"stuck in a loop {reader['trapped_probability']:.1%}, expected scenes read {reader['expected_scenes_read']}"
+        + (" (approximate)" if reader["approximate"] else ""),
+    ]
+    endings = sorted(report["ending_routes"], key=lambda e: -(e["probability"] or 0))
+    if endings:
+        lines.append(f"Endings ({len(endings)}, most likely first):")
+    for entry in endings[:limit]:
+        shortest = entry["shortest"]["choices"] if entry["shortest"] else "-"
+        longest = entry["longest"]["choices"] if isinstance(entry["longest"], dict) else entry["longest"] or "-"
+        lines.append(f"  {entry['probability']:>7.2%}  {entry['title']}  "
+                     f"(routes: {entry['paths']}, shortest: {shortest}, longest: {longest})")
+    if len(endings) > limit:
+        lines.append(f"  ... and {len(endings) - limit} more")
+    return lines
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Count playthroughs, routes and visit probabilities of a story.")
+    parser.add_argument("input", nargs="?", default=Converter.INPUT_FILENAME,
+                        help=f"source .docx (default: {Converter.INPUT_FILENAME})")
+    parser.add_argument("-o", "--output", help="report file to write (default: <input>.analytics.json)")
+    parser.add_argument("--no-cache", action="store_true", help="re-parse every scene and do not touch the parse cache")
+    verbosity = parser.add_mutually_exclusive_group()
+    verbosity.add_argument("-q", "--quiet", action="store_true", help="only print warnings and errors")
+    verbosity.add_argument("-v", "--verbose", action="store_true", help="list every scene while parsing")
+    args = parser.parse_args(argv)
+
+    Converter.VERBOSITY = Converter.QUIET if args.quiet else Converter.VERBOSE if args.verbose else Converter.NORMAL
+    cache = None if args.no_cache else Converter.ParseCache(args.input)
+    story = Converter.parse_docx(args.input, cache=cache)
+    if not story:
+        return 1
+
+    report = analyze_story(story)
+    output = args.output or analytics_path(args.input)
+    write_report(report, output)
+    for line in summarize(report):
+        Converter.log(line)
+    Converter.log(f"Report saved to {output}")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,36 @@
+import os
+import sys
+import zipfile
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, "benchmarks"))
+
+import Converter  # noqa: E402
+import synthetic_docx  # noqa: E402
+
+
+def write_story(filename, scenes):
+    """Write a .docx from [(title, [paragraph, ...]), ...]."""
+    paragraphs = []
+    for title, lines in scenes:
+        paragraphs.append(synthetic_docx._paragraph_xml(title, "Heading1", 1, None))
+        paragraphs.extend(synthetic_docx._paragraph_xml(line, None, 1, None) for line in lines)
+    with zipfile.ZipFile(filename, "w") as zf:
+        zf.writestr("[Content_Types].xml", synthetic_docx.CONTENT_TYPES)
+        zf.writestr("_rels/.rels", synthetic_docx.PACKAGE_RELS)
+        zf.writestr("word/_rels/document.xml.rels", synthetic_docx.DOCUMENT_RELS)
+        zf.writestr("word/styles.xml", synthetic_docx.STYLES)
+        zf.writestr("word/document.xml", synthetic_docx.DOCUMENT_HEAD + "".join(paragraphs)
+                    + synthetic_docx.DOCUMENT_TAIL)
+    return filename
+
+
+@pytest.fixture(autouse=True)
+def quiet():
+    verbosity = Converter.VERBOSITY
+    Converter.VERBOSITY = Converter.QUIET
+    yield
+    Converter.VERBOSITY = verbosity
@@ -0,0 +1,79 @@
+// Just enough of a browser to run a generated player page in node (see
+// test_story_code.py). Sidecar shard scripts are only loaded when the test
+// calls finishScripts(), so it can act while a shard is still loading.
+const fs = require('fs');
+const path = require('path');
+const vm = require('vm');
+
+function element(tag) {
+    return {
+        tag, children: [], style: { setProperty() {} }, dataset: {}, className: '', innerText: '', _html: '',
+        classList: { add() {}, remove() {}, toggle() {}, contains() { return false; } },
+        scrollTop: 0, clientHeight: 500, offsetHeight: 0,
+        get innerHTML() { return this._html; },
+        set innerHTML(html) { this._html = html; this.children = []; },
+        get textContent() { return this._html; },
+        set textContent(text) { this._html = text; },
+        // Markup set through innerHTML counts as a single node
+        get childNodes() { return [...(this._html ? [{ html: this._html }] : []), ...this.children]; },
+        appendChild(child) { this.children.push(child); return child; },
+        append(...nodes) { this.children.push(...nodes); },
+        replaceChildren(...nodes) { this.children = nodes; this._html = ''; },
+        insertAdjacentHTML(position, html) { this._html += html; },
+        querySelectorAll() { return []; },
+        querySelector() { return null; },
+        addEventListener() {}, removeEventListener() {}, setAttribute() {}, remove() {}, focus() {},
+    };
+}
+
+function loadPage(file) {
+    const folder = path.dirname(file);
+    const html = fs.readFileSync(file, 'utf8');
+    const elements = {};
+    const pendingScripts = [];
+    const storage = {};
+
+    global.window = global;
+    global.document = {
+        documentElement: element('html'),
+        body: element('body'),
+        head: { appendChild(script) { pendingScripts.push(script); return script; } },
+        getElementById(id) { return elements[id] || (elements[id] = element(id)); },
+        createElement: element,
+        getElementsByTagName() { return []; },
+        addEventListener() {},
+    };
+    global.localStorage = {
+        getItem(key) { return key in storage ? storage[key] : null; },
+        setItem(key, value) { storage[key] = String(value); },
+        removeItem(key) { delete storage[key]; },
+    };
+    global.location = { search: '', protocol: 'file:', href: 'file://' + file };
+    global.navigator = {};
+    global.requestAnimationFrame = (callback) => setTimeout(() => callback(Date.now()), 0);
+    global.requestIdleCallback = () => 0; // No prefetching: shards load when a test says so
+
+    for (const match of html.matchAll(/<script>([\s\S]*?)<\/script>/g)) vm.runInThisContext(match[1]);
+
+    return {
+        elements,
+        pendingScripts,
+        // Run (or fail) the shard scripts requested so far, then let promises settle
+        async finishScripts(ok = true) {
+            for (const script of pendingScripts.splice(0)) {
+                if (ok) {
+                    vm.runInThisContext(fs.readFileSync(path.join(folder, decodeURIComponent(script.src)), 'utf8'));
+                    script.onload();
+                } else {
+                    script.onerror();
+                }
+            }
+            await new Promise((resolve) => setTimeout(resolve, 0));
+        },
+        choice(label) {
+            return elements['choices-container'].children.find((node) => node.innerText === label);
+        },
+    };
+}
+
+module.exports = { loadPage };
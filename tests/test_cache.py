@@ -0,0 +1,37 @@
+import Converter
+from conftest import write_story
+
+
+def test_rich_and_plain_builds_keep_their_own_cache(tmp_path):
+    source = write_story(str(tmp_path / "Story.docx"), [("Start", ["Some text.", "[On -> End]"]), ("End", ["Bye."])])
+    output = str(tmp_path / "Story.html")
+    for rich_text in (False, True):
+        assert Converter.convert_file(source, output, rich_text=rich_text)
+
+    for rich_text in (False, True):
+        cache = Converter.ParseCache(source, rich_text=rich_text)
+        assert Converter.parse_docx(source, cache=cache, rich_text=rich_text)
+        assert cache.source_hit
+    assert Converter.ParseCache(source).path != Converter.ParseCache(source, rich_text=True).path
+
+
+def test_cached_sections_repeat_their_warnings(tmp_path, capsys):
+    source = write_story(str(tmp_path / "Story.docx"), [
+        ("Start", ["[Pay -> End {if gold >=}]", "[Take -> End {set gold += }]"]),
+        ("End", ["Bye."]),
+    ])
+    output = str(tmp_path / "Story.html")
+    warnings = []
+    for _ in range(2):
+        assert Converter.convert_file(source, output)
+        warnings.append([line for line in capsys.readouterr().out.splitlines() if "Invalid {" in line])
+    assert len(warnings[0]) == 2
+    assert warnings[1] == warnings[0]
+
+    # Only the untouched section comes from the cache when another one is edited
+    write_story(source, [
+        ("Start", ["[Pay -> End {if gold >=}]", "[Take -> End {set gold += }]"]),
+        ("End", ["Goodbye."]),
+    ])
+    assert Converter.convert_file(source, output)
+    assert [line for line in capsys.readouterr().out.splitlines() if "Invalid {" in line] == warnings[0]
@@ -0,0 +1,66 @@
+import random
+import zipfile
+
+import pytest
+
+import Converter
+import synthetic_docx
+
+
+def write_edge_cases(filename, scenes=300, seed=5):
+    """Headings that do not start a section (empty, duplicated, inside tables),
+    text before the first heading, bad metadata and formatted runs."""
+    rng = random.Random(seed)
+    paragraph = synthetic_docx._paragraph_xml
+    body = [paragraph("Preface text before any heading")]
+    for index in range(scenes):
+        kind = rng.random()
+        if kind < 0.1:
+            body.append(paragraph("   ", "Heading1"))
+        elif kind < 0.2:
+            body.append("<w:tbl><w:tr><w:tc>" + paragraph(f"Table heading {index}", "Heading1") + "</w:tc></w:tr></w:tbl>")
+        elif kind < 0.25:
+            body.append(paragraph("Dup", "Heading1"))
+        else:
+            body.append(paragraph(f"Scene {index}", "Heading1"))
+        if rng.random() < 0.3:
+            body.append(paragraph("METADATA: color=#zz0000, icon=X"))
+        for line in range(rng.randint(0, 3)):
+            body.append(paragraph(f"Text {index}.{line} with a bold stretch", None, 4, rng, "<w:b/>"))
+        body.append(paragraph(f"[Go -> Scene {rng.randrange(scenes)} {{if visits > {index % 3}}}]"))
+    with zipfile.ZipFile(filename, "w") as zf:
+        zf.writestr("[Content_Types].xml", synthetic_docx.CONTENT_TYPES)
+        zf.writestr("_rels/.rels", synthetic_docx.PACKAGE_RELS)
+        zf.writestr("word/_rels/document.xml.rels", synthetic_docx.DOCUMENT_RELS)
+        zf.writestr("word/styles.xml", synthetic_docx.STYLES)
+        zf.writestr("word/document.xml", synthetic_docx.DOCUMENT_HEAD + "".join(body) + synthetic_docx.DOCUMENT_TAIL)
+
+
+def parse(filename, capsys, rich_text, workers):
+    story = Converter.parse_docx(filename, rich_text=rich_text, workers=workers)
+    output = capsys.readouterr().out
+    return [(title, scene.record()) for title, scene in story.items()], output
+
+
+@pytest.fixture
+def small_ranges(monkeypatch):
+    # Split even small test documents, into more ranges than there are workers
+    monkeypatch.setattr(Converter, "PARALLEL_PARSE_MIN_BYTES", 0)
+
+
+@pytest.mark.parametrize("rich_text", [False, True])
+@pytest.mark.parametrize("writer", ["synthetic", "edge-cases"])
+def test_parallel_parse_matches_sequential(tmp_path, capsys, small_ranges, rich_text, writer):
+    source = str(tmp_path / "Story.docx")
+    if writer == "synthetic":
+        synthetic_docx.write_docx(source, scenes=400, paragraphs=3, choices=2, text="mixed", metadata=0.3,
+                                  formatted=0.5)
+    else:
+        write_edge_cases(source)
+
+    assert Converter.parse_ranges(source, 3, rich_text) is not None  # Really took the parallel path
+    capsys.readouterr()
+    sequential = parse(source, capsys, rich_text, workers=1)
+    parallel = parse(source, capsys, rich_text, workers=3)
+    assert parallel[0] == sequential[0]
+    assert parallel[1] == sequential[1]  # Same warnings, in the same order
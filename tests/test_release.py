@@ -0,0 +1,80 @@
+import gzip
+import os
+import re
+import shutil
+import subprocess
+
+import pytest
+
+import Converter
+from conftest import write_story
+
+SCENES = [("Start", ["Hello.", "[On -> End]"]), ("End", ["Bye."])]
+
+
+def gz_matches(filename):
+    with open(filename, "rb") as f, gzip.open(filename + ".gz") as g:
+        return f.read() == g.read()
+
+
+@pytest.mark.parametrize("payload", ["inline", "site"])
+def test_compressed_copies_follow_the_page(tmp_path, payload):
+    source = write_story(str(tmp_path / "Story.docx"), SCENES)
+    output = str(tmp_path / "index.html")
+    Converter.convert_file(source, output, use_cache=False, payload=payload, release=True)
+    assert gz_matches(output)
+
+    # Unchanged rebuild: the copy is left alone
+    mtime = os.stat(output + ".gz").st_mtime_ns
+    os.utime(output + ".gz", ns=(mtime - 10**9, mtime - 10**9))
+    Converter.convert_file(source, output, use_cache=False, payload=payload, release=True)
+    assert os.stat(output + ".gz").st_mtime_ns == mtime - 10**9
+
+    # A debug build must not leave the release copy behind
+    Converter.convert_file(source, output, use_cache=False, payload=payload)
+    assert not os.path.exists(output + ".gz")
+    assert not os.path.exists(output + ".br")
+
+
+JS_SAMPLE = r"""
+const slashes = /\/\/+/g; // a comment after a regex with //
+const url = "http://example.com/a//b".replace(slashes, "/"); /* block */
+const inClass = "a/b".split(/[/]/).length;
+const templated = `//${ "//" + url }`;
+const divided = 12 / 2 / 3;
+const nested = [1, 2].map((n) => n / 2).filter((n) => n > 0.5);
+"""
+
+
+def run_js(source):
+    script = source + "\nconsole.log(JSON.stringify([url, inClass, templated, divided, nested]));"
+    return subprocess.run(["node", "-e", script], capture_output=True, text=True, check=True).stdout
+
+
+def test_minify_js_keeps_literals_with_slashes():
+    minified = Converter.minify_js(JS_SAMPLE)
+    for literal in (r"/\/\/+/g", '"http://example.com/a//b"', "/[/]/", '`//${ "//" + url }`'):
+        assert literal in minified
+    assert "comment" not in minified and "block" not in minified
+    assert "12/2/3" in minified
+
+
+@pytest.mark.skipif(shutil.which("node") is None, reason="needs node")
+def test_minified_js_runs_the_same():
+    assert run_js(Converter.minify_js(JS_SAMPLE)) == run_js(JS_SAMPLE)
+
+
+@pytest.mark.skipif(shutil.which("node") is None, reason="needs node")
+def test_release_template_scripts_parse(tmp_path):
+    scripts = re.findall(r"<script>(.*?)</script>", Converter.release_template(), re.DOTALL)
+    assert scripts
+    for index, script in enumerate(scripts):
+        path = tmp_path / f"player-{index}.js"
+        path.write_text(script, encoding="utf-8")
+        result = subprocess.run(["node", "--check", str(path)], capture_output=True, text=True)
+        assert result.returncode == 0, result.stderr
+
+
+def test_minify_css_keeps_selectors():
+    css = "/* note */\n#a:hover > .b,\n.c  { color: red;  margin: 0 auto; }\n@media (max-width: 600px) { .d { top: 0; } }"
+    assert Converter.minify_css(css) == "#a:hover>.b,.c{color:red;margin:0 auto}@media (max-width: 600px){.d{top:0}}"
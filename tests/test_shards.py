@@ -0,0 +1,85 @@
+import os
+
+import pytest
+
+import Converter
+from conftest import write_story
+
+
+def story(extra_choices=0):
+    scenes = []
+    for index in range(30):
+        lines = [f"Scene {index} text.", "METADATA: icon=🏰, color=#336699"]
+        lines += [f"[Onward -> S{(index + 1) % 30}]", "[Go back -> S0]"] if index % 2 else [f"[Onward -> S{(index + 1) % 30}]"]
+        scenes.append((f"S{index}", lines))
+    # Makes "Go back" the most repeated string, ahead of the icon, color and "Onward"
+    scenes[7][1].extend(["[Go back -> S0]"] * extra_choices)
+    return scenes
+
+
+def shard_files(folder):
+    files = {}
+    for name in os.listdir(folder):
+        with open(os.path.join(folder, name), encoding="utf-8") as f:
+            files[name] = f.read()
+    return files
+
+
+@pytest.mark.parametrize("payload", ["site", "sidecar"])
+def test_editing_one_scene_changes_one_shard(tmp_path, payload):
+    source = str(tmp_path / "Story.docx")
+    output = str(tmp_path / "index.html")
+    folder = (os.path.join(Converter.site_assets_dir(output), "scenes") if payload == "site"
+              else Converter.sidecar_dir(output))
+
+    write_story(source, story())
+    assert Converter.convert_file(source, output, use_cache=False, payload=payload, release=True)
+    before = shard_files(folder)
+    write_story(source, story(extra_choices=40))
+    assert Converter.convert_file(source, output, use_cache=False, payload=payload, release=True)
+    after = shard_files(folder)
+
+    if payload == "sidecar":
+        assert {name for name in after if after[name] != before.get(name)} == {"scene-7.js"}
+    else:
+        # Content-hashed names: scene 7's file is replaced, every other one is kept
+        assert len(before.keys() - after.keys()) == 1
+        assert len(after.keys() - before.keys()) == 1
+        assert '"S7"' in after[(after.keys() - before.keys()).pop()]
+
+
+def test_inserting_a_scene_keeps_the_other_site_shards(tmp_path):
+    source = str(tmp_path / "Story.docx")
+    output = str(tmp_path / "index.html")
+    folder = os.path.join(Converter.site_assets_dir(output), "scenes")
+    scenes = story()
+    scenes[3][1].append("[Bribe -> S5 {if gold > 2} {set gold -= 2}]")
+
+    write_story(source, scenes)
+    Converter.convert_file(source, output, use_cache=False, payload="site", release=True)
+    before = shard_files(folder)
+    # A new first scene that also introduces a variable, which renumbers the others
+    write_story(source, [("Prologue", ["[Begin -> S0 {set luck = 1}]"])] + scenes)
+    Converter.convert_file(source, output, use_cache=False, payload="site", release=True)
+    after = shard_files(folder)
+
+    assert before.keys() < after.keys()
+    assert len(after) == len(before) + 1
+
+
+def test_single_file_pages_still_share_strings(tmp_path):
+    source = write_story(str(tmp_path / "Story.docx"), story())
+    table = Converter.build_story_table(Converter.parse_docx(source))
+    assert Converter.intern_story_strings(table) > 0
+    assert "Go back" in table["strings"]
+
+
+def test_sidecar_urls_are_quoted(tmp_path):
+    source = write_story(str(tmp_path / "Story.docx"), story())
+    output = str(tmp_path / "Part #1? 100%.html")
+    assert Converter.convert_file(source, output, use_cache=False, payload="sidecar", search=True)
+    with open(output, encoding="utf-8") as f:
+        page = f.read()
+    assert '"shardPath": "Part%20%231%3F%20100%25_scenes"' in page
+    assert '"searchIndex": "Part%20%231%3F%20100%25_scenes/search-index.js"' in page
+    assert os.path.exists(os.path.join(Converter.sidecar_dir(output), "scene-0.js"))
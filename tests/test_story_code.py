@@ -0,0 +1,207 @@
+import json
+import os
+import re
+import shutil
+import subprocess
+
+import pytest
+
+import Converter
+from Converter import (OP_ADD, OP_AND, OP_CONST, OP_EQ, OP_GE, OP_LOAD, OP_NEG, OP_NOT, OP_OR, OP_STORE, OP_SUB,
+                       compile_condition, compile_effects, link_code, parse_choice)
+from conftest import write_story
+
+
+def run(code, variables):
+    """Python reading of the bytecode, as runStoryCode() in the player runs it."""
+    stack = []
+    binary = {
+        OP_ADD: lambda a, b: a + b, OP_SUB: lambda a, b: a - b,
+        OP_EQ: lambda a, b: int(a == b), Converter.OP_NE: lambda a, b: int(a != b),
+        Converter.OP_LT: lambda a, b: int(a < b), Converter.OP_LE: lambda a, b: int(a <= b),
+        Converter.OP_GT: lambda a, b: int(a > b), OP_GE: lambda a, b: int(a >= b),
+        OP_AND: lambda a, b: int(bool(a and b)), OP_OR: lambda a, b: int(bool(a or b)),
+    }
+    for op, operand in Converter.iter_code(code):
+        if op == OP_CONST:
+            stack.append(operand)
+        elif op == OP_LOAD:
+            stack.append(variables.get(operand, 0))
+        elif op == OP_STORE:
+            variables[operand] = stack.pop()
+        elif op == OP_NOT:
+            stack.append(int(not stack.pop()))
+        elif op == OP_NEG:
+            stack.append(-stack.pop())
+        else:
+            b, a = stack.pop(), stack.pop()
+            stack.append(binary[op](a, b))
+    return stack[-1] if stack else 0
+
+
+def test_not_binds_looser_than_comparison():
+    assert compile_condition("not a >= 5") == [OP_LOAD, "a", OP_CONST, 5, OP_GE, OP_NOT]
+    assert run(compile_condition("not a >= 5"), { "a": 3 }) == 1
+    assert run(compile_condition("not a >= 5"), { "a": 7 }) == 0
+
+
+def test_and_binds_tighter_than_or():
+    assert compile_condition("a or b and c") == [OP_LOAD, "a", OP_LOAD, "b", OP_LOAD, "c", OP_AND, OP_OR]
+    assert compile_condition("(a or b) and c") == [OP_LOAD, "a", OP_LOAD, "b", OP_OR, OP_LOAD, "c", OP_AND]
+
+
+def test_subtraction_is_left_associative():
+    assert compile_condition("a - b - c") == [OP_LOAD, "a", OP_LOAD, "b", OP_SUB, OP_LOAD, "c", OP_SUB]
+    assert run(compile_condition("a - b - c"), { "a": 10, "b": 3, "c": 2 }) == 5
+
+
+@pytest.mark.parametrize("source, variables, expected", [
+    ("gold >= 5 and not banned", { "gold": 5 }, 1),
+    ("gold >= 5 and not banned", { "gold": 5, "banned": 1 }, 0),
+    ("-x + 2 - -1 ≥ 0", { "x": 3 }, 1),
+    ("a != -1", { "a": -1 }, 0),
+    ("a = 2", { "a": 2 }, 1),
+    ("!a || b", {}, 1),
+    ("TRUE and not false", {}, 1),
+    ("Gold > 3", { "gold": 4 }, 1),
+    ("金币 ≠ 0", { "金币": 1 }, 1),
+])
+def test_conditions(source, variables, expected):
+    assert run(compile_condition(source), dict(variables)) == expected
+
+
+def test_effects():
+    assert compile_effects("x") == [OP_CONST, 1, OP_STORE, "x"]
+    assert compile_effects("not x") == [OP_CONST, 0, OP_STORE, "x"]
+    assert compile_effects("x += 2") == [OP_LOAD, "x", OP_CONST, 2, OP_ADD, OP_STORE, "x"]
+    assert compile_effects("x -= 2") == [OP_LOAD, "x", OP_CONST, 2, OP_SUB, OP_STORE, "x"]
+
+    variables = { "gold": 7 }
+    run(compile_effects("gold -= 5, bribed; Key = true，钥匙；not door"), variables)
+    assert variables == { "gold": 2, "bribed": 1, "key": 1, "钥匙": 1, "door": 0 }
+
+
+@pytest.mark.parametrize("source, message", [
+    ("", "expected a value at the end"),
+    ("gold >> 5", "expected a variable name before '>'"),
+    ("a == b == c", "unexpected '=='"),
+    ("(a", "expected ')' at the end"),
+    ("a b", "unexpected 'b'"),
+])
+def test_condition_errors(source, message):
+    with pytest.raises(ValueError, match=re.escape(message)):
+        compile_condition(source)
+
+
+@pytest.mark.parametrize("source, message", [
+    ("x += ", "expected a value at the end"),
+    ("x++", "expected '=' or '+=' or '-=' before '+'"),
+    ("3 = x", "expected a variable name before '3'"),
+])
+def test_effect_errors(source, message):
+    with pytest.raises(ValueError, match=re.escape(message)):
+        compile_effects(source)
+
+
+def test_link_code_numbers_variables_in_order_of_first_use():
+    variables = {}
+    condition = link_code(compile_condition("b > a"), variables)
+    effects = link_code(compile_effects("a += 3, c"), variables)
+    assert variables == { "b": 0, "a": 1, "c": 2 }
+    assert condition == [OP_LOAD, 0, OP_LOAD, 1, Converter.OP_GT]
+    assert effects == [OP_LOAD, 1, OP_CONST, 3, OP_ADD, OP_STORE, 1, OP_CONST, 1, OP_STORE, 2]
+
+
+def test_parse_choice_clauses():
+    assert parse_choice("Go", "Gate", "S") == ("Go", "Gate")
+    assert parse_choice("Go", "Gate {weird}", "S") == ("Go", "Gate {weird}")
+    assert parse_choice("Pay", "Gate {if gold >= 5} {set gold -= 5}", "S") == (
+        "Pay", "Gate", compile_condition("gold >= 5"), compile_effects("gold -= 5"))
+    # Full-width braces; several {if} clauses must all hold
+    assert parse_choice("Go", "Gate｛if a｝ {if b}｛set 钥匙｝", "S") == (
+        "Go", "Gate", [OP_LOAD, "a", OP_LOAD, "b", OP_AND], compile_effects("钥匙"))
+
+
+def test_unreadable_condition_hides_the_choice(capsys):
+    Converter.VERBOSITY = Converter.NORMAL
+    assert parse_choice("Pay", "Gate {if gold >> 5}", "S") == ("Pay", "Gate", [OP_CONST, 0], None)
+    assert "The choice stays hidden" in capsys.readouterr().out
+    assert parse_choice("Pay", "Gate {if a} {set x+}", "S") == ("Pay", "Gate", [OP_LOAD, "a"], None)
+    assert "Skipping it" in capsys.readouterr().out
+
+
+@pytest.mark.skipif(shutil.which("node") is None, reason="needs node")
+def test_player_runs_the_bytecode_like_the_reference():
+    player = re.search(r"\n( *)function runStoryCode\(code\) \{.*?\n\1\}", Converter.HTML_TEMPLATE, re.DOTALL).group(0)
+    cases = []
+    for source, variables in [("gold >= 5 and not banned", { "gold": 6 }), ("-x + 2 - -1 ≥ 0", { "x": 4 }),
+                              ("a - b - c", { "a": 1, "b": 2, "c": 3 }), ("not a >= 5 or b", { "a": 9 }),
+                              ("(a or b) and c != 0", { "b": 2, "c": 1 }), ("a <= b and a < b", { "b": 1 })]:
+        names = {}
+        code = link_code(compile_condition(source), names)
+        effects = link_code(compile_effects("a += 2, b -= 1, not c"), names)
+        values = [variables.get(name, 0) for name in names]
+        expected_vars = dict(variables)
+        expected = run(compile_condition(source), expected_vars)
+        run(compile_effects("a += 2, b -= 1, not c"), expected_vars)
+        cases.append([code, effects, values, [expected, [expected_vars.get(name, 0) for name in names]]])
+
+    script = (f"let storyVars = [];{player}\n"
+              f"for (const [code, effects, values, expected] of {json.dumps(cases)}) {{\n"
+              "  storyVars = values; const result = runStoryCode(code); runStoryCode(effects);\n"
+              "  console.log(JSON.stringify([result, storyVars]) === JSON.stringify(expected));\n"
+              "}\n")
+    output = subprocess.run(["node", "-e", script], capture_output=True, text=True, check=True).stdout.split()
+    assert output == ["true"] * len(cases)
+
+
+CLICK_SCENARIO = """
+const page = require(process.argv[1]).loadPage(process.argv[2]);
+const log = (step) => console.log(JSON.stringify([step, currentSceneId, storyStateByName()]));
+(async () => {
+    await page.finishScripts();
+    log('start');
+    // Clicked three times while the target's shard loads: the effect runs once
+    const earn = page.choice('Earn gold');
+    earn.onclick(); earn.onclick(); earn.onclick();
+    log('loading');
+    await page.finishScripts();
+    log('market');
+
+    page.choice('Back').onclick();
+    await page.finishScripts();
+    page.choice('Go to the gate').onclick();
+    await page.finishScripts();
+    // The shard cannot be loaded: the reader stays, and so does the gold
+    page.choice('Pay the guard').onclick();
+    await page.finishScripts(false);
+    log('failed');
+    page.choice('Pay the guard').onclick();
+    await page.finishScripts();
+    log('paid');
+    process.exit(0);
+})().catch((e) => { console.error(e); process.exit(1); });
+"""
+
+
+@pytest.mark.skipif(shutil.which("node") is None, reason="needs node")
+def test_effects_run_once_the_target_scene_is_shown(tmp_path):
+    source = write_story(str(tmp_path / "Story.docx"), [
+        ("Start", ["[Earn gold -> Market {set gold += 3}]", "[Go to the gate -> Gate]"]),
+        ("Market", ["[Back -> Start]"]),
+        ("Gate", ["[Pay the guard -> Beyond {set gold -= 5, bribed}]"]),
+        ("Beyond", ["The end."]),
+    ])
+    output = str(tmp_path / "Story.html")
+    assert Converter.convert_file(source, output, use_cache=False, payload="sidecar")
+
+    fake_dom = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fake_dom.js")
+    result = subprocess.run(["node", "-e", CLICK_SCENARIO, fake_dom, output], capture_output=True, text=True)
+    assert result.returncode == 0, result.stderr
+    assert [json.loads(line) for line in result.stdout.splitlines()] == [
+        ["start", "Start", {}],
+        ["loading", "Start", {}],
+        ["market", "Market", { "gold": 3 }],
+        ["failed", "Gate", { "gold": 3 }],
+        ["paid", "Beyond", { "gold": -2, "bribed": 1 }],
+    ]